@@ -0,0 +1,232 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic_corpus import generate_corpus
+
+STAGES = ['read_data', 'get_performance_differences', 'calculate_bias', 'simulation']
+
+
+def run_stages(fpm, writer, measure):
+    """
+    Run the pipeline stages under benchmark, from reading the output files up to the weight simulations.
+
+    :param fpm: FilepathManager of the corpus.
+    :param writer: ResultsWriter to write the results with.
+    :param measure: Function called with the name and a callable of every stage, returning the result of the callable.
+    """
+    from src.asr_output_data import AsrOutputData
+    from src.bias_calculation import get_performance_differences, calculate_weighted_performance_bias, \
+        calculate_overall_weighted_performance_bias, calculate_intergroup_weighted_performance_bias, \
+        calculate_overall_intergroup_weighted_performance_bias, sweep_weights, get_optimal_weights
+    from src.process import read_data
+
+    result_per_group_df, result_per_speaker_df = {}, {}
+    measure('read_data', lambda: read_data(AsrOutputData(fpm), fpm, result_per_group_df, result_per_speaker_df))
+
+    performance_differences_abs, _ = measure('get_performance_differences', lambda: get_performance_differences(
+        result_per_group_df, fpm, writer=writer))
+
+    measure('calculate_bias', lambda: (
+        calculate_weighted_performance_bias(performance_differences_abs, 0.5, 0.5, writer),
+        calculate_overall_weighted_performance_bias(performance_differences_abs, 0.5, 0.5, fpm, writer),
+        calculate_intergroup_weighted_performance_bias(performance_differences_abs, 0.5, 0.5, writer),
+        calculate_overall_intergroup_weighted_performance_bias(performance_differences_abs, 0.5, 0.5, fpm, writer),
+    ))
+
+    measure('simulation', lambda: [(sweep_weights(performance_differences_abs, np.linspace(0, 1, 100), metric),
+                                    get_optimal_weights(performance_differences_abs, metric))
+                                   for metric in ('wpb', 'iwpb')])
+
+
+def benchmark(path, n_models, n_groups, n_speakers, n_styles=2, repeats=3, memory=True, seed=0):
+    """
+    Generate a synthetic corpus and time every pipeline stage on it.
+
+    The stages are run repeats times with a cold cache. Peak memory is measured in a separate run with tracemalloc,
+    so that its overhead does not affect the timings.
+
+    :param path: Directory to generate the corpus and write the results in.
+    :param n_models: Number of ASR models.
+    :param n_groups: Number of speaker groups.
+    :param n_speakers: Total number of speakers.
+    :param n_styles: Number of speaking styles.
+    :param repeats: Number of timed runs.
+    :param memory: Whether to measure the peak memory of every stage.
+    :param seed: Seed of the synthetic corpus.
+    :return: Dictionary with the parameters and, per stage, the wall and CPU times of every run, the median wall
+        time and the peak memory in bytes.
+    """
+    from src.filepath_manager import FilepathManager
+    from src.memo_cache import MemoCache, set_memo_cache
+    from src.results_writer import get_results_writer
+
+    start = time.perf_counter()
+    config_path = generate_corpus(path, n_models, n_groups, n_speakers, n_styles, seed)
+    generation_time = time.perf_counter() - start
+
+    results = {stage: {'wall_time': [], 'cpu_time': []} for stage in STAGES}
+    working_directory = os.getcwd()
+    os.chdir(path)
+
+    try:
+        for run in range(repeats + memory):
+            trace = run == repeats
+            fpm = FilepathManager(config_path)
+            # Start from a cold cache, so every run parses the output files and computes every bias result
+            shutil.rmtree(fpm.get_cache_path(), ignore_errors=True)
+            set_memo_cache(MemoCache())
+
+            def measure(stage, function):
+                if trace:
+                    tracemalloc.start()
+                wall_time, cpu_time = time.perf_counter(), time.process_time()
+
+                result = function()
+
+                if trace:
+                    results[stage]['peak_memory'] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                else:
+                    results[stage]['wall_time'].append(time.perf_counter() - wall_time)
+                    results[stage]['cpu_time'].append(time.process_time() - cpu_time)
+                return result
+
+            run_stages(fpm, get_results_writer(fpm), measure)
+    finally:
+        os.chdir(working_directory)
+
+    for stage_results in results.values():
+        stage_results['median_wall_time'] = statistics.median(stage_results['wall_time']) \
+            if stage_results['wall_time'] else None
+
+    return {
+        'parameters': {'models': n_models, 'groups': n_groups, 'speakers': n_speakers, 'styles': n_styles,
+                       'repeats': repeats, 'seed': seed},
+        'generation_time': generation_time,
+        'stages': results,
+    }
+
+
+def compare(results, baseline, max_slowdown=None):
+    """
+    Print the median wall time of every stage relative to an earlier benchmark with the same parameters.
+
+    :param results: Benchmark results, as written to --output.
+    :param baseline: Benchmark results of an earlier commit.
+    :param max_slowdown: Optional maximum ratio of the median wall times.
+    :return: Whether no stage is slower than max_slowdown.
+    """
+    baseline_runs = {_get_size(run['parameters']): run for run in baseline['runs']}
+    passed = True
+
+    for run in results['runs']:
+        baseline_run = baseline_runs.get(_get_size(run['parameters']))
+        if baseline_run is None:
+            continue
+
+        print(f"Compared to {baseline.get('commit')}, {_describe(run['parameters'])}:")
+        for stage in STAGES:
+            current = run['stages'][stage]['median_wall_time']
+            previous = baseline_run['stages'].get(stage, {}).get('median_wall_time')
+            if not current or not previous:
+                continue
+
+            ratio = current / previous
+            slower = max_slowdown is not None and ratio > max_slowdown
+            passed = passed and not slower
+            print(f"  {stage:<30} {previous:10.4f}s -> {current:10.4f}s  x{ratio:.2f}{'  SLOWER' if slower else ''}")
+
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic corpora. Every combination of "
+                                                 "the given numbers of models, groups and speakers is benchmarked.")
+    parser.add_argument('--models', type=int, nargs='+', default=[5], help="Numbers of ASR models.")
+    parser.add_argument('--groups', type=int, nargs='+', default=[5], help="Numbers of speaker groups.")
+    parser.add_argument('--speakers', type=int, nargs='+', default=[1000], help="Total numbers of speakers.")
+    parser.add_argument('--styles', type=int, default=2, help="Number of speaking styles.")
+    parser.add_argument('--repeats', type=int, default=3, help="Number of timed runs per corpus.")
+    parser.add_argument('--no-memory', action='store_true', help="Do not measure the peak memory of the stages.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic corpora.")
+    parser.add_argument('--output', default='benchmark.json', help="JSON file to write the results to.")
+    parser.add_argument('--workdir', help="Directory to generate the corpora in. Defaults to a temporary directory.")
+    parser.add_argument('--compare', help="Results of an earlier benchmark to compare the median wall times with.")
+    parser.add_argument('--max-slowdown', type=float, help="Exit with status 1 if a stage is slower than this "
+                                                           "ratio compared to --compare.")
+    args = parser.parse_args(argv)
+
+    results = {
+        'commit': _get_commit(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'runs': [],
+    }
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        for n_models, n_groups, n_speakers in itertools.product(args.models, args.groups, args.speakers):
+            parameters = {'models': n_models, 'groups': n_groups, 'speakers': n_speakers, 'styles': args.styles}
+            print(f"Benchmarking {_describe(parameters)}...")
+
+            path = os.path.join(workdir, f'{n_models}x{n_groups}x{n_speakers}')
+            run = benchmark(path, n_models, n_groups, n_speakers, args.styles, args.repeats, not args.no_memory,
+                            args.seed)
+            results['runs'].append(run)
+
+            for stage in STAGES:
+                peak_memory = run['stages'][stage].get('peak_memory')
+                print(f"  {stage:<30} {run['stages'][stage]['median_wall_time']:10.4f}s" +
+                      (f"  {peak_memory / 2 ** 20:10.1f} MiB" if peak_memory is not None else ""))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # Peak resident set size of the whole benchmark, in bytes (ru_maxrss is in kilobytes on Linux)
+    results['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    with open(args.output, 'w') as file:
+        file.write(json.dumps(results, indent=4))
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            if not compare(results, json.load(file), args.max_slowdown):
+                return 1
+
+    return 0
+
+
+def _describe(parameters):
+    return (f"{parameters['models']} models, {parameters['groups']} groups, {parameters['speakers']} speakers, "
+            f"{parameters['styles']} speaking styles")
+
+
+def _get_size(parameters):
+    return parameters['models'], parameters['groups'], parameters['speakers'], parameters['styles']
+
+
+def _get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import json
+import os
+
+import numpy as np
+
+# Columns of the per-speaker output files, as written by sclite
+OUTPUT_FILE_COLUMNS = ['SPKR', '# Snt', '# Wrd', 'Corr', 'Sub', 'Del', 'Ins', 'Err']
+
+
+def generate_corpus(path, n_models=5, n_groups=5, n_speakers=1000, n_styles=2, seed=0):
+    """
+    Generate a synthetic corpus of per-speaker output files and a config.json to run the pipeline on.
+
+    Every model recognises the same speakers, which are divided evenly over the groups. Each model and group has its
+    own error rate, so the bias metrics are not trivially zero.
+
+    :param path: Directory to write the corpus to. The output files are written to
+        {path}/data/{speaking_style}/{model}/{group}.csv.
+    :param n_models: Number of ASR models.
+    :param n_groups: Number of speaker groups.
+    :param n_speakers: Total number of speakers, over all groups.
+    :param n_styles: Number of speaking styles.
+    :param seed: Seed of the random number generator.
+    :return: Path of the generated config.json.
+    """
+    rng = np.random.default_rng(seed)
+    models = [f'model{index}' for index in range(n_models)]
+    groups = [f'group{index}' for index in range(n_groups)]
+    speaking_styles = [f'style{index}' for index in range(n_styles)]
+    speakers_per_group = np.full(n_groups, n_speakers // n_groups)
+    speakers_per_group[:n_speakers % n_groups] += 1
+    # Speaker IDs are unique over all groups
+    first_speakers = np.concatenate([[0], np.cumsum(speakers_per_group)[:-1]])
+
+    for style_index, speaking_style in enumerate(speaking_styles):
+        # The number of sentences and words of a speaker do not depend on the model
+        sentences = [rng.integers(5, 50, size) for size in speakers_per_group]
+        words = [rng.integers(50, 500, size) for size in speakers_per_group]
+
+        for model_index, model in enumerate(models):
+            directory = os.path.join(path, 'data', speaking_style, model)
+            os.makedirs(directory, exist_ok=True)
+
+            for group_index, group in enumerate(groups):
+                error_rate = 0.05 + 0.2 * rng.random() + 0.02 * style_index
+                group_words = words[group_index]
+                errors = rng.binomial(group_words, error_rate)
+                substitutions = rng.binomial(errors, 0.6)
+                deletions = rng.binomial(errors - substitutions, 0.5)
+                insertions = errors - substitutions - deletions
+                correct = group_words - substitutions - deletions
+
+                speakers = first_speakers[group_index] + np.arange(len(group_words))
+                table = np.column_stack([speakers, sentences[group_index], group_words, correct, substitutions,
+                                         deletions, insertions, errors])
+                np.savetxt(os.path.join(directory, f'{group}.csv'), table, fmt='%d', delimiter=',',
+                           header=','.join(OUTPUT_FILE_COLUMNS), comments='')
+
+    config = {
+        'base_path': os.path.abspath(os.path.join(path, 'data')),
+        'error_rates': ['WER'],
+        'speaking_style_folders': speaking_styles,
+        'speaking_style_infixes': speaking_styles,
+        'speaker_groups': groups,
+        'asr_models': models,
+        'path_templates': {
+            'output_file': '{base_path}/{speaking_style_folder}/{asr_model}/{speaker_group}.csv',
+            'error_rate_file': '{base_path}/{error_rate}.csv',
+        },
+        'cache_path': os.path.abspath(os.path.join(path, '.cache')),
+    }
+
+    config_path = os.path.join(path, 'config.json')
+    with open(config_path, 'w') as file:
+        file.write(json.dumps(config, indent=4))
+
+    return config_path
@@ -1,75 +1,539 @@
-import json
+import argparse
+import os
 
-from src.asr_output_data import AsrOutputData
-from src.bias_calculation import get_performance_differences, calculate_weighted_performance_bias, \
-    calculate_intergroup_weighted_performance_bias, calculate_total_intergroup_weighted_performance_bias, \
-    calculate_overall_weighted_performance_bias, calculate_overall_intergroup_weighted_performance_bias
-from src.filepath_manager import FilepathManager
-from src.process import read_data
-from src.visualize import plot_statistics_per_error_rate, plot_performance_difference, plot_iwpb, plot_wpb, \
-    plot_iwpb_simulation, plot_iwpb_heatmap, plot_wpb_simulation
+from src.instrumentation import timed
 
+# Heavy dependencies (pandas, matplotlib, seaborn) are imported by the stages that need them, so that e.g. the
+# compute stage does not pay for importing the plotting libraries.
+
+ERROR_RATES_PER_SPEAKER_PATH = 'results/error_rates/error_rates_per_speaker.txt'
+SPEAKER_STORE_PATH = 'results/error_rates/error_rates_per_speaker'
+ERROR_RATES_PER_GROUP_PATH = 'results/error_rates/error_rates_per_group.txt'
+PERFORMANCE_DIFFERENCES_ABS_PATH = 'results/bias/old/performance_differences_combined_abs.json'
+PERFORMANCE_DIFFERENCES_REL_PATH = 'results/bias/old/performance_differences_combined_rel.json'
+WEIGHTED_BIAS_PATH = 'results/bias/new/weighted_performance_bias.json'
+OVERALL_WEIGHTED_BIAS_PATH = 'results/bias/new/overall_weighted_performance_bias.json'
+INTERGROUP_WEIGHTED_BIAS_PATH = 'results/bias/new/intergroup_weighted_performance_bias.json'
+OVERALL_INTERGROUP_WEIGHTED_BIAS_PATH = 'results/bias/new/overall_intergroup_weighted_performance_bias.json'
+BIAS_PER_ERROR_RATE_PATH = 'results/bias/new/bias_per_error_rate.json'
+WEIGHTS_PATH = 'results/bias/new/weights.json'
+WEIGHT_SWEEP_PATH = 'results/bias/new/weight_sweep.json'
+OPTIMISED_WEIGHTS_PATH = 'results/bias/new/optimised_weights.json'
+LIVE_BIAS_PATH = 'results/bias/new/live_bias.json'
+
+COMPUTE_OUTPUTS = ['bias', 'confidence_intervals', 'pairwise_differences', 'speaker_bias']
+PLOTS = ['iwpb_heatmap', 'iwpb_simulation', 'wpb_simulation', 'performance_difference', 'statistics', 'wpb', 'iwpb']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calculate the (intergroup) weighted performance bias of ASR models.")
+    parser.add_argument('--config', default='config.json', help="Path to the config file.")
+    parser.add_argument('--timings', help="JSON lines file to append the wall time, CPU time, peak RSS and item "
+                                          "count of every stage to.")
+    parser.add_argument('--profile', help="Directory to write a profile of every stage to.")
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile',
+                        help="Profiler used for --profile.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('ingest', help="Read the ASR output and write the error rates per speaker and group.")
+
+    compute_parser = subparsers.add_parser('compute', help="Calculate the bias metrics from the error rates.")
+    compute_parser.add_argument('--outputs', nargs='+', choices=COMPUTE_OUTPUTS, default=COMPUTE_OUTPUTS,
+                                help="Results to calculate, besides the performance differences.")
+
+    sweep_parser = subparsers.add_parser('sweep', help="Sweep the weights of the WPB and IWPB.")
+    sweep_parser.add_argument('--metric', nargs='+', choices=['wpb', 'iwpb'], default=['wpb', 'iwpb'])
+    sweep_parser.add_argument('--resolution', type=int, default=100, help="Number of w1 values between 0 and 1.")
+
+    optimise_parser = subparsers.add_parser('optimise', help="Fit the weights of the WPB or IWPB under an objective.")
+    optimise_parser.add_argument('--metric', nargs='+', choices=['wpb', 'iwpb'], default=['wpb', 'iwpb'])
+    optimise_parser.add_argument('--objective', choices=['mean', 'minimax', 'ranking'], default='minimax')
+    optimise_parser.add_argument('--scope', choices=['global', 'model', 'style'], default='global',
+                                 help="Fit one set of weights to all models, or one per model or speaking style.")
+    optimise_parser.add_argument('--per-rate', action='store_true',
+                                 help="Give every error rate its own performance difference and base weight.")
+    optimise_parser.add_argument('--bounds', nargs='+', default=[], metavar='TERM=LOWER:UPPER',
+                                 help="Bounds of the weight of a term, e.g. base=0.2:0.8.")
+    optimise_parser.add_argument('--ranking', nargs='+', metavar='MODEL',
+                                 help="Target ranking of the models, from least to most biased.")
+
+    plot_parser = subparsers.add_parser('plot', help="Plot the results of the ingest and compute stages.")
+    plot_parser.add_argument('--plots', nargs='+', choices=PLOTS, default=PLOTS, help="Plots to render.")
+
+    serve_parser = subparsers.add_parser('serve', help="Keep the data in memory and answer bias queries over a "
+                                                       "local HTTP/JSON API.")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="Host to listen on.")
+    serve_parser.add_argument('--port', type=int, default=8000, help="Port to listen on.")
+    serve_parser.add_argument('--workers', type=int, help="Number of worker processes evaluating the queries. "
+                                                          "Defaults to one per CPU.")
+
+    monitor_parser = subparsers.add_parser('monitor', help="Update the WPB and IWPB from a stream of error counts or "
+                                                           "transcripts.")
+    monitor_parser.add_argument('--input', default='-', help="JSON lines file with the results to monitor, or - to "
+                                                             "read them from standard input.")
+    monitor_parser.add_argument('--window', choices=['cumulative', 'sliding', 'decay'], default='cumulative',
+                                help="Keep all results, those of the last --window-size seconds, or weigh them by "
+                                     "their age with a half-life of --window-size seconds.")
+    monitor_parser.add_argument('--window-size', type=float, help="Window length or half-life, in seconds.")
+    monitor_parser.add_argument('--report-every', type=int, default=100,
+                                help="Number of results after which the bias is written and printed.")
+    monitor_parser.add_argument('--wpb-w1', type=float, default=0.5, help="Weight for performance difference of "
+                                                                          "the WPB.")
+    monitor_parser.add_argument('--iwpb-w1', type=float, default=0.5, help="Weight for performance difference of "
+                                                                           "the IWPB.")
+
+    args = parser.parse_args(argv)
+
+    from src.filepath_manager import FilepathManager
+    from src.instrumentation import Instrumentation, set_instrumentation, stage
+    from src.memo_cache import MemoCache, set_memo_cache
+    from src.results_writer import get_results_writer
+
+    # Time every stage, so a slow run can be traced back to the stage that caused it
+    instrumentation = Instrumentation(args.timings, args.profile, args.profiler)
+    set_instrumentation(instrumentation)
+
+    filepath_manager = FilepathManager(args.config)
+    writer = get_results_writer(filepath_manager)
+
+    # Reuse bias results computed from the same inputs and weights, within this run and across runs
+    memo_cache = None
+    if filepath_manager.memo_cache:
+        memo_cache = MemoCache(os.path.join(filepath_manager.get_cache_path(), 'memo'),
+                               filepath_manager.memo_cache_entries, filepath_manager.memo_cache_size * 2 ** 20)
+    set_memo_cache(memo_cache)
+
+    if args.command == 'ingest':
+        ingest(filepath_manager, writer)
+    elif args.command == 'compute':
+        from src.speaker_store import SpeakerStore
+        with stage('load'):
+            result_per_group_df = writer.read(ERROR_RATES_PER_GROUP_PATH)
+            result_per_speaker_df = SpeakerStore(SPEAKER_STORE_PATH)
+        compute(filepath_manager, writer, result_per_group_df, result_per_speaker_df, args.outputs)
+    elif args.command == 'sweep':
+        with stage('load'):
+            performance_differences_abs = writer.read(PERFORMANCE_DIFFERENCES_ABS_PATH)
+        sweep(filepath_manager, writer, performance_differences_abs, args.metric, args.resolution)
+    elif args.command == 'optimise':
+        with stage('load'):
+            performance_differences_abs = writer.read(PERFORMANCE_DIFFERENCES_ABS_PATH)
+        bounds = {term: tuple(float(bound) for bound in bounds.split(':'))
+                  for term, bounds in (argument.split('=') for argument in args.bounds)}
+        optimise(writer, performance_differences_abs, args.metric, args.objective, args.scope, args.per_rate, bounds,
+                 args.ranking)
+    elif args.command == 'plot':
+        from src.performance_records import PerformanceRecords
+        from src.speaker_store import SpeakerStore
+        with stage('load'):
+            results = {
+                'performance_differences_abs': PerformanceRecords.from_performance_differences(
+                    writer.read(PERFORMANCE_DIFFERENCES_ABS_PATH)),
+                'performance_differences_rel': PerformanceRecords.from_performance_differences(
+                    writer.read(PERFORMANCE_DIFFERENCES_REL_PATH)),
+                'result_per_speaker_df': SpeakerStore(SPEAKER_STORE_PATH),
+                'weighted_bias': writer.read(WEIGHTED_BIAS_PATH),
+                'intergroup_weighted_bias': writer.read(INTERGROUP_WEIGHTED_BIAS_PATH),
+                'bias_per_error_rate': writer.read(BIAS_PER_ERROR_RATE_PATH),
+                **writer.read(WEIGHTS_PATH),
+            }
+        plot(filepath_manager, results, args.plots)
+    elif args.command == 'monitor':
+        monitor(filepath_manager, writer, args.input, args.window, args.window_size, args.report_every, args.wpb_w1,
+                args.iwpb_w1)
+    elif args.command == 'serve':
+        import asyncio
+        from src.server import BiasService, serve
+        with stage('load'):
+            print("Loading data...")
+            service = BiasService(filepath_manager)
+        try:
+            asyncio.run(serve(service, args.host, args.port, args.workers))
+        except KeyboardInterrupt:
+            print("Stopped serving bias queries.")
+    else:
+        # Run the whole pipeline
+        result_per_group_df, result_per_speaker_df = ingest(filepath_manager, writer)
+        results = compute(filepath_manager, writer, result_per_group_df, result_per_speaker_df, COMPUTE_OUTPUTS)
+        plot(filepath_manager, {**results, 'result_per_speaker_df': result_per_speaker_df}, PLOTS)
+
+    print(instrumentation.summary())
+    if memo_cache is not None and memo_cache.hits + memo_cache.misses:
+        print(f"Reused {memo_cache.hits} of {memo_cache.hits + memo_cache.misses} bias results from the memo cache.")
+
+
+@timed()
+def ingest(filepath_manager, writer):
+    from src.asr_output_data import AsrOutputData
+    from src.instrumentation import stage
+    from src.process import read_data
+    from src.speaker_store import SpeakerStore
 
-def main():
     print("Retrieving data...")
-    filepath_manager = FilepathManager('config.json')
     asr_output_data = AsrOutputData(filepath_manager=filepath_manager)
 
+    # Report the combinations of ASR model, speaker group and speaking style without input files
+    missing = filepath_manager.get_missing_combinations()
+    if missing:
+        print(f"Skipping {len(missing)} combination(s) without input files:\n" +
+              "\n".join(f"  {model}_{group}_{speaking_style}" for model, group, speaking_style in missing))
+    state = _get_state(filepath_manager)
+
     result_per_speaker_df = {}
     result_per_group_df = {}
 
     # Read error-data for both Read and HMI speaking style
     print("Reading data...")
-    read_data(asr_output_data, filepath_manager, result_per_group_df, result_per_speaker_df)
+    with stage('read_data') as record:
+        read_data(asr_output_data, filepath_manager, result_per_group_df, result_per_speaker_df, state)
+        record['items'] = len(result_per_group_df)
 
     # Write error rates to file
-    with open(f'results/error_rates/error_rates_per_speaker.txt', 'w') as file:
-        file.write(json.dumps(result_per_speaker_df, indent=4))
+    with stage('write_error_rates', items=len(result_per_group_df)):
+        writer.write(ERROR_RATES_PER_SPEAKER_PATH, result_per_speaker_df)
+        writer.write(ERROR_RATES_PER_GROUP_PATH, result_per_group_df)
+
+        # Later stages read the error rates per speaker from the memory-mapped store
+        result_per_speaker_df = SpeakerStore.write(SPEAKER_STORE_PATH, result_per_speaker_df)
+
+    if state is not None:
+        state.save()
+
+    return result_per_group_df, result_per_speaker_df
+
 
-    with open(f'results/error_rates/error_rates_per_group.txt', 'w') as file:
-        file.write(json.dumps(result_per_group_df, indent=4))
+@timed()
+def compute(filepath_manager, writer, result_per_group_df, result_per_speaker_df, outputs):
+    import numpy as np
+
+    from src.bias_calculation import get_performance_differences, calculate_weighted_performance_bias, \
+        calculate_intergroup_weighted_performance_bias, calculate_total_intergroup_weighted_performance_bias, \
+        calculate_overall_weighted_performance_bias, calculate_overall_intergroup_weighted_performance_bias, \
+        calculate_bias_per_error_rate, get_optimal_weights, get_overall_intergroup_weighted_performance_bias
+    from src.incremental import fingerprint
+    from src.instrumentation import stage
+    from src.speaker_bias import BIAS_LEVELS, speaker_group_rates
+
+    if filepath_manager.bias_level not in BIAS_LEVELS:
+        raise ValueError(f"Invalid bias_level. Use one of {', '.join(BIAS_LEVELS)}.")
+
+    state = _get_state(filepath_manager)
+    # Speaking style and error rate the IWPB is reported for
+    reported = (filepath_manager.reported_speaking_style, filepath_manager.reported_error_rate)
+
+    if filepath_manager.bias_level == 'speaker':
+        # Derive the error rate of every group from the distribution of its speakers
+        print("Calculating error rates per group from the speakers...")
+        with stage('speaker_group_rates', items=len(result_per_speaker_df)):
+            result_per_group_df = speaker_group_rates(result_per_speaker_df, filepath_manager.error_rates,
+                                                      filepath_manager.speaker_weighting)
 
     # Bias Calculation
     print("Calculating performance differences...")
-    performance_differences_abs, performance_differences_rel = get_performance_differences(result_per_group_df, filepath_manager)
+    with stage('performance_differences', items=len(result_per_group_df)):
+        performance_differences_abs, performance_differences_rel = get_performance_differences(
+            result_per_group_df, filepath_manager, state, writer)
 
-    # Simulate weights
-    plot_iwpb_heatmap(performance_differences_abs)
+    # Simulate weights, averaging the best w1 of each model
     print("Performing IWPB simulation...")
-    iwpb_w1 = (plot_iwpb_simulation(performance_differences_abs))
-    iwpb_w2 = 1 - iwpb_w1
+    with stage('iwpb_simulation', items=len(performance_differences_abs.models)):
+        iwpb_w1 = float(np.mean(list(get_optimal_weights(performance_differences_abs, 'iwpb', *reported).values())))
+        iwpb_w2 = 1 - iwpb_w1
 
     print("Performing WPB simulation...")
-    wpb_w1 = (plot_wpb_simulation(performance_differences_abs))
-    wpb_w2 = 1 - wpb_w1
+    with stage('wpb_simulation', items=len(performance_differences_abs.models)):
+        wpb_w1 = float(np.mean(list(get_optimal_weights(performance_differences_abs, 'wpb', *reported).values())))
+        wpb_w2 = 1 - wpb_w1
 
     # Override weights, if necessary
     # iwpb_w1 = iwpb_w2 = wpb_w1 = wpb_w2 = 0.5
 
+    writer.write(WEIGHTS_PATH, {'wpb_w1': wpb_w1, 'iwpb_w1': iwpb_w1})
+
+    results = {'performance_differences_abs': performance_differences_abs,
+               'performance_differences_rel': performance_differences_rel,
+               'wpb_w1': wpb_w1, 'iwpb_w1': iwpb_w1}
+
     # New bias metrics calculation
-    print("Calculating bias via new bias metrics...")
-    weighted_bias = calculate_weighted_performance_bias(performance_differences_abs, wpb_w1, wpb_w2)
-    overall_bias = calculate_overall_weighted_performance_bias(performance_differences_abs, wpb_w1, wpb_w2, filepath_manager)
-    intergroup_weighted_bias = calculate_intergroup_weighted_performance_bias(performance_differences_abs,iwpb_w1, iwpb_w2)
-    overall_intergroup_weighted_bias = calculate_overall_intergroup_weighted_performance_bias(performance_differences_abs, iwpb_w1, iwpb_w2, filepath_manager)
-    total_intergroup_weighted_bias = calculate_total_intergroup_weighted_performance_bias(performance_differences_abs, iwpb_w1, iwpb_w2)
+    if 'bias' in outputs:
+        print("Calculating bias via new bias metrics...")
+        with stage('bias'):
+            # The stored tables and the format they are written in are part of the fingerprint, so adding a table or
+            # changing the format invalidates older states
+            bias_tables = [WEIGHTED_BIAS_PATH, OVERALL_WEIGHTED_BIAS_PATH, INTERGROUP_WEIGHTED_BIAS_PATH,
+                           OVERALL_INTERGROUP_WEIGHTED_BIAS_PATH, BIAS_PER_ERROR_RATE_PATH]
+            bias_fingerprint = fingerprint([performance_differences_abs.get_fingerprint(), wpb_w1, wpb_w2, iwpb_w1, iwpb_w2,
+                                            bias_tables, writer.results_format, writer.export_json, reported])
+            cached_bias = state.get('bias', 'tables', bias_fingerprint) if state is not None else None
+
+            if cached_bias is not None:
+                # Write the stored tables again, as the files may have been removed or overwritten since
+                with stage('write_cached', items=len(bias_tables)):
+                    for path, table in zip(bias_tables, cached_bias):
+                        writer.write(path, table)
+                weighted_bias, _, intergroup_weighted_bias, _, bias_per_error_rate = cached_bias
+            else:
+                n_models = len(performance_differences_abs.models)
+                with stage('wpb', items=n_models):
+                    weighted_bias = calculate_weighted_performance_bias(performance_differences_abs, wpb_w1, wpb_w2, writer)
+                with stage('overall_wpb', items=n_models):
+                    overall_bias = calculate_overall_weighted_performance_bias(performance_differences_abs, wpb_w1, wpb_w2, filepath_manager, writer)
+                with stage('iwpb', items=n_models):
+                    intergroup_weighted_bias = calculate_intergroup_weighted_performance_bias(performance_differences_abs,iwpb_w1, iwpb_w2, writer,
+                                                                                              *reported)
+                with stage('overall_iwpb', items=n_models):
+                    overall_intergroup_weighted_bias = get_overall_intergroup_weighted_performance_bias(
+                        calculate_overall_intergroup_weighted_performance_bias(performance_differences_abs, iwpb_w1, iwpb_w2, filepath_manager, writer))
+                with stage('total_iwpb', items=n_models):
+                    total_intergroup_weighted_bias = calculate_total_intergroup_weighted_performance_bias(performance_differences_abs, iwpb_w1, iwpb_w2,
+                                                                                                          *reported)
+                with stage('per_error_rate', items=len(performance_differences_abs.rate_types)):
+                    bias_per_error_rate = calculate_bias_per_error_rate(performance_differences_abs, wpb_w1, wpb_w2,
+                                                                        iwpb_w1, iwpb_w2, writer,
+                                                                        filepath_manager.reported_speaking_style)
+
+                if state is not None:
+                    state.put('bias', 'tables', bias_fingerprint,
+                              [weighted_bias, overall_bias, intergroup_weighted_bias, overall_intergroup_weighted_bias,
+                               bias_per_error_rate])
+
+            results['weighted_bias'] = weighted_bias
+            results['intergroup_weighted_bias'] = intergroup_weighted_bias
+            results['bias_per_error_rate'] = bias_per_error_rate
+
+    # Bias metrics comparing the speakers of the groups rather than their error rates
+    if 'speaker_bias' in outputs and filepath_manager.bias_level == 'speaker':
+        from src.speaker_bias import calculate_speaker_level_bias
+
+        print("Calculating speaker-level bias...")
+        with stage('speaker_bias', items=len(result_per_speaker_df)):
+            results['speaker_level_bias'] = calculate_speaker_level_bias(
+                result_per_speaker_df, filepath_manager, wpb_w1, wpb_w2, iwpb_w1, iwpb_w2,
+                filepath_manager.speaker_weighting, filepath_manager.baseline_quantile, writer)
+
+    if state is not None:
+        state.save()
+
+    # Confidence intervals of the bias metrics, by resampling the speakers of each group
+    if 'confidence_intervals' in outputs and filepath_manager.bootstrap_resamples > 0:
+        from src.bootstrap import resample_group_rates, bootstrap_confidence_intervals
+
+        print("Calculating bootstrap confidence intervals...")
+        with stage('confidence_intervals', items=filepath_manager.bootstrap_resamples):
+            resampled_rates = resample_group_rates(result_per_speaker_df, filepath_manager,
+                                                   n_resamples=filepath_manager.bootstrap_resamples,
+                                                   seed=filepath_manager.bootstrap_seed,
+                                                   rate_type=filepath_manager.error_rates,
+                                                   weights=_get_speaker_weights(result_per_speaker_df,
+                                                                                filepath_manager),
+                                                   max_workers=filepath_manager.max_workers)
+            confidence_intervals = bootstrap_confidence_intervals(resampled_rates, filepath_manager, wpb_w1, wpb_w2,
+                                                                  iwpb_w1, iwpb_w2, filepath_manager.confidence_level,
+                                                                  filepath_manager.error_rates)
+
+            writer.write('results/bias/new/bias_confidence_intervals.json', confidence_intervals)
+
+    # Significance of the differences between each pair of groups
+    if 'pairwise_differences' in outputs and filepath_manager.permutations > 0:
+        from src.group_permutation import pairwise_permutation_test
+
+        print("Testing pairwise group differences...")
+        with stage('pairwise_differences', items=filepath_manager.permutations):
+            pairwise_differences = pairwise_permutation_test(result_per_speaker_df, filepath_manager,
+                                                             n_permutations=filepath_manager.permutations,
+                                                             seed=filepath_manager.permutation_seed,
+                                                             rate_type=filepath_manager.error_rates,
+                                                             correction=filepath_manager.p_value_correction,
+                                                             max_workers=filepath_manager.max_workers)
+
+            writer.write('results/bias/new/pairwise_group_differences.json', pairwise_differences)
+
+    return results
+
+
+@timed()
+def sweep(filepath_manager, writer, performance_differences_abs, metrics, resolution):
+    import numpy as np
+
+    from src.bias_calculation import sweep_weights, get_optimal_weights
+    from src.instrumentation import stage
+
+    w1_values = np.linspace(0, 1, resolution)
+    weight_sweep = {'w1': w1_values.tolist()}
+    reported = (filepath_manager.reported_speaking_style, filepath_manager.reported_error_rate)
+
+    for metric in metrics:
+        print(f"Sweeping {metric.upper()} weights...")
+        with stage(metric) as record:
+            models, bias = sweep_weights(performance_differences_abs, w1_values, metric, None, *reported)
+            weight_sweep[metric] = {
+                'bias': {model: bias[:, index].tolist() for index, model in enumerate(models)},
+                'optimal_w1': get_optimal_weights(performance_differences_abs, metric, *reported),
+            }
+            # Number of evaluated weights and models
+            record['items'] = bias.size
+
+    writer.write(WEIGHT_SWEEP_PATH, weight_sweep)
+
+    return weight_sweep
+
+
+@timed()
+def optimise(writer, performance_differences_abs, metrics, objective, scope, per_rate=False, bounds=None,
+             target_ranking=None):
+    from src.instrumentation import stage
+    from src.weight_optimiser import optimise_weights
+
+    optimised_weights = {}
+
+    for metric in metrics:
+        print(f"Optimising {metric.upper()} weights...")
+        with stage(metric):
+            result = optimise_weights(performance_differences_abs, metric, objective, scope, per_rate, bounds,
+                                      target_ranking)
+            # The terms are the keys of the weights of every fit
+            optimised_weights[metric] = {'weights': result['weights'], 'objective': result['objective']}
+
+    writer.write(OPTIMISED_WEIGHTS_PATH, optimised_weights)
+
+    return optimised_weights
+
+
+@timed()
+def plot(filepath_manager, results, plots):
+    from src.rendering import PlotJob, render_plots
 
     # Data Visualization
     print("Starting data visualization...")
+    error_rates = filepath_manager.get_error_rates()
+    reported = {'speaking_style': filepath_manager.reported_speaking_style,
+                'rate_type': filepath_manager.reported_error_rate}
+    plot_jobs = {
+        # Plot the IWPB heatmap and the WPB/IWPB simulations
+        'iwpb_heatmap': lambda: [PlotJob('plot_iwpb_heatmap', ['plots/iwpb_heatmap.png'],
+                                         results['performance_differences_abs'], **reported)],
+        'iwpb_simulation': lambda: [PlotJob('plot_iwpb_simulation', ['plots/iwpb_simulation.png'],
+                                            results['performance_differences_abs'], **reported)],
+        'wpb_simulation': lambda: [PlotJob('plot_wpb_simulation', ['plots/wpb_simulation.png'],
+                                           results['performance_differences_abs'])],
 
-    # Plot the combined performance differences
-    plot_performance_difference(performance_differences_abs, performance_differences_rel)
+        # Plot the combined performance differences
+        'performance_difference': lambda: [PlotJob('plot_performance_difference',
+                                                   ['plots/performance_differences_combined.png'],
+                                                   results['performance_differences_abs'],
+                                                   results['performance_differences_rel'])],
 
-    # Plot statistics per error rates
-    plot_statistics_per_error_rate(result_per_speaker_df)
+        # Plot statistics per error rates
+        'statistics': lambda: [PlotJob('plot_statistics_per_error_rate',
+                                       [f'plots/histogram-statistics-{rate_type}.png' for rate_type in error_rates],
+                                       results['result_per_speaker_df'], error_rates, filepath_manager)],
 
-    # Plot the weighted performance bias
-    plot_wpb(weighted_bias, filepath_manager, wpb_w1)
+        # Plot the weighted performance bias, over all error rates and per error rate
+        'wpb': lambda: [PlotJob('plot_wpb', ['plots/wpb.png'], results['weighted_bias'], filepath_manager,
+                                results['wpb_w1'])] +
+                       [PlotJob('plot_wpb', [f'plots/wpb-{rate_type}.png'], wpb_values, filepath_manager,
+                                results['wpb_w1'], rate_type)
+                        for rate_type, wpb_values in results['bias_per_error_rate']['wpb'].items()],
+
+        # Plot the intergroup weighted performance bias, for the first error rate and per error rate
+        'iwpb': lambda: [PlotJob('plot_iwpb', ['plots/iwpb.png'], results['intergroup_weighted_bias'],
+                                 filepath_manager, results['iwpb_w1'])] +
+                        [PlotJob('plot_iwpb', [f'plots/iwpb-{rate_type}.png'], iwpb_values, filepath_manager,
+                                 results['iwpb_w1'], rate_type)
+                         for rate_type, iwpb_values in results['bias_per_error_rate']['iwpb'].items()],
+    }
+    plot_jobs = [job for name in plots for job in plot_jobs[name]()]
+
+    # Render in parallel, skipping figures whose input data did not change
+    rendered_jobs = render_plots(plot_jobs, os.path.join(filepath_manager.get_cache_path(), 'plot_hashes.json'),
+                                 max_workers=filepath_manager.plot_workers)
+    print(f"Rendered {len(rendered_jobs)} of {len(plot_jobs)} plots, the others were unchanged.")
+
+
+@timed()
+def monitor(filepath_manager, writer, path, window, window_size, report_every, wpb_w1, iwpb_w1):
+    import json
+    import sys
+
+    from src.bias_monitor import BiasMonitor, apply_event
+    from src.instrumentation import stage
+    from src.process import CHARACTER_RATES
+
+    # The counts of the results are those of a single alignment, so they cannot give character and word error rates
+    rate_types = [rate_type for rate_type in filepath_manager.error_rates if rate_type not in CHARACTER_RATES]
+    if len(rate_types) != len(filepath_manager.error_rates):
+        print(f"Not monitoring {', '.join(sorted(set(filepath_manager.error_rates) - set(rate_types)))}, it needs "
+              f"a character-level alignment next to the word-level one.")
+
+    bias_monitor = BiasMonitor(filepath_manager.asr_models, filepath_manager.speaker_groups,
+                               filepath_manager.speaking_style_folders, rate_types, window,
+                               window_size, wpb_w1, 1 - wpb_w1, iwpb_w1, 1 - iwpb_w1)
+
+    def report():
+        # Remove the counts that are older than the window before the latest result, also from slices without recent
+        # results, so results with historic timestamps are windowed as they were recorded
+        bias_monitor.advance()
+        writer.write(LIVE_BIAS_PATH, bias_monitor.get_bias())
+        totals = bias_monitor.get_totals()
+        print(f"After {bias_monitor.n_updates} results: " + ", ".join(
+            f"{model} WPB {totals['wpb'][model]:.4f} IWPB {totals['iwpb'][model]:.4f}"
+            for model in bias_monitor.models if totals['wpb'][model] is not None))
+
+    print("Monitoring bias...")
+    skipped = 0
+    file = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        with stage('update') as record:
+            for line in file:
+                if not line.strip():
+                    continue
+                # A malformed result or one of an unknown model, group or speaking style does not stop the monitor
+                try:
+                    apply_event(bias_monitor, json.loads(line), filepath_manager.transcript_unit)
+                except (ValueError, KeyError, TypeError) as error:
+                    skipped += 1
+                    print(f"Skipping result: {error}")
+                    continue
+
+                if bias_monitor.n_updates % report_every == 0:
+                    report()
+            record['items'] = bias_monitor.n_updates
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+    if bias_monitor.n_updates % report_every:
+        report()
+    if skipped:
+        print(f"Skipped {skipped} result(s).")
+
+    return bias_monitor
+
+
+def _get_speaker_weights(result_per_speaker_df, filepath_manager):
+    # Resample the group error rates as they are calculated: from the summed counts, i.e. weighted by the number of
+    # words (characters for CER) of every speaker, unless the speaker-level mode weighs all speakers equally
+    if filepath_manager.bias_level == 'speaker' and filepath_manager.speaker_weighting == 'speakers':
+        return None
+
+    from src.process import get_weight_key
+    weight_keys = {rate_type: get_weight_key(rate_type) for rate_type in filepath_manager.error_rates}
+    speakers = {key: result_per_speaker_df[key] for key in result_per_speaker_df}
+    if any(weight_key not in key_speakers for key_speakers in speakers.values() for weight_key in weight_keys.values()):
+        raise ValueError("The number of words per speaker is unavailable, run the ingest stage again.")
+    return {key: {rate_type: key_speakers[weight_key] for rate_type, weight_key in weight_keys.items()}
+            for key, key_speakers in speakers.items()}
+
+
+def _get_state(filepath_manager):
+    # Only recompute results whose inputs changed since the last run, if enabled
+    if not filepath_manager.incremental:
+        return None
+
+    from src.incremental import IncrementalState
+    return IncrementalState(os.path.join(filepath_manager.get_cache_path(), 'incremental.json'))
 
-    # Plot the intergroup weighted performance bias
-    plot_iwpb(intergroup_weighted_bias, filepath_manager, iwpb_w1)
 
 if __name__ == '__main__':
     main()
     print("Successfully terminated.")
-
@@ -1,6 +1,25 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pandas as pd
 
 from .filepath_manager import FilepathManager
+from .process import CHARACTER_COUNT_COLUMNS, CHARACTER_RATES, COUNT_COLUMNS
+from .transcripts import accumulate_counts, counts_to_frames, read_transcripts
+
+# Columns needed from each per-speaker output file, with their dtypes
+OUTPUT_COLUMNS = {'Sub': 'int64', 'Ins': 'int64', 'Del': 'int64', 'Corr': 'int64', '# Wrd': 'int64'}
+KEY_COLUMNS = ['Model', 'Group', 'SpeakingStyle', 'Speaker']
+
+# Pools the output files can be read with concurrently
+INGESTION_MODES = ['thread', 'process']
+
+# Column of the speaker IDs in the output files, if present
+SPEAKER_COLUMN = 'SPKR'
+
+# Version of the cached table, cached tables of other versions are not used
+CACHE_VERSION = 2
 
 
 class AsrOutputData:
@@ -9,6 +28,11 @@ class AsrOutputData:
 
     Handles the creation of a Pandas Dataframe containing all the information from the model output.
 
+    build_table reads all output files into a single tidy table, which is cached in the FilepathManager's cache
+    directory. Only files whose modification time or size changed since the last run are parsed again. If the
+    FilepathManager's input_format is 'transcripts', the table is built by streaming and aligning utterance-level
+    transcript files instead.
+
     Attributes:
         filepath_manager: A FilepathManager instance to handle file retrieval and reading.
     """
@@ -17,7 +41,7 @@ class AsrOutputData:
         self.filepath_manager = filepath_manager
 
     def build_dataframe(self, speaking_style=0):
-        speaker_groups = self.filepath_manager.get_speaker_groups()
+        speaker_groups = self.filepath_manager.get_input_groups()
         asr_models = self.filepath_manager.get_asr_models()
 
         speaking_style_folder = self.filepath_manager.get_speaking_style_folders()[speaking_style]
@@ -39,3 +63,245 @@ class AsrOutputData:
                 d[model].append((group, pd.read_csv(model_error_filepath)))
 
         return pd.DataFrame(data=d)
+
+    def build_table(self):
+        """
+        Read the output files of all speaking styles, speaker groups and ASR models into a single table.
+
+        :return: DataFrame with one row per speaker, keyed by the 'Model', 'Group', 'SpeakingStyle' and 'Speaker'
+            (the SPKR column of the output file, or the row number within it) columns, followed by the OUTPUT_COLUMNS
+            counts.
+        """
+        if self.filepath_manager.input_format == 'transcripts':
+            return self.build_transcript_table()
+
+        sources = self._get_sources()
+        fingerprints = {path: _fingerprint(path) for path, _ in sources}
+
+        cached_table, cached_fingerprints = self._read_cache()
+        unchanged = {path for path, fingerprint in fingerprints.items()
+                     if fingerprint is not None and cached_fingerprints.get(path) == fingerprint}
+        cached_tables = {}
+        if unchanged:
+            cached_tables = {path: table for path, table in cached_table.groupby('Path', observed=True, sort=False)
+                             if path in unchanged}
+
+        changed = [path for path, _ in sources if path not in cached_tables]
+        read_tables = dict(zip(changed, self._read_output_files(changed)))
+
+        tables = []
+        for path, (model, group, speaking_style) in sources:
+            table = cached_tables.get(path)
+            if table is None:
+                table = read_tables[path]
+                speakers = table.pop(SPEAKER_COLUMN) if SPEAKER_COLUMN in table else range(len(table))
+                table.insert(0, 'Speaker', pd.Series(speakers, index=table.index).astype(str))
+                table.insert(0, 'SpeakingStyle', speaking_style)
+                table.insert(0, 'Group', group)
+                table.insert(0, 'Model', model)
+                table['Path'] = path
+            tables.append(table)
+
+        table = pd.concat(tables, ignore_index=True)
+        for column in ['Model', 'Group', 'SpeakingStyle', 'Path']:
+            table[column] = table[column].astype('category')
+
+        if len(unchanged) != len(sources) or len(cached_fingerprints) != len(sources):
+            self._write_cache(table, fingerprints)
+
+        return table.drop(columns='Path')
+
+    def build_transcript_table(self):
+        """
+        Stream the transcript file of every speaking style and ASR model, and align it into a per-speaker table.
+
+        If any CHARACTER_RATES are configured, the transcripts are aligned per character as well, and the counts of
+        that alignment are added as the CHARACTER_COUNT_COLUMNS.
+
+        :return: DataFrame in the same format as build_table, with the speaker IDs from the transcripts in the
+            'Speaker' column.
+        """
+        unit = self.filepath_manager.transcript_unit
+        fields = self.filepath_manager.transcript_fields
+        character_counts = any(rate_type in CHARACTER_RATES for rate_type in self.filepath_manager.get_error_rates())
+        columns = COUNT_COLUMNS + CHARACTER_COUNT_COLUMNS if character_counts else COUNT_COLUMNS
+        tables = []
+
+        for path, (model, speaking_style) in self._get_transcript_sources():
+            counts = accumulate_counts(read_transcripts(path, fields), unit)
+            if character_counts:
+                char_counts = counts if unit == 'char' else accumulate_counts(read_transcripts(path, fields), 'char')
+                counts = {speaker: speaker_counts + char_counts[speaker] for speaker, speaker_counts in counts.items()}
+
+            for group, table in counts_to_frames(counts, columns).items():
+                table = table.rename(columns={'SPKR': 'Speaker'})
+                table.insert(0, 'SpeakingStyle', speaking_style)
+                table.insert(0, 'Group', group)
+                table.insert(0, 'Model', model)
+                tables.append(table)
+
+        table = pd.concat(tables, ignore_index=True)
+        table = table.astype({column: 'int64' for column in columns})
+        for column in ['Model', 'Group', 'SpeakingStyle']:
+            table[column] = table[column].astype('category')
+
+        return table
+
+    def get_fingerprints(self):
+        """
+        Fingerprint the output files without reading them.
+
+        :return: Dictionary with (model, group, speaking style) tuples as keys and the (modification time, size) of
+            the corresponding output file as values, or None if the file does not exist.
+        """
+        if self.filepath_manager.input_format == 'transcripts':
+            # Every group of a model and speaking style comes from the same transcript file
+            return {(model, group, speaking_style): _fingerprint(path)
+                    for path, (model, speaking_style) in self._get_transcript_sources()
+                    for group in self.filepath_manager.get_input_groups()}
+
+        return {source: _fingerprint(path) for path, source in self._get_sources()}
+
+    def _read_output_files(self, paths):
+        """
+        Read output files, concurrently if the FilepathManager allows more than one worker.
+
+        :param paths: Paths of the output files.
+        :return: List of DataFrames, in the same order as paths.
+        :raises RuntimeError: If any of the files could not be read, listing every failing path.
+        """
+        max_workers = self.filepath_manager.max_workers
+        if self.filepath_manager.ingestion_mode not in INGESTION_MODES:
+            raise ValueError(f"Invalid ingestion_mode. Use one of {', '.join(INGESTION_MODES)}.")
+
+        if (max_workers is not None and max_workers <= 1) or len(paths) <= 1:
+            results = [_try_read_output_file(path) for path in paths]
+        else:
+            if self.filepath_manager.ingestion_mode == 'process':
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+            else:
+                executor = ThreadPoolExecutor(max_workers=max_workers)
+
+            with executor:
+                # map returns the results in the order of the paths, regardless of completion order
+                results = list(executor.map(_try_read_output_file, paths))
+
+        failures = [(path, error) for path, (_, error) in zip(paths, results) if error is not None]
+        if failures:
+            raise RuntimeError(f"Failed to read {len(failures)} output file(s):\n" +
+                               "\n".join(f"  {path}: {error!r}" for path, error in failures))
+
+        return [table for table, _ in results]
+
+    def _get_sources(self):
+        # List each output file together with the (model, group, speaking style) it belongs to, skipping missing files
+        sources = []
+        available = set(self.filepath_manager.get_combinations())
+        speaking_styles = zip(self.filepath_manager.get_speaking_style_folders(),
+                              self.filepath_manager.get_speaking_style_infixes())
+
+        for speaking_style_folder, speaking_style_infix in speaking_styles:
+            for group in self.filepath_manager.get_input_groups():
+                for model in self.filepath_manager.get_asr_models():
+                    if (model, group, speaking_style_folder) not in available:
+                        continue
+
+                    path = self.filepath_manager.get_output_path(
+                        speaking_style_folder=speaking_style_folder,
+                        speaking_style_infix=speaking_style_infix,
+                        speaker_group=group, asr_model=model)
+                    sources.append((path, (model, group, speaking_style_folder)))
+
+        return sources
+
+    def _get_transcript_sources(self):
+        # List each transcript file together with the (model, speaking style) it belongs to, skipping missing files
+        sources = []
+        available = {(model, speaking_style) for model, _, speaking_style in self.filepath_manager.get_combinations()}
+        speaking_styles = zip(self.filepath_manager.get_speaking_style_folders(),
+                              self.filepath_manager.get_speaking_style_infixes())
+
+        for speaking_style_folder, speaking_style_infix in speaking_styles:
+            for model in self.filepath_manager.get_asr_models():
+                if (model, speaking_style_folder) not in available:
+                    continue
+
+                path = self.filepath_manager.get_transcript_path(
+                    speaking_style_folder=speaking_style_folder,
+                    speaking_style_infix=speaking_style_infix,
+                    asr_model=model)
+                sources.append((path, (model, speaking_style_folder)))
+
+        return sources
+
+    def _get_cache_paths(self):
+        cache_path = self.filepath_manager.get_cache_path()
+        cache_format = self.filepath_manager.cache_format
+        return os.path.join(cache_path, f'asr_output.{cache_format}'), os.path.join(cache_path, 'asr_output.json')
+
+    def _read_cache(self):
+        table_path, manifest_path = self._get_cache_paths()
+
+        if not (os.path.exists(table_path) and os.path.exists(manifest_path)):
+            return None, {}
+
+        try:
+            if self.filepath_manager.cache_format == 'feather':
+                table = pd.read_feather(table_path)
+            else:
+                table = pd.read_parquet(table_path)
+        except ImportError:
+            return None, {}
+
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+        if manifest.get('version') != CACHE_VERSION:
+            return None, {}
+        fingerprints = {path: tuple(fingerprint) for path, fingerprint in manifest['fingerprints'].items()}
+
+        return table, fingerprints
+
+    def _write_cache(self, table, fingerprints):
+        table_path, manifest_path = self._get_cache_paths()
+        os.makedirs(os.path.dirname(table_path) or '.', exist_ok=True)
+
+        try:
+            if self.filepath_manager.cache_format == 'feather':
+                table.to_feather(table_path)
+            else:
+                table.to_parquet(table_path, index=False)
+        except ImportError as error:
+            print(f"Not caching ASR output, {self.filepath_manager.cache_format} support is unavailable: {error}")
+            return
+
+        with open(manifest_path, 'w') as file:
+            file.write(json.dumps({'version': CACHE_VERSION, 'fingerprints': fingerprints}))
+
+
+def read_output_file(path):
+    """
+    Read the counts needed for the error rates from a single per-speaker output file.
+
+    :param path: Path to the output file.
+    :return: DataFrame with the OUTPUT_COLUMNS, and the SPEAKER_COLUMN if the file has one.
+    """
+    return pd.read_csv(path, usecols=lambda column: column in OUTPUT_COLUMNS or column == SPEAKER_COLUMN,
+                       dtype={**OUTPUT_COLUMNS, SPEAKER_COLUMN: str})
+
+
+def _try_read_output_file(path):
+    # Return the error instead of raising it, so one failing file does not abort the other reads
+    try:
+        return read_output_file(path), None
+    except Exception as error:
+        return None, error
+
+
+def _fingerprint(path):
+    # Missing files get no fingerprint, so they are never served from the cache and fail when read
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
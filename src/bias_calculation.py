@@ -1,55 +1,80 @@
-import json
-
+import numpy as np
 import pandas as pd
 
+from .bias_engine import BASELINE_AXIS, MODEL_AXIS, GROUP_AXIS, STYLE_AXIS, RATE_AXIS, sweep_linear_weights, \
+    optimal_linear_weight
+from .incremental import fingerprint
+from .memo_cache import memoize
+from .performance_records import INTERSECTION_FIELD, PerformanceRecords, as_performance_records
+from .results_writer import ResultsWriter
 
-def get_performance_differences(df, fpm):
-    performance_diff_abs_min = performance_difference(df, fpm, baseline_type='min', diff_type='absolute')
-    performance_diff_abs_norm = performance_difference(df, fpm, baseline_type='norm', diff_type='absolute')
-    performance_diff_rel_min = performance_difference(df, fpm, baseline_type='min', diff_type='relative')
-    performance_diff_rel_norm = performance_difference(df, fpm, baseline_type='norm', diff_type='relative')
-
-    # Combine absolute values and relative values seperately
-    performance_diff_combined_abs = combine_performance_differences(performance_diff_abs_min, performance_diff_abs_norm,
-                                                                    {}, {})
-    performance_diff_combined_rel = combine_performance_differences({}, {}, performance_diff_rel_min,
-                                                                    performance_diff_rel_norm)
 
-    bias = {'abs_min': convert_to_bias_values(performance_diff_abs_min, fpm),
-            'abs_norm': convert_to_bias_values(performance_diff_abs_norm, fpm),
-            'rel_min': convert_to_bias_values(performance_diff_rel_min, fpm),
-            'rel_norm': convert_to_bias_values(performance_diff_rel_norm, fpm)}
+BASELINE_TYPES = ['min', 'norm']
+DIFF_TYPES = ['absolute', 'relative']
 
-    overall_bias = {'abs_min': convert_to_bias_values(performance_diff_abs_min, fpm, True),
-            'abs_norm': convert_to_bias_values(performance_diff_abs_norm, fpm, True),
-            'rel_min': convert_to_bias_values(performance_diff_rel_min, fpm, True),
-            'rel_norm': convert_to_bias_values(performance_diff_rel_norm, fpm, True)}
 
-    with open(f'results/bias/old/performance_difference_bias.json','w') as file:
-        json.dump(bias, file)
+def get_performance_differences(df, fpm, state=None, writer=None):
+    if writer is None:
+        writer = ResultsWriter('json')
 
-    with open(f'results/bias/old/overall_performance_difference_bias.json','w') as file:
-        json.dump(overall_bias, file)
+    # Compute all baselines and differences in a single pass
+    frame = build_performance_frame(df, fpm, state)
 
-    with open(f'results/bias/old/performance_differences_combined_abs.json','w') as file:
-        file.write(json.dumps(performance_diff_combined_abs, indent=4))
+    records = {}
+    for diff_type in DIFF_TYPES:
+        for baseline_type in BASELINE_TYPES:
+            records[diff_type, baseline_type] = PerformanceRecords.from_frame(frame, diff_type, fpm.asr_models,
+                                                                              [baseline_type])
+            writer.write(f'results/bias/old/performance_difference_{baseline_type}_{diff_type}.json',
+                         records[diff_type, baseline_type].to_performance_differences())
 
-    with open(f'results/bias/old/performance_differences_combined_rel.json','w') as file:
-        file.write(json.dumps(performance_diff_combined_rel, indent=4))
+    # Combine absolute values and relative values seperately
+    performance_diff_combined_abs = PerformanceRecords.from_frame(frame, 'absolute', fpm.asr_models)
+    performance_diff_combined_rel = PerformanceRecords.from_frame(frame, 'relative', fpm.asr_models)
+
+    bias = {'abs_min': convert_to_bias_values(records['absolute', 'min'], fpm),
+            'abs_norm': convert_to_bias_values(records['absolute', 'norm'], fpm),
+            'rel_min': convert_to_bias_values(records['relative', 'min'], fpm),
+            'rel_norm': convert_to_bias_values(records['relative', 'norm'], fpm)}
+
+    overall_bias = {'abs_min': convert_to_bias_values(records['absolute', 'min'], fpm, True),
+            'abs_norm': convert_to_bias_values(records['absolute', 'norm'], fpm, True),
+            'rel_min': convert_to_bias_values(records['relative', 'min'], fpm, True),
+            'rel_norm': convert_to_bias_values(records['relative', 'norm'], fpm, True)}
+
+    writer.write(f'results/bias/old/performance_difference_bias.json', bias)
+    writer.write(f'results/bias/old/overall_performance_difference_bias.json', overall_bias)
+    writer.write(f'results/bias/old/performance_differences_combined_abs.json',
+                 performance_diff_combined_abs.to_performance_differences())
+    writer.write(f'results/bias/old/performance_differences_combined_rel.json',
+                 performance_diff_combined_rel.to_performance_differences())
 
     # Return combined the performance differences
     return performance_diff_combined_abs, performance_diff_combined_rel
 
 
 def convert_to_bias_values(df, fpm, overall=False):
+    """
+    Convert the performance differences of a single baseline type to percentages per speech type, model and group.
+
+    :param df: PerformanceRecords, or the performance difference dictionary, of a single baseline type.
+    :param fpm: FilepathManager holding the ASR models and speaking styles.
+    :param overall: Whether to return the average over the groups of each model instead.
+    :return: Bias as {speech_type: {model: {group: bias}}}, or {speech_type: {model: bias}} if overall. Only the
+        first rate type is taken into account.
+    """
+    records = as_performance_records(df)
+    rate_type, baseline_type = records.rate_types[0], records.baseline_types[0]
+
     bias = {speech_type: {model: {} for model in fpm.asr_models} for speech_type in fpm.speaking_style_folders}
     overall_bias = {speech_type: {model: 0.0 for model in fpm.asr_models} for speech_type in fpm.speaking_style_folders}
 
-    for index, speech_type in enumerate(fpm.speaking_style_folders):
-        for model in df.keys():
-            for group in df[model].keys():
-                if df[model][group][index]['SpeakingStyle'] == speech_type:
-                    bias_value = df[model][group][index]['PerformanceDiff']
+    for speech_type in fpm.speaking_style_folders:
+        for model in records.models:
+            for group in records.groups_of(model):
+                position = records.find(model, group, speech_type, rate_type, baseline_type)
+                if position is not None:
+                    bias_value = records.performance_diff[position]
                     bias[speech_type][model][group] = float("{0:.2f}".format(100 * bias_value))
             # Store overall bias
             average_bias = sum(bias[speech_type][model].values()) / len(bias[speech_type][model])
@@ -61,17 +86,17 @@ def convert_to_bias_values(df, fpm, overall=False):
 def combine_performance_differences(abs_min, abs_norm, rel_min, rel_norm):
     combined = {}
 
-    # Collect all model keys from all dictionaries
-    all_models = set(abs_min.keys()) | set(abs_norm.keys()) | set(rel_min.keys()) | set(rel_norm.keys())
+    # Collect all model keys from all dictionaries, keeping their order so results are reproducible
+    all_models = dict.fromkeys([*abs_min.keys(), *abs_norm.keys(), *rel_min.keys(), *rel_norm.keys()])
 
     for model in all_models:
         combined[model] = {}
 
         # Collect all group keys for each model from all dictionaries
-        all_groups = (set(abs_min.get(model, {}).keys()) |
-                      set(abs_norm.get(model, {}).keys()) |
-                      set(rel_min.get(model, {}).keys()) |
-                      set(rel_norm.get(model, {}).keys()))
+        all_groups = dict.fromkeys([*abs_min.get(model, {}).keys(),
+                                    *abs_norm.get(model, {}).keys(),
+                                    *rel_min.get(model, {}).keys(),
+                                    *rel_norm.get(model, {}).keys()])
 
         for group in all_groups:
             combined[model][group] = (
@@ -83,267 +108,442 @@ def combine_performance_differences(abs_min, abs_norm, rel_min, rel_norm):
 
     return combined
 
-def performance_difference(df, fpm, baseline_type='min', diff_type='absolute'):
-    performance_difference_df = {model: {} for model in fpm.asr_models}
+def build_performance_frame(df, fpm, state=None):
+    """
+    Calculate the baselines and performance differences for every baseline type and diff type in a single pass.
+
+    :param df: Error rates per group, keyed by 'model_group_style'.
+    :param fpm: FilepathManager holding the ASR models, error rates and speaking styles.
+    :param state: Optional IncrementalState. If given, only (model, speaking style) slices whose group error rates
+        changed since the last run are recomputed.
+    :return: Long-format DataFrame with one row per (model, group, speaking style, rate type), holding the error rate
+        ('Rates'), a 'Baseline_<baseline_type>' column per baseline type and a '<diff_type>_<baseline_type>' column
+        per combination of diff type and baseline type. Rows are ordered by model, rate type and speaking style as
+        listed in the FilepathManager. With intersectional groups, the baselines are taken over the groups of every
+        intersection, which is stored in the INTERSECTION_FIELD column.
+    """
+    if state is not None:
+        return _build_performance_frame_incremental(df, fpm, state)
+
     rows = []
 
-    for rate_type in fpm.error_rates:
-        for key, value in df.items():
-            model, group, speaking_style = key.split('_')
+    for key, value in df.items():
+        model, group, speaking_style = fpm.split_key(key)
+        for rate_type in fpm.error_rates:
             rows.append([model, group, speaking_style, rate_type, value[rate_type]])
 
-    df = pd.DataFrame(rows, columns=['Model', 'Group', 'SpeakingStyle', 'RateType', 'Rates'])
+    frame = pd.DataFrame(rows, columns=['Model', 'Group', 'SpeakingStyle', 'RateType', 'Rates'])
+    frame = _order_performance_frame(frame, fpm)
 
-    for model in fpm.asr_models:
-        model_df = df[df['Model'] == model]
+    slice_columns = ['Model', 'RateType', 'SpeakingStyle']
+    intersections = fpm.get_group_intersections()
+    if intersections is not None:
+        # A speaker belongs to a group of every intersection, so only the groups of one intersection are compared
+        frame[INTERSECTION_FIELD] = frame['Group'].map(dict(zip(fpm.speaker_groups, intersections)))
+        slice_columns.append(INTERSECTION_FIELD)
 
-        for rate_type in fpm.error_rates:
-            rate_df = model_df[model_df['RateType'] == rate_type]
-
-            for speaking_style in fpm.speaking_style_folders:
-                style_df = rate_df[rate_df['SpeakingStyle'] == speaking_style]
-
-                # Determine baseline performance
-                if baseline_type == 'min':
-                    baseline_performance = style_df['Rates'].min()
-                elif baseline_type == 'norm':
-                    baseline_performance = style_df['Rates'].mean()
-                else:
-                    raise ValueError("Invalid baseline_type. Use 'min' or 'norm'.")
-
-                for _, row in style_df.iterrows():
-                    current_performance = row['Rates']
-                    group = row['Group']
-
-                    if diff_type == 'absolute':
-                        performance_diff = abs(current_performance - baseline_performance)
-                    elif diff_type == 'relative':
-                        performance_diff = abs((current_performance - baseline_performance) / baseline_performance)
-                    else:
-                        raise ValueError("Invalid diff_type. Use 'absolute' or 'relative'.")
-
-                    if group not in performance_difference_df[model]:
-                        performance_difference_df[model][group] = []
-
-                    performance_difference_df[model][group].append({
-                        "RateType": rate_type,
-                        "SpeakingStyle": speaking_style,
-                        "PerformanceDiff": performance_diff,
-                        "BasePerformance": current_performance,
-                        "BaselinePerformance": baseline_performance,
-                        "BaselineType": baseline_type
-                    })
-
-    with open(f'results/bias/old/performance_difference_{baseline_type}_{diff_type}.json','w') as file:
-        file.write(json.dumps(performance_difference_df, indent=4))
+    rates = frame.groupby(slice_columns, observed=True, sort=False)['Rates']
+    frame['Baseline_min'] = rates.transform('min')
+    frame['Baseline_norm'] = rates.transform('mean')
+
+    for baseline_type in BASELINE_TYPES:
+        difference = frame['Rates'] - frame[f'Baseline_{baseline_type}']
+        frame[f'absolute_{baseline_type}'] = difference.abs()
+        frame[f'relative_{baseline_type}'] = (difference / frame[f'Baseline_{baseline_type}']).abs()
+
+    return frame
+
+
+def _build_performance_frame_incremental(df, fpm, state):
+    # Baselines only depend on the groups of the same model and speaking style, so those slices are independent
+    slices = {}
+    for key, value in df.items():
+        model, group, speaking_style = fpm.split_key(key)
+        slices.setdefault(model + '_' + speaking_style, {})[group] = [value[rate_type] for rate_type in fpm.error_rates]
+
+    frames = []
+    changed = {}
+    for slice_key, rates in slices.items():
+        slice_fingerprint = fingerprint([fpm.error_rates, rates, fpm.get_group_intersections()])
+        cached = state.get('performance_differences', slice_key, slice_fingerprint)
+
+        if cached is None:
+            changed[slice_key] = slice_fingerprint
+        else:
+            frames.append(pd.DataFrame(cached))
+
+    if changed:
+        changed_df = {}
+        for key, value in df.items():
+            model, group, speaking_style = fpm.split_key(key)
+            if model + '_' + speaking_style in changed:
+                changed_df[key] = value
+
+        frame = build_performance_frame(changed_df, fpm)
+        frames.append(frame)
+
+        for (model, speaking_style), slice_frame in frame.groupby(['Model', 'SpeakingStyle'], observed=True):
+            slice_key = model + '_' + speaking_style
+            slice_frame = slice_frame.astype({'Model': str, 'RateType': str, 'SpeakingStyle': str})
+            state.put('performance_differences', slice_key, changed[slice_key], slice_frame.to_dict('list'))
+
+    state.retain('performance_differences', slices.keys())
+
+    return _order_performance_frame(pd.concat(frames, ignore_index=True), fpm)
+
+
+def _order_performance_frame(frame, fpm):
+    # Only keep configured combinations, ordered as in the config
+    frame['Model'] = pd.Categorical(frame['Model'], categories=fpm.asr_models)
+    frame['RateType'] = pd.Categorical(frame['RateType'], categories=fpm.error_rates)
+    frame['SpeakingStyle'] = pd.Categorical(frame['SpeakingStyle'], categories=fpm.speaking_style_folders)
+    frame = frame.dropna(subset=['Model', 'RateType', 'SpeakingStyle'])
+    return frame.sort_values(['Model', 'RateType', 'SpeakingStyle'], kind='stable').reset_index(drop=True)
+
+
+def performance_difference(df, fpm, baseline_type='min', diff_type='absolute', frame=None, writer=None):
+    """
+    Calculate the performance difference of each group with respect to a baseline.
+
+    :param df: Error rates per group, keyed by 'model_group_style'.
+    :param fpm: FilepathManager holding the ASR models, error rates and speaking styles.
+    :param baseline_type: Either 'min' or 'norm' (mean).
+    :param diff_type: Either 'absolute' or 'relative'.
+    :param frame: Result of build_performance_frame, computed from df if not given.
+    :param writer: ResultsWriter used to write the results. Writes JSON if not given.
+    :return: Performance differences as {model: {group: [record, ...]}}.
+    """
+    if writer is None:
+        writer = ResultsWriter('json')
+
+    if baseline_type not in BASELINE_TYPES:
+        raise ValueError("Invalid baseline_type. Use 'min' or 'norm'.")
+    if diff_type not in DIFF_TYPES:
+        raise ValueError("Invalid diff_type. Use 'absolute' or 'relative'.")
+
+    if frame is None:
+        frame = build_performance_frame(df, fpm)
+
+    records = PerformanceRecords.from_frame(frame, diff_type, fpm.asr_models, [baseline_type])
+    performance_difference_df = records.to_performance_differences()
+
+    writer.write(f'results/bias/old/performance_difference_{baseline_type}_{diff_type}.json', performance_difference_df)
 
     return performance_difference_df
 
 
-def calculate_weighted_performance_bias(df, w1, w2):
+def calculate_weighted_performance_bias(df, w1, w2, writer=None):
     """
     Calculate Weighted Performance Bias (WPB).
 
-    :param df: The absolute performance difference dataframe.
+    :param df: PerformanceRecords, or the absolute performance difference dictionary.
     :param w1: Weight for performance difference.
     :param w2: Weight for base performance.
-    :param bp: Baseline performance.
+    :param writer: ResultsWriter used to write the results. Writes JSON if not given.
     :return: Weighted Performance Bias (WPB) for each model and group.
     """
-    weighted_bias = {model: {} for model in df.keys()}
+    if writer is None:
+        writer = ResultsWriter('json')
 
-    for model in df.keys():
-        for group in df[model].keys():
-            n = len(df[model][group])
-            total_bias = 0
-            for record in df[model][group]:
-                bp = record['BaselinePerformance']
-                pd_i = record['PerformanceDiff']
-                base_i = record['BasePerformance']
-                total_bias += (w1 * (pd_i / bp)) + (w2 * base_i)
+    records = as_performance_records(df)
+    tensor = records.to_tensor()
+    wpb = tensor.weighted_performance_bias(w1, w2)
 
-            weighted_bias[model][group] = total_bias / n
+    weighted_bias = {model: {} for model in records.models}
 
-    with open(f'results/bias/new/weighted_performance_bias.json', 'w') as file:
-        file.write(json.dumps(weighted_bias, indent=4))
+    for model in records.models:
+        model_index = tensor.index_of(MODEL_AXIS, model)
+        for group in records.groups_of(model):
+            weighted_bias[model][group] = float(wpb[model_index, tensor.index_of(GROUP_AXIS, group)])
+
+    writer.write(f'results/bias/new/weighted_performance_bias.json', weighted_bias)
 
     return weighted_bias
 
 
-def calculate_overall_weighted_performance_bias(df, w1, w2, fpm):
+def calculate_overall_weighted_performance_bias(df, w1, w2, fpm, writer=None):
     """
     Calculate overall Weighted Performance Bias (WPB).
 
-    :param df: The absolute performance difference dataframe.
+    :param df: PerformanceRecords, or the absolute performance difference dictionary.
     :param w1: Weight for performance difference.
     :param w2: Weight for base performance.
-    :param bp: Baseline performance.
+    :param fpm: FilepathManager holding the speaker groups and speaking styles.
+    :param writer: ResultsWriter used to write the results. Writes JSON if not given.
     :return: overall Weighted Performance Bias (WPB) for each model and group.
     """
-    overall_weighted_bias = {speech_type: {model: 0.0 for model in fpm.asr_models} for speech_type in fpm.speaking_style_folders}
+    if writer is None:
+        writer = ResultsWriter('json')
 
-    # Setup dataframe
-    for index, speech_type in enumerate(fpm.speaking_style_folders):
-        for model in df.keys():
-            total_bias = 0
-            for group in df[model].keys():
-                record = df[model][group][index]
-                bp = record['BaselinePerformance']
-                pd_i = record['PerformanceDiff']
-                base_i = record['BasePerformance']
-                total_bias += (w1 * (pd_i / bp)) + (w2 * base_i)
+    records = as_performance_records(df)
+    tensor = records.to_tensor()
+    # Only the 'min' baseline type and the reported error rate are taken into account
+    baseline_index, _, rate_index = get_reported_indices(tensor, rate_type=fpm.reported_error_rate)
+    terms = tensor.weighted_performance_terms(w1, w2)[baseline_index, :, :, :, rate_index]
+    total_bias = np.nansum(terms, axis=1)
 
-            # After total bias is known
-            overall_weighted_bias[speech_type][model] = float("{0:.2f}".format(100 * total_bias / len(fpm.speaker_groups)))
+    overall_weighted_bias = {speech_type: {model: 0.0 for model in fpm.asr_models} for speech_type in fpm.speaking_style_folders}
 
-    with open(f'results/bias/new/overall_weighted_performance_bias.json', 'w') as file:
-        file.write(json.dumps(overall_weighted_bias, indent=4))
+    for speech_type in fpm.speaking_style_folders:
+        style_index = tensor.index_of(STYLE_AXIS, speech_type)
+        for model in records.models:
+            model_bias = total_bias[tensor.index_of(MODEL_AXIS, model), style_index]
+            overall_weighted_bias[speech_type][model] = float("{0:.2f}".format(100 * model_bias / len(fpm.speaker_groups)))
+
+    writer.write(f'results/bias/new/overall_weighted_performance_bias.json', overall_weighted_bias)
 
     return overall_weighted_bias
 
 
-def calculate_intergroup_weighted_performance_bias(df, w1, w2):
+def calculate_intergroup_weighted_performance_bias(df, w1, w2, writer=None, speaking_style=None, rate_type=None):
     """
     Calculate Intergroup Weighted Performance Bias (IWPB).
 
-    :param df: The absolute performance difference dataframe.
+    :param df: PerformanceRecords, or the absolute performance difference dictionary.
     :param w1: Weight for performance difference.
     :param w2: Weight for base performance.
-    :param bp: Baseline performance.
+    :param writer: ResultsWriter used to write the results. Writes JSON if not given.
+    :param speaking_style: Speaking style to calculate the IWPB of, see get_reported_indices.
+    :param rate_type: Error rate to calculate the IWPB of, see get_reported_indices.
     :return: Intergroup Weighted Performance Bias (IWPB) for each model and group.
     """
-    intergroup_weighted_bias = {model: {} for model in df.keys()}
-
-    for model in df.keys():
-        groups = list(df[model].keys())
-        n = len(groups)
+    if writer is None:
+        writer = ResultsWriter('json')
 
-        for i in range(n):
-            group_i = groups[i]
-            base_i = df[model][group_i][0]['BasePerformance']  # Base performance for group i
-            total_bias = 0
-            count = 0
+    records = as_performance_records(df)
+    tensor = records.to_tensor()
+    # Only the 'min' baseline type, the reported speaking style and the reported error rate are taken into account
+    baseline_index, style_index, rate_index = get_reported_indices(tensor, speaking_style, rate_type)
+    iwpb = tensor.intergroup_weighted_performance_bias(w1, w2)[baseline_index, :, :, style_index, rate_index]
 
-            for j in range(n):
-                if i != j:
-                    group_j = groups[j]
-                    bp = df[model][group_j][0]['BaselinePerformance']
-                    base_j = df[model][group_j][0]['BasePerformance']  # Base performance for group j
-                    pd_ij = abs(base_i - base_j)
-                    total_bias += (w1 * (pd_ij / bp)) + (w2 * base_i)
-                    count += 1
+    intergroup_weighted_bias = {model: {} for model in records.models}
 
-            intergroup_weighted_bias[model][group_i] = total_bias / count if count != 0 else 0
+    for model in records.models:
+        model_index = tensor.index_of(MODEL_AXIS, model)
+        for group in records.groups_of(model):
+            intergroup_weighted_bias[model][group] = float(iwpb[model_index, tensor.index_of(GROUP_AXIS, group)])
 
-    with open(f'results/bias/new/intergroup_weighted_performance_bias.json', 'w') as file:
-        file.write(json.dumps(intergroup_weighted_bias, indent=4))
+    writer.write(f'results/bias/new/intergroup_weighted_performance_bias.json', intergroup_weighted_bias)
 
     return intergroup_weighted_bias
 
 
-def calculate_overall_intergroup_weighted_performance_bias(df, w1, w2, fpm):
+def calculate_overall_intergroup_weighted_performance_bias(df, w1, w2, fpm, writer=None):
     """
     Calculate overall Intergroup Weighted Performance Bias (IWPB) per speech type.
 
-    :param df: The performance difference dataframe.
+    :param df: PerformanceRecords, or the performance difference dictionary.
     :param w1: Weight for performance difference.
     :param w2: Weight for base performance.
-    :param bp: Baseline performance.
-    :return: total Intergroup Weighted Performance Bias (IWPB) for each model.
+    :param fpm: FilepathManager holding the speaker groups and speaking styles.
+    :param writer: ResultsWriter used to write the results. Writes JSON if not given.
+    :return: Intergroup Weighted Performance Bias (IWPB) for each speech type, model and group.
     """
+    if writer is None:
+        writer = ResultsWriter('json')
+
+    records = as_performance_records(df)
+    tensor = records.to_tensor()
+    # Only the 'min' baseline type and the reported error rate are taken into account
+    baseline_index, _, rate_index = get_reported_indices(tensor, rate_type=fpm.reported_error_rate)
+    iwpb = tensor.intergroup_weighted_performance_bias(w1, w2)[baseline_index, :, :, :, rate_index]
+
     intergroup_weighted_bias = {speech_type: {model: {} for model in fpm.asr_models} for speech_type in fpm.speaking_style_folders}
-    overall_intergroup_weighted_bias = {speech_type: {model: 0.0 for model in fpm.asr_models} for speech_type in
-                             fpm.speaking_style_folders}
-
-    for index, speech_type in enumerate(fpm.speaking_style_folders):
-        for model in df.keys():
-            groups = list(df[model].keys())
-            n = len(groups)
-
-            for i in range(n):
-                group_i = groups[i]
-                base_i = df[model][group_i][index]['BasePerformance']  # Base performance for group i
-                total_bias = 0
-                count = 0
-
-                for j in range(n):
-                    if i != j:
-                        group_j = groups[j]
-                        bp = df[model][group_j][index]['BaselinePerformance']
-                        base_j = df[model][group_j][index]['BasePerformance']  # Base performance for group j
-                        pd_ij = abs(base_i - base_j)
-                        total_bias += (w1 * (pd_ij / bp)) + (w2 * base_i)
-                        count += 1
-
-                if df[model][group_i][index]['SpeakingStyle'] == speech_type:
-                    intergroup_weighted_bias[speech_type][model][group_i] = total_bias / count if count != 0 else 0
-
-    # Calculate overall bias
-    for index, speech_type in enumerate(fpm.speaking_style_folders):
-        for model in df.keys():
-            average_bias = sum(intergroup_weighted_bias[speech_type][model].values()) / len(intergroup_weighted_bias[speech_type][model])
-            overall_intergroup_weighted_bias[speech_type][model] = float("{0:.2f}".format(100 * average_bias))
 
-    with open(f'results/bias/new/overall_intergroup_weighted_performance_bias.json', 'w') as file:
-        file.write(json.dumps(overall_intergroup_weighted_bias, indent=4))
+    for speech_type in fpm.speaking_style_folders:
+        style_index = tensor.index_of(STYLE_AXIS, speech_type)
+        for model in records.models:
+            model_index = tensor.index_of(MODEL_AXIS, model)
+            for group in records.groups_of(model):
+                group_bias = iwpb[model_index, tensor.index_of(GROUP_AXIS, group), style_index]
+                intergroup_weighted_bias[speech_type][model][group] = float(group_bias)
+
+    overall_intergroup_weighted_bias = get_overall_intergroup_weighted_performance_bias(intergroup_weighted_bias)
+    writer.write(f'results/bias/new/overall_intergroup_weighted_performance_bias.json', overall_intergroup_weighted_bias)
 
     return intergroup_weighted_bias
 
 
+def get_overall_intergroup_weighted_performance_bias(intergroup_weighted_bias):
+    """
+    Average the IWPB of the groups of every speech type and model.
+
+    :param intergroup_weighted_bias: IWPB for each speech type, model and group, as returned by
+        calculate_overall_intergroup_weighted_performance_bias.
+    :return: Overall IWPB for each speech type and model, as a percentage rounded to two decimals.
+    """
+    overall_intergroup_weighted_bias = {}
+
+    for speech_type, models in intergroup_weighted_bias.items():
+        overall_intergroup_weighted_bias[speech_type] = {}
+        for model, groups in models.items():
+            # Calculate overall bias, 0 for models without any group
+            average_bias = sum(groups.values()) / len(groups) if groups else 0.0
+            overall_intergroup_weighted_bias[speech_type][model] = float("{0:.2f}".format(100 * average_bias))
+
+    return overall_intergroup_weighted_bias
+
+
+def calculate_bias_per_error_rate(df, wpb_w1, wpb_w2, iwpb_w1, iwpb_w2, writer=None, speaking_style=None):
+    """
+    Calculate the Weighted Performance Bias (WPB) and Intergroup Weighted Performance Bias (IWPB) of every error rate
+    at once, from a single tensor holding all error rates.
+
+    :param df: PerformanceRecords, or the absolute performance difference dictionary.
+    :param wpb_w1: WPB weight for performance difference.
+    :param wpb_w2: WPB weight for base performance.
+    :param iwpb_w1: IWPB weight for performance difference.
+    :param iwpb_w2: IWPB weight for base performance.
+    :param writer: ResultsWriter used to write the results. Writes JSON if not given.
+    :param speaking_style: Speaking style to calculate the IWPB of, see get_reported_indices.
+    :return: Bias as {'wpb' or 'iwpb': {rate_type: {model: {group: bias}}}}. The WPB is averaged over the baseline
+        types and speaking styles, the IWPB only takes the 'min' baseline type and the reported speaking style into
+        account, as in calculate_weighted_performance_bias and calculate_intergroup_weighted_performance_bias.
+    """
+    if writer is None:
+        writer = ResultsWriter('json')
+
+    records = as_performance_records(df)
+    tensor = records.to_tensor()
+    # Arrays of shape (model, group, rate)
+    wpb = tensor.weighted_performance_bias(wpb_w1, wpb_w2, axis=(BASELINE_AXIS, STYLE_AXIS))
+    baseline_index, style_index, _ = get_reported_indices(tensor, speaking_style)
+    iwpb = tensor.intergroup_weighted_performance_bias(iwpb_w1, iwpb_w2)[baseline_index, :, :, style_index, :]
+
+    bias_per_error_rate = {}
+    for metric, values in (('wpb', wpb), ('iwpb', iwpb)):
+        bias_per_error_rate[metric] = {rate_type: {model: {} for model in records.models}
+                                       for rate_type in records.rate_types}
+        for rate_index, rate_type in enumerate(tensor.rate_types):
+            for model in records.models:
+                model_index = tensor.index_of(MODEL_AXIS, model)
+                for group in records.groups_of(model):
+                    bias_per_error_rate[metric][rate_type][model][group] = float(
+                        values[model_index, tensor.index_of(GROUP_AXIS, group), rate_index])
+
+    writer.write(f'results/bias/new/bias_per_error_rate.json', bias_per_error_rate)
+
+    return bias_per_error_rate
+
+
 def calculate_total_weighted_performance_bias(df, w1, w2):
     """
     Calculate total Weighted Performance Bias (WPB).
 
-    :param df: The performance difference dataframe.
+    :param df: PerformanceRecords, or the performance difference dictionary.
     :param w1: Weight for performance difference.
     :param w2: Weight for base performance.
-    :param bp: Baseline performance.
-    :return: total Weighted Performance Bias (IWPB) for each model.
+    :return: total Weighted Performance Bias (WPB) for each model, averaged over its groups.
     """
-    total_weighted_bias = {model: 0 for model in df.keys()}
+    models, bias = sweep_weights(df, [w1], metric='wpb', w2_values=[w2])
+    return {model: float(bias[0, index]) for index, model in enumerate(models)}
 
-    for model in df.keys():
-        for group in df[model].keys():
-            n = len(df[model][group])
-            total_bias = 0
-            for record in df[model][group]:
-                bp = record['BaselinePerformance']
-                pd_i = record['PerformanceDiff']
-                base_i = record['BasePerformance']
-                total_bias += (w1 * (pd_i / bp)) + (w2 * base_i)
 
-        total_weighted_bias[model] = total_bias / n
-
-    return total_weighted_bias
-
-
-def calculate_total_intergroup_weighted_performance_bias(df, w1, w2):
+@memoize
+def calculate_total_intergroup_weighted_performance_bias(df, w1, w2, speaking_style=None, rate_type=None):
     """
     Calculate total Intergroup Weighted Performance Bias (IWPB).
 
-    :param df: The performance difference dataframe.
+    :param df: PerformanceRecords, or the performance difference dictionary.
     :param w1: Weight for performance difference.
     :param w2: Weight for base performance.
-    :param bp: Baseline performance.
+    :param speaking_style: Speaking style to calculate the IWPB of, see get_reported_indices.
+    :param rate_type: Error rate to calculate the IWPB of, see get_reported_indices.
     :return: total Intergroup Weighted Performance Bias (IWPB) for each model.
     """
-    total_intergroup_weighted_bias = {model: 0 for model in df.keys()}
+    records = as_performance_records(df)
+    tensor = records.to_tensor()
+    total_iwpb = tensor.total_intergroup_weighted_performance_bias(w1, w2, *get_reported_indices(tensor, speaking_style,
+                                                                                                  rate_type))
+
+    return {model: float(total_iwpb[tensor.index_of(MODEL_AXIS, model)]) for model in records.models}
+
+
+@memoize
+def get_bias_components(df, metric='iwpb', speaking_style=None, rate_type=None):
+    """
+    Calculate the two weight-independent components of the total WPB or IWPB of each model.
+
+    Both metrics are linear in the weights, total = w1 * performance_component + w2 * base_component, so these two
+    aggregates are sufficient to evaluate the metric for any weight.
+
+    :param df: PerformanceRecords, or the performance difference dictionary.
+    :param metric: Either 'wpb' or 'iwpb'.
+    :param speaking_style: Speaking style to calculate the IWPB of, see get_reported_indices. The WPB is averaged
+        over all speaking styles.
+    :param rate_type: Error rate to calculate the IWPB of, see get_reported_indices. The WPB is averaged over all
+        error rates.
+    :return: Tuple of (models, performance_component, base_component), the components being arrays of shape (model,).
+    """
+    records = as_performance_records(df)
+    tensor = records.to_tensor()
+
+    if metric == 'wpb':
+        performance_component, base_component = tensor.weighted_performance_components()
+    elif metric == 'iwpb':
+        performance_component, base_component = tensor.intergroup_weighted_performance_components(
+            *get_reported_indices(tensor, speaking_style, rate_type))
+    else:
+        raise ValueError("Invalid metric. Use 'wpb' or 'iwpb'.")
+
+    # Average over the groups of each model
+    return tensor.models, np.nanmean(performance_component, axis=1), np.nanmean(base_component, axis=1)
+
+
+def sweep_weights(df, w1_values, metric='iwpb', w2_values=None, speaking_style=None, rate_type=None):
+    """
+    Calculate the total WPB or IWPB of each model for every weight in a grid, in a single pass over the data.
+
+    :param df: PerformanceRecords, or the performance difference dictionary.
+    :param w1_values: Weights for performance difference.
+    :param metric: Either 'wpb' or 'iwpb'.
+    :param w2_values: Weights for base performance. Defaults to 1 - w1 for every w1.
+    :param speaking_style: Speaking style of the IWPB, see get_bias_components.
+    :param rate_type: Error rate of the IWPB, see get_bias_components.
+    :return: Tuple of (models, bias), with bias an array of shape (len(w1_values), len(models)).
+    """
+    models, performance_component, base_component = get_bias_components(df, metric, speaking_style, rate_type)
+    w1_values = np.asarray(w1_values, dtype=float)
+
+    if w2_values is None:
+        return models, sweep_linear_weights(performance_component, base_component, w1_values)
 
-    for model in df.keys():
-        groups = list(df[model].keys())
-        n = len(groups)
-        total_bias = 0
+    w2_values = np.asarray(w2_values, dtype=float)
+    return models, np.outer(w1_values, performance_component) + np.outer(w2_values, base_component)
 
-        for i in range(n):
-            base_i = df[model][groups[i]][0]['BasePerformance']  # Base performance for group i
 
-            for j in range(n):
-                if i != j:
-                    bp = df[model][groups[j]][0]['BaselinePerformance']
-                    base_j = df[model][groups[j]][0]['BasePerformance']  # Base performance for group j
-                    pd_ij = abs(base_i - base_j)
-                    total_bias += (w1 * (pd_ij / bp)) + (w2 * base_i)
+def get_optimal_weights(df, metric='iwpb', speaking_style=None, rate_type=None):
+    """
+    Find the w1, with w2 = 1 - w1, that minimises the total WPB or IWPB of each model.
+
+    :param df: PerformanceRecords, or the performance difference dictionary.
+    :param metric: Either 'wpb' or 'iwpb'.
+    :param speaking_style: Speaking style of the IWPB, see get_bias_components.
+    :param rate_type: Error rate of the IWPB, see get_bias_components.
+    :return: Dictionary with model names as keys and the optimal w1 value as values.
+    """
+    models, performance_component, base_component = get_bias_components(df, metric, speaking_style, rate_type)
+    optimal_w1 = optimal_linear_weight(performance_component, base_component)
+    return {model: float(optimal_w1[index]) for index, model in enumerate(models)}
 
-        total_intergroup_weighted_bias[model] = total_bias / (n * (n - 1))
 
-    return total_intergroup_weighted_bias
\ No newline at end of file
+def get_reported_indices(tensor, speaking_style=None, rate_type=None):
+    """
+    Look up the slice of a tensor that the IWPB is reported for, by the labels of its axes rather than their order.
+
+    :param tensor: PerformanceTensor.
+    :param speaking_style: Speaking style, e.g. the reported_speaking_style of the FilepathManager. Defaults to the
+        first speaking style of the tensor.
+    :param rate_type: Error rate, e.g. the reported_error_rate of the FilepathManager. Defaults to the first error rate
+        of the tensor.
+    :return: Tuple of the indices of the 'min' baseline type, the speaking style and the error rate.
+    """
+    speaking_style = tensor.speaking_styles[0] if speaking_style is None else speaking_style
+    rate_type = tensor.rate_types[0] if rate_type is None else rate_type
+    if speaking_style not in tensor.speaking_styles:
+        raise ValueError(f"No results for the speaking style {speaking_style}.")
+    if rate_type not in tensor.rate_types:
+        raise ValueError(f"No results for the error rate {rate_type}.")
+
+    return (tensor.index_of(BASELINE_AXIS, BASELINE_TYPES[0]), tensor.index_of(STYLE_AXIS, speaking_style),
+            tensor.index_of(RATE_AXIS, rate_type))
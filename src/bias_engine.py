@@ -0,0 +1,351 @@
+import warnings
+
+import numpy as np
+
+# Axes of the dense performance difference arrays, counted from the end so that leading dimensions (e.g. bootstrap
+# resamples) are supported
+BASELINE_AXIS = -5
+MODEL_AXIS = -4
+GROUP_AXIS = -3
+STYLE_AXIS = -2
+RATE_AXIS = -1
+
+# Baseline types of tensors built from error rates
+BASELINE_TYPES = ['min', 'norm']
+
+
+class PerformanceTensor:
+    """
+    Dense, array-backed representation of the performance difference data.
+
+    Packs the nested {model: {group: [record, ...]}} structure produced by `performance_difference` into arrays of
+    shape (baseline type, model, group, speaking style, rate type), so that the bias metrics can be computed with
+    broadcasting instead of nested loops. Combinations that are missing from the input are stored as NaN. The arrays
+    may have additional leading dimensions, e.g. one per bootstrap resample.
+
+    With intersectional groups, a speaker belongs to a group of every intersection, so the IWPB only compares the
+    groups of the same intersection.
+
+    Attributes:
+        baseline_types: Baseline types, in the order of the baseline axis.
+        models: ASR model names, in the order of the model axis.
+        groups: Speaker group names, in the order of the group axis.
+        speaking_styles: Speaking styles, in the order of the style axis.
+        rate_types: Error rate types, in the order of the rate axis.
+        performance_diff: Performance difference of each group with respect to the baseline.
+        base_performance: Error rate of each group.
+        baseline_performance: Baseline error rate the group was compared against.
+        intersections: Intersection of every group, in the order of the group axis, or None if all groups are
+            compared with each other.
+    """
+
+    def __init__(self, baseline_types, models, groups, speaking_styles, rate_types, performance_diff,
+                 base_performance, baseline_performance, intersections=None):
+        self.baseline_types = list(baseline_types)
+        self.models = list(models)
+        self.groups = list(groups)
+        self.speaking_styles = list(speaking_styles)
+        self.rate_types = list(rate_types)
+        self.performance_diff = performance_diff
+        self.base_performance = base_performance
+        self.baseline_performance = baseline_performance
+        self.intersections = None if intersections is None else list(intersections)
+
+    @classmethod
+    def from_performance_differences(cls, df):
+        """
+        Build a tensor from the nested performance difference dictionary.
+
+        The order of every axis follows the order in which its labels are first encountered, so index 0 of each
+        axis corresponds to the first record of the first group, as used by the positional dict-based metrics.
+
+        :param df: The performance difference dictionary, {model: {group: [record, ...]}}.
+        :return: PerformanceTensor holding the same data.
+        """
+        labels = {'BaselineType': {}, 'Group': {}, 'SpeakingStyle': {}, 'RateType': {}}
+        models = {model: index for index, model in enumerate(df.keys())}
+        intersections = {}
+
+        for groups in df.values():
+            for group, records in groups.items():
+                labels['Group'].setdefault(group, len(labels['Group']))
+                for record in records:
+                    for field in ('BaselineType', 'SpeakingStyle', 'RateType'):
+                        labels[field].setdefault(record[field], len(labels[field]))
+                    intersections.setdefault(group, record.get('Intersection'))
+
+        shape = (len(labels['BaselineType']), len(models), len(labels['Group']), len(labels['SpeakingStyle']),
+                 len(labels['RateType']))
+        performance_diff = np.full(shape, np.nan)
+        base_performance = np.full(shape, np.nan)
+        baseline_performance = np.full(shape, np.nan)
+
+        for model, groups in df.items():
+            for group, records in groups.items():
+                for record in records:
+                    index = (labels['BaselineType'][record['BaselineType']], models[model], labels['Group'][group],
+                             labels['SpeakingStyle'][record['SpeakingStyle']], labels['RateType'][record['RateType']])
+                    performance_diff[index] = record['PerformanceDiff']
+                    base_performance[index] = record['BasePerformance']
+                    baseline_performance[index] = record['BaselinePerformance']
+
+        # Records of intersectional groups hold the intersection of their group
+        intersections = [intersections.get(group) for group in labels['Group']]
+        return cls(labels['BaselineType'], models, labels['Group'], labels['SpeakingStyle'], labels['RateType'],
+                   performance_diff, base_performance, baseline_performance,
+                   intersections if any(intersection is not None for intersection in intersections) else None)
+
+    @classmethod
+    def from_rates(cls, rates, models, groups, speaking_styles, rate_types, intersections=None):
+        """
+        Build a tensor of absolute performance differences directly from the error rates of each group.
+
+        Uses the same 'min' and 'norm' (mean) baselines as `performance_difference`.
+
+        :param rates: Array of shape (..., model, group, style, rate) with the error rate of each group, NaN if
+            missing. Leading dimensions are kept.
+        :param models: ASR model names.
+        :param groups: Speaker group names.
+        :param speaking_styles: Speaking styles.
+        :param rate_types: Error rate types.
+        :param intersections: Optional intersection of every group. The baselines are then taken over the groups of
+            each intersection.
+        :return: PerformanceTensor with the absolute performance differences.
+        """
+        rates = np.asarray(rates, dtype=float)
+
+        with warnings.catch_warnings():
+            # Groups missing for a whole model and speaking style result in a NaN baseline
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            if intersections is None:
+                baselines = [np.nanmin(rates, axis=GROUP_AXIS, keepdims=True),
+                             np.nanmean(rates, axis=GROUP_AXIS, keepdims=True)]
+            else:
+                baselines = [np.empty(rates.shape), np.empty(rates.shape)]
+                for members in get_intersection_members(intersections, rates.shape[GROUP_AXIS]):
+                    members_rates = rates[..., members, :, :]
+                    baselines[0][..., members, :, :] = np.nanmin(members_rates, axis=GROUP_AXIS, keepdims=True)
+                    baselines[1][..., members, :, :] = np.nanmean(members_rates, axis=GROUP_AXIS, keepdims=True)
+
+        baseline_performance, base_performance = np.broadcast_arrays(np.stack(baselines, axis=BASELINE_AXIS),
+                                                                     np.expand_dims(rates, BASELINE_AXIS))
+        performance_diff = np.abs(base_performance - baseline_performance)
+
+        return cls(BASELINE_TYPES, models, groups, speaking_styles, rate_types, performance_diff, base_performance,
+                   baseline_performance, intersections)
+
+    def weighted_performance_terms(self, w1, w2):
+        """
+        Calculate the Weighted Performance Bias (WPB) term of every record.
+
+        :param w1: Weight for performance difference.
+        :param w2: Weight for base performance.
+        :return: Array of shape (..., baseline, model, group, style, rate).
+        """
+        return weighted_performance_terms(self.performance_diff, self.baseline_performance, self.base_performance,
+                                          w1, w2)
+
+    def weighted_performance_bias(self, w1, w2, axis=(BASELINE_AXIS, STYLE_AXIS, RATE_AXIS)):
+        """
+        Calculate the Weighted Performance Bias (WPB), averaged over all records of each model and group.
+
+        :param w1: Weight for performance difference.
+        :param w2: Weight for base performance.
+        :param axis: Axes to average over. Defaults to all but the model and group axes.
+        :return: Array of shape (..., model, group) for the default axes.
+        """
+        terms = self.weighted_performance_terms(w1, w2)
+        return _nanmean(terms, axis=axis)
+
+    def intergroup_weighted_performance_bias(self, w1, w2):
+        """
+        Calculate the Intergroup Weighted Performance Bias (IWPB) of every group against all other groups of its
+        intersection.
+
+        :param w1: Weight for performance difference.
+        :param w2: Weight for base performance.
+        :return: Array of shape (..., baseline, model, group, style, rate).
+        """
+        return intergroup_weighted_performance_terms(self.base_performance, self.baseline_performance, w1, w2,
+                                                     intersections=self.intersections)
+
+    def total_intergroup_weighted_performance_bias(self, w1, w2, baseline_index=0, style_index=0, rate_index=0):
+        """
+        Calculate the total Intergroup Weighted Performance Bias (IWPB), i.e. the average over all group pairs.
+
+        :param w1: Weight for performance difference.
+        :param w2: Weight for base performance.
+        :param baseline_index: Index of the baseline type to use.
+        :param style_index: Index of the speaking style to use.
+        :param rate_index: Index of the rate type to use.
+        :return: Array of shape (..., model).
+        """
+        iwpb = self.intergroup_weighted_performance_bias(w1, w2)[..., baseline_index, :, :, style_index, rate_index]
+        return _nanmean(iwpb, axis=-1)
+
+    def weighted_performance_components(self, axis=(BASELINE_AXIS, STYLE_AXIS, RATE_AXIS)):
+        """
+        Split the Weighted Performance Bias (WPB) into its two weight-independent components.
+
+        WPB is linear in the weights: WPB = w1 * performance_component + w2 * base_component.
+
+        :param axis: Axes to average over. Defaults to all but the model and group axes.
+        :return: Tuple of (performance_component, base_component), both arrays of shape (..., model, group) for
+            the default axes.
+        """
+        normalised_diff = self.performance_diff / self.baseline_performance
+        return _nanmean(normalised_diff, axis=axis), _nanmean(self.base_performance, axis=axis)
+
+    def intergroup_weighted_performance_components(self, baseline_index=0, style_index=0, rate_index=0):
+        """
+        Split the Intergroup Weighted Performance Bias (IWPB) into its two weight-independent components.
+
+        IWPB is linear in the weights: IWPB = w1 * performance_component + w2 * base_component.
+
+        :param baseline_index: Index of the baseline type to use.
+        :param style_index: Index of the speaking style to use, or slice(None) to keep the style axis.
+        :param rate_index: Index of the rate type to use, or slice(None) to keep the rate axis.
+        :return: Tuple of (performance_component, base_component), both arrays of shape (..., model, group),
+            followed by the style and rate axes if they are kept.
+        """
+        differences, count = intergroup_differences(self.base_performance, self.baseline_performance,
+                                                    intersections=self.intersections)
+        selection = (Ellipsis, baseline_index, slice(None), slice(None), style_index, rate_index)
+        differences, count = differences[selection], count[selection]
+        # Groups without any other group to compare against have an IWPB of 0
+        base = np.where(count != 0, self.base_performance[selection], np.where(np.isnan(differences), np.nan, 0.0))
+        return differences, base
+
+    def index_of(self, axis, label):
+        """
+        Look up the position of a label along one of the axes.
+
+        :param axis: One of the *_AXIS constants.
+        :param label: The label to look up.
+        :return: Index of the label along the axis.
+        """
+        labels = [self.baseline_types, self.models, self.groups, self.speaking_styles, self.rate_types][axis]
+        return labels.index(label)
+
+
+def weighted_performance_terms(performance_diff, baseline_performance, base_performance, w1, w2):
+    """
+    Calculate WPB terms, w1 * (pd / bp) + w2 * base, element-wise.
+
+    :param performance_diff: Array of performance differences.
+    :param baseline_performance: Array of baseline performances, broadcastable to performance_diff.
+    :param base_performance: Array of base performances, broadcastable to performance_diff.
+    :param w1: Weight for performance difference.
+    :param w2: Weight for base performance.
+    :return: Array of WPB terms.
+    """
+    return (w1 * (performance_diff / baseline_performance)) + (w2 * base_performance)
+
+
+def intergroup_differences(base_performance, baseline_performance, group_axis=-3, intersections=None):
+    """
+    Calculate the mean normalised pairwise difference of every group to all other groups.
+
+    For group i this is the mean over all groups j != i of |base_i - base_j| / bp_j. Missing groups (NaN) are left
+    out of the mean; a group without any other group to compare against gets 0.
+
+    :param base_performance: Array of base performances, with groups along group_axis.
+    :param baseline_performance: Array of baseline performances, broadcastable to base_performance.
+    :param group_axis: Axis holding the groups. Defaults to the group axis counted from the end, so leading batch
+        dimensions are supported.
+    :param intersections: Optional intersection of every group. Groups are then only compared with the other groups
+        of their intersection.
+    :return: Tuple of (mean normalised differences, number of groups compared against), both shaped like
+        base_performance.
+    """
+    base_performance, baseline_performance = np.broadcast_arrays(base_performance, baseline_performance)
+    base = np.moveaxis(base_performance, group_axis, -1)
+    bp = np.moveaxis(baseline_performance, group_axis, -1)
+
+    valid = ~np.isnan(base)
+    pairwise = np.abs(base[..., :, np.newaxis] - base[..., np.newaxis, :]) / bp[..., np.newaxis, :]
+    if intersections is None:
+        count = valid.sum(axis=-1, keepdims=True) - valid
+    else:
+        intersections = np.asarray(intersections, dtype=object)
+        same = intersections[:, np.newaxis] == intersections[np.newaxis, :]
+        pairwise = np.where(same, pairwise, np.nan)
+        count = (valid[..., np.newaxis, :] & same).sum(axis=-1) - valid
+    total = np.nansum(pairwise, axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count != 0, total / np.where(count != 0, count, 1), 0.0)
+    mean = np.where(valid, mean, np.nan)
+
+    return np.moveaxis(mean, -1, group_axis), np.moveaxis(count, -1, group_axis)
+
+
+def intergroup_weighted_performance_terms(base_performance, baseline_performance, w1, w2, group_axis=-3,
+                                          intersections=None):
+    """
+    Calculate the IWPB of every group, the mean over all other groups of w1 * (|base_i - base_j| / bp_j) + w2 * base_i.
+
+    :param base_performance: Array of base performances, with groups along group_axis.
+    :param baseline_performance: Array of baseline performances, broadcastable to base_performance.
+    :param w1: Weight for performance difference.
+    :param w2: Weight for base performance.
+    :param group_axis: Axis holding the groups.
+    :param intersections: Optional intersection of every group, see intergroup_differences.
+    :return: Array of IWPB values, shaped like base_performance. Groups without any other group get 0.
+    """
+    differences, count = intergroup_differences(base_performance, baseline_performance, group_axis, intersections)
+    iwpb = (w1 * differences) + (w2 * np.broadcast_to(base_performance, differences.shape))
+    return np.where(count != 0, iwpb, np.where(np.isnan(differences), np.nan, 0.0))
+
+
+def sweep_linear_weights(performance_component, base_component, w1_values):
+    """
+    Evaluate a bias metric that is linear in (w1, w2), with w2 = 1 - w1, for every weight in w1_values at once.
+
+    :param performance_component: Array with the coefficient of w1.
+    :param base_component: Array with the coefficient of w2, same shape as performance_component.
+    :param w1_values: 1-D array of w1 values.
+    :return: Array of shape (len(w1_values), *performance_component.shape).
+    """
+    w1_values = np.asarray(w1_values, dtype=float).reshape((-1,) + (1,) * np.ndim(performance_component))
+    return (w1_values * performance_component) + ((1 - w1_values) * base_component)
+
+
+def optimal_linear_weight(performance_component, base_component):
+    """
+    Find the w1 in [0, 1] that minimises a bias metric that is linear in (w1, w2), with w2 = 1 - w1.
+
+    The metric equals base_component + w1 * (performance_component - base_component), so its minimum lies at
+    w1 = 1 when the performance component is the smaller one and at w1 = 0 otherwise (including ties, matching the
+    first minimum of a grid search).
+
+    :param performance_component: Array with the coefficient of w1.
+    :param base_component: Array with the coefficient of w2.
+    :return: Array of optimal w1 values, shaped like the components.
+    """
+    return np.where(performance_component < base_component, 1.0, 0.0)
+
+
+def _nanmean(values, axis):
+    # Mean over the available values only, NaN where nothing is available
+    count = np.sum(~np.isnan(values), axis=axis)
+    total = np.nansum(values, axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count != 0, total / np.where(count != 0, count, 1), np.nan)
+
+
+def get_intersection_members(intersections, n_groups):
+    """
+    Divide the groups over their intersections.
+
+    :param intersections: Intersection of every group, or None if all groups are compared with each other.
+    :param n_groups: Number of groups.
+    :return: List with an array of the indices of the groups of every intersection, in order of first occurrence.
+    """
+    if intersections is None:
+        return [np.arange(n_groups)]
+
+    positions = {}
+    for index, intersection in enumerate(intersections):
+        positions.setdefault(intersection, []).append(index)
+    return [np.array(members) for members in positions.values()]
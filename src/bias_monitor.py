@@ -0,0 +1,282 @@
+import collections
+import time
+import warnings
+
+import numpy as np
+
+from .bias_engine import BASELINE_TYPES
+from .process import CHARACTER_RATES, COUNT_COLUMNS, ERROR_RATES
+from .transcripts import align, tokenize
+
+WINDOWS = ['cumulative', 'sliding', 'decay']
+
+
+class BiasMonitor:
+    """
+    Streaming accumulator of the error counts of every ASR model, speaker group and speaking style, which keeps the
+    WPB and IWPB up to date as results arrive.
+
+    Every update adds the Sub, Ins, Del, Corr and # Wrd counts of, e.g., one utterance to a single counter. As the
+    baselines only depend on the groups of the same model and speaking style, only that slice is recomputed: the
+    error rates of its groups from their counts, the 'min' and 'norm' baselines, and the WPB and IWPB of every group.
+    The pairwise differences of the IWPB are all normalised by the 'min' baseline of the slice, so their sums are
+    found from the sorted error rates and their prefix sums rather than by comparing all pairs of groups. An update
+    therefore costs O(G log G) for G groups, independent of the amount of data seen. With a cumulative window the
+    results equal those of the batch pipeline on the same counts.
+
+    The window determines which counts contribute. 'cumulative' keeps all counts, 'sliding' only those of the last
+    window_size seconds, and 'decay' weighs counts by 0.5 ** (age / window_size), so window_size is the half-life.
+    Decay scales all counters of a slice at once and so leaves its error rates unchanged between updates; counts
+    leave a sliding window when their slice is updated, or for all slices at once with advance. The window follows the
+    timestamps of the counts rather than the clock, so a stream of historic results, e.g. replayed from a file, is
+    windowed as it was recorded.
+
+    Attributes:
+        models: ASR model names.
+        groups: Speaker group names.
+        speaking_styles: Speaking styles.
+        rate_types: Error rate types.
+        window: One of WINDOWS.
+        window_size: Length of the sliding window or half-life of the decay, in seconds.
+        wpb_w1: Weight for performance difference of the WPB.
+        wpb_w2: Weight for base performance of the WPB.
+        iwpb_w1: Weight for performance difference of the IWPB.
+        iwpb_w2: Weight for base performance of the IWPB.
+        counts: Array of shape (model, group, style, count) with the counts in the order of COUNT_COLUMNS.
+        rates: Array of shape (model, group, style, rate) with the error rates, NaN for groups without words.
+        baselines: Array of shape (baseline, model, style, rate) with the 'min' and 'norm' baselines.
+        wpb: Array of shape (model, group, style, rate) with the WPB, averaged over the baseline types.
+        iwpb: Array of shape (model, group, style, rate) with the IWPB.
+        n_updates: Number of updates so far.
+        latest: Latest timestamp of the counts so far, -inf before the first update.
+    """
+
+    def __init__(self, models, groups, speaking_styles, rate_types, window='cumulative', window_size=None,
+                 wpb_w1=0.5, wpb_w2=None, iwpb_w1=0.5, iwpb_w2=None):
+        if window not in WINDOWS:
+            raise ValueError(f"Invalid window. Use one of {', '.join(WINDOWS)}.")
+        if window != 'cumulative' and not (window_size or 0) > 0:
+            raise ValueError(f"The '{window}' window requires a positive window_size.")
+        character_rates = [rate_type for rate_type in rate_types if rate_type in CHARACTER_RATES]
+        if character_rates:
+            raise ValueError(f"The monitor only accumulates the counts of one alignment, so it cannot calculate the "
+                             f"error_rates {character_rates}.")
+
+        self.models = list(models)
+        self.groups = list(groups)
+        self.speaking_styles = list(speaking_styles)
+        self.rate_types = list(rate_types)
+        self.window = window
+        self.window_size = window_size
+        self.wpb_w1 = wpb_w1
+        self.wpb_w2 = 1 - wpb_w1 if wpb_w2 is None else wpb_w2
+        self.iwpb_w1 = iwpb_w1
+        self.iwpb_w2 = 1 - iwpb_w1 if iwpb_w2 is None else iwpb_w2
+
+        shape = (len(self.models), len(self.groups), len(self.speaking_styles))
+        self.counts = np.zeros(shape + (len(COUNT_COLUMNS),))
+        self.rates = np.full(shape + (len(self.rate_types),), np.nan)
+        self.baselines = np.full((len(BASELINE_TYPES), len(self.models), len(self.speaking_styles),
+                                  len(self.rate_types)), np.nan)
+        self.wpb = np.full(self.rates.shape, np.nan)
+        self.iwpb = np.full(self.rates.shape, np.nan)
+        self.n_updates = 0
+        self.latest = -np.inf
+
+        # Time of the last update of every slice, and the counts in the sliding window of every slice
+        self._times = np.full((len(self.models), len(self.speaking_styles)), -np.inf)
+        self._entries = {}
+
+    def update(self, model, group, speaking_style, counts, timestamp=None):
+        """
+        Add counts to a counter and recompute the bias of its model and speaking style.
+
+        :param model: ASR model name.
+        :param group: Speaker group name.
+        :param speaking_style: Speaking style.
+        :param counts: Sub, Ins, Del, Corr and # Wrd counts, as a sequence in that order or a mapping with
+            COUNT_COLUMNS as keys.
+        :param timestamp: Time of the counts in seconds, e.g. from time.time(). Defaults to now.
+        """
+        model_index = _index_of(self.models, model, 'model')
+        group_index = _index_of(self.groups, group, 'speaker group')
+        style_index = _index_of(self.speaking_styles, speaking_style, 'speaking style')
+
+        if isinstance(counts, dict):
+            counts = [counts[column] for column in COUNT_COLUMNS]
+        counts = np.asarray(counts, dtype=np.float64)
+        if counts.shape != (len(COUNT_COLUMNS),):
+            raise ValueError(f"Invalid counts. Give the {', '.join(COUNT_COLUMNS)} counts.")
+
+        timestamp = time.time() if timestamp is None else timestamp
+        slice_counts = self.counts[model_index, :, style_index]
+        last = self._times[model_index, style_index]
+
+        if self.window == 'decay':
+            if timestamp >= last:
+                if np.isfinite(last):
+                    slice_counts *= 0.5 ** ((timestamp - last) / self.window_size)
+            else:
+                # Counts arriving out of order are decayed to the time of the slice
+                counts = counts * 0.5 ** ((last - timestamp) / self.window_size)
+        elif self.window == 'sliding':
+            self._entries.setdefault((model_index, style_index), collections.deque()).append(
+                (timestamp, group_index, counts))
+
+        slice_counts[group_index] += counts
+        self._times[model_index, style_index] = max(last, timestamp)
+        self.latest = max(self.latest, timestamp)
+        self.n_updates += 1
+
+        if self.window == 'sliding':
+            self._evict(model_index, style_index, self._times[model_index, style_index])
+
+        self._refresh(model_index, style_index)
+
+    def update_transcript(self, model, group, speaking_style, reference, hypothesis, unit='word', timestamp=None):
+        """
+        Align a transcript and add its counts, see update.
+
+        :param model: ASR model name.
+        :param group: Speaker group name.
+        :param speaking_style: Speaking style.
+        :param reference: Reference text.
+        :param hypothesis: Recognised text.
+        :param unit: Token unit, see tokenize.
+        :param timestamp: Time of the transcript in seconds. Defaults to now.
+        """
+        reference = tokenize(reference, unit)
+        substitutions, insertions, deletions, hits = align(reference, tokenize(hypothesis, unit))
+        self.update(model, group, speaking_style, [substitutions, insertions, deletions, hits, len(reference)],
+                    timestamp)
+
+    def advance(self, timestamp=None):
+        """
+        Remove the counts that left the sliding window from all slices, e.g. before reporting when some models or
+        speaking styles received no recent updates. Other windows are not affected.
+
+        :param timestamp: Current time in seconds. Defaults to the latest timestamp of the counts, so counts with
+            historic timestamps are not all removed.
+        """
+        if self.window != 'sliding':
+            return
+
+        timestamp = self.latest if timestamp is None else timestamp
+        for model_index, style_index in list(self._entries):
+            if self._evict(model_index, style_index, timestamp):
+                self._refresh(model_index, style_index)
+
+    def get_bias(self):
+        """
+        :return: Dictionary with 'wpb' and 'iwpb' keys and {rate_type: {speaking_style: {model: {group: value}}}}
+            dictionaries as values, as calculate_speaker_level_bias. Groups without words are left out.
+        """
+        return {metric: {rate_type: {speaking_style: {model: {
+            group: float(values[model_index, group_index, style_index, rate_index])
+            for group_index, group in enumerate(self.groups)
+            if not np.isnan(values[model_index, group_index, style_index, rate_index])}
+            for model_index, model in enumerate(self.models)}
+            for style_index, speaking_style in enumerate(self.speaking_styles)}
+            for rate_index, rate_type in enumerate(self.rate_types)}
+            for metric, values in (('wpb', self.wpb), ('iwpb', self.iwpb))}
+
+    def get_totals(self):
+        """
+        :return: Dictionary with 'wpb' and 'iwpb' keys and the bias of every model, averaged over its groups,
+            speaking styles and error rates, as values. Models without words have a bias of None.
+        """
+        with warnings.catch_warnings():
+            # Models without any words result in NaN
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            totals = {metric: np.nanmean(values, axis=(1, 2, 3)) for metric, values in (('wpb', self.wpb),
+                                                                                          ('iwpb', self.iwpb))}
+
+        return {metric: {model: None if np.isnan(values[index]) else float(values[index])
+                         for index, model in enumerate(self.models)}
+                for metric, values in totals.items()}
+
+    def _evict(self, model_index, style_index, timestamp):
+        # Subtract the counts that are older than the window, returning whether any were removed
+        entries = self._entries.get((model_index, style_index))
+        removed = False
+        while entries and entries[0][0] <= timestamp - self.window_size:
+            _, group_index, counts = entries.popleft()
+            self.counts[model_index, group_index, style_index] -= counts
+            removed = True
+
+        if removed:
+            # Guard against rounding errors of fractional counts
+            np.maximum(self.counts[model_index, :, style_index], 0, out=self.counts[model_index, :, style_index])
+        return removed
+
+    def _refresh(self, model_index, style_index):
+        # Recompute the error rates, baselines, WPB and IWPB of all groups of a model and speaking style
+        counts = self.counts[model_index, :, style_index]
+
+        with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+            # Groups without words and slices without any group result in NaN
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+
+            rates = np.stack([ERROR_RATES[rate_type](*counts.T) for rate_type in self.rate_types], axis=-1)
+            rates[counts[:, COUNT_COLUMNS.index('# Wrd')] <= 0] = np.nan
+            baselines = np.stack([np.nanmin(rates, axis=0), np.nanmean(rates, axis=0)])
+
+            wpb = np.nanmean((self.wpb_w1 * (np.abs(rates - baselines[:, np.newaxis]) / baselines[:, np.newaxis])) +
+                             (self.wpb_w2 * rates), axis=0)
+
+            differences, count = _mean_absolute_differences(rates)
+            iwpb = (self.iwpb_w1 * differences / baselines[0]) + (self.iwpb_w2 * rates)
+            # Groups without any other group to compare against have an IWPB of 0
+            iwpb = np.where(count != 0, iwpb, np.where(np.isnan(rates), np.nan, 0.0))
+
+        self.rates[model_index, :, style_index] = rates
+        self.baselines[:, model_index, style_index] = baselines
+        self.wpb[model_index, :, style_index] = wpb
+        self.iwpb[model_index, :, style_index] = iwpb
+
+
+def apply_event(monitor, event, unit='word'):
+    """
+    Update a monitor with a result, e.g. one line of a JSON lines stream.
+
+    :param monitor: BiasMonitor to update.
+    :param event: Dictionary with 'model', 'group' and 'speaking_style' fields, an optional 'timestamp' in seconds,
+        and either the Sub, Ins, Del, Corr and # Wrd counts or a 'reference' and 'hypothesis' transcript.
+    :param unit: Token unit of transcripts, see tokenize.
+    """
+    labels = (event['model'], event['group'], event['speaking_style'])
+    if 'reference' in event:
+        monitor.update_transcript(*labels, event['reference'], event['hypothesis'], unit, event.get('timestamp'))
+    else:
+        monitor.update(*labels, event, event.get('timestamp'))
+
+
+def _mean_absolute_differences(rates):
+    # Mean absolute difference of every group to all other groups with an error rate, per column, from the sorted
+    # error rates: sum_j |x_i - x_j| = x_i * (i - (n - 1 - i)) - P_i + (P_n - P_(i+1)) for sorted x and prefix sums P
+    differences = np.full(rates.shape, np.nan)
+    count = np.zeros(rates.shape, dtype=np.int64)
+
+    for column in range(rates.shape[1]):
+        valid = np.flatnonzero(~np.isnan(rates[:, column]))
+        n = len(valid)
+        if n == 0:
+            continue
+
+        order = valid[np.argsort(rates[valid, column], kind='stable')]
+        values = rates[order, column]
+        prefix = np.concatenate([[0], np.cumsum(values)])
+        positions = np.arange(n)
+        summed = values * (2 * positions - (n - 1)) - prefix[:-1] + (prefix[-1] - prefix[1:])
+
+        differences[order, column] = summed / max(n - 1, 1)
+        count[order, column] = n - 1
+
+    return differences, count
+
+
+def _index_of(labels, label, name):
+    try:
+        return labels.index(label)
+    except ValueError:
+        raise ValueError(f"Unknown {name} {label}. Use one of {', '.join(labels)}.")
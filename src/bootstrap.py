@@ -0,0 +1,149 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .bias_calculation import get_reported_indices
+from .bias_engine import PerformanceTensor
+from .filepath_manager import get_key
+
+
+def resample_group_rates(result_per_speaker_df, fpm, n_resamples=1000, seed=0, rate_type='WER', weights=None,
+                         batch_size=100, max_workers=1):
+    """
+    Bootstrap the error rate of every group by resampling its speakers with replacement.
+
+    All speakers of all groups are resampled at once: each batch of resamples is a single array of draws over the
+    concatenated per-speaker error rates, which is reduced per group with np.add.reduceat.
+
+    :param result_per_speaker_df: Error rates per speaker, keyed by 'model_group_style', as collected by read_data.
+    :param fpm: FilepathManager holding the ASR models, speaker groups and speaking styles.
+    :param n_resamples: Number of bootstrap resamples.
+    :param seed: Seed of the random number generator. Results do not depend on batch_size or max_workers.
+    :param rate_type: The error rate to resample, or a list of error rates. All error rates are resampled with the
+        same draws of speakers.
+    :param weights: Optional per-speaker weights, keyed like result_per_speaker_df, either as a list per key or as a
+        dictionary of lists per error rate. Weighted by the number of words, or characters for CER, the error rate
+        of a group is that of its summed counts for WER and CER, as calculated by process_output. Without weights,
+        the error rate of a group is the mean of its speakers' error rates.
+    :param batch_size: Number of resamples drawn per batch, bounding the memory use to batch_size * #speakers.
+    :param max_workers: Number of processes to divide the batches over. 1 draws all batches in this process.
+    :return: Array of shape (n_resamples, model, group, style), NaN for groups without speakers, followed by a rate
+        axis if rate_type is a list.
+    """
+    keys = [get_key(model, group, speaking_style)
+            for model in fpm.asr_models
+            for group in fpm.speaker_groups
+            for speaking_style in fpm.speaking_style_folders]
+    rate_types = [rate_type] if isinstance(rate_type, str) else list(rate_type)
+
+    # Arrays of shape (rate, speaker) per key
+    rates = [np.array([result_per_speaker_df.get(key, {}).get(key_rate_type, []) for key_rate_type in rate_types],
+                      dtype=float).reshape(len(rate_types), -1)
+             for key in keys]
+    if weights is None:
+        key_weights = [np.ones(key_rates.shape) for key_rates in rates]
+    else:
+        key_weights = [np.array([_get_rate_weights(weights.get(key, []), key_rate_type)
+                                 for key_rate_type in rate_types], dtype=float).reshape(len(rate_types), -1)
+                       for key in keys]
+
+    lengths = np.array([key_rates.shape[1] for key_rates in rates])
+    present = lengths > 0
+    value_weights = np.concatenate(key_weights, axis=1)
+    # Speakers without any words have no error rate, but neither do they count towards the rate of their group
+    values = np.concatenate(rates, axis=1)
+    values = np.where(np.isnan(values) & (value_weights == 0), 0.0, values)
+
+    batches = [min(batch_size, n_resamples - start) for start in range(0, n_resamples, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    arguments = [(values, value_weights, lengths[present], size, batch_seed) for size, batch_seed in zip(batches, seeds)]
+
+    if (max_workers is not None and max_workers <= 1) or len(batches) <= 1:
+        results = [_resample_batch(*batch_arguments) for batch_arguments in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_resample_batch, *zip(*arguments)))
+
+    resampled = np.full((n_resamples, len(keys), len(rate_types)), np.nan)
+    resampled[:, present] = np.concatenate(results)
+    resampled = resampled.reshape(n_resamples, len(fpm.asr_models), len(fpm.speaker_groups),
+                                  len(fpm.speaking_style_folders), len(rate_types))
+
+    return resampled[..., 0] if isinstance(rate_type, str) else resampled
+
+
+def bootstrap_confidence_intervals(resampled_rates, fpm, wpb_w1, wpb_w2, iwpb_w1, iwpb_w2, confidence=0.95,
+                                   rate_type='WER'):
+    """
+    Calculate bootstrap confidence intervals of the bias metrics from resampled group error rates.
+
+    The metrics of all resamples are calculated at once, following the same definitions as the calculate_* functions
+    in bias_calculation for the absolute performance differences.
+
+    :param resampled_rates: Result of resample_group_rates.
+    :param fpm: FilepathManager holding the ASR models, speaker groups and speaking styles.
+    :param wpb_w1: WPB weight for performance difference.
+    :param wpb_w2: WPB weight for base performance.
+    :param iwpb_w1: IWPB weight for performance difference.
+    :param iwpb_w2: IWPB weight for base performance.
+    :param confidence: Confidence level of the percentile intervals.
+    :param rate_type: The error rate that was resampled, or the list of error rates.
+    :return: Dictionary with a [low, high] interval for every value of the WPB, overall WPB, IWPB, overall IWPB and
+        total IWPB, or a dictionary with such a dictionary per error rate if rate_type is a list.
+    """
+    if not isinstance(rate_type, str):
+        return {rate: bootstrap_confidence_intervals(resampled_rates[..., index], fpm, wpb_w1, wpb_w2, iwpb_w1,
+                                                     iwpb_w2, confidence, rate)
+                for index, rate in enumerate(rate_type)}
+
+    tensor = PerformanceTensor.from_rates(resampled_rates[..., np.newaxis], fpm.asr_models, fpm.speaker_groups,
+                                          fpm.speaking_style_folders, [rate_type], fpm.get_group_intersections())
+
+    # Overall metrics only take the 'min' baseline type into account, IWPB also only the reported speaking style
+    baseline_index, style_index, _ = get_reported_indices(tensor, fpm.reported_speaking_style)
+    wpb = tensor.weighted_performance_bias(wpb_w1, wpb_w2)
+    wpb_terms = tensor.weighted_performance_terms(wpb_w1, wpb_w2)[..., baseline_index, :, :, :, 0]
+    overall_wpb = 100 * np.nansum(wpb_terms, axis=-2) / len(fpm.speaker_groups)
+    iwpb_per_style = tensor.intergroup_weighted_performance_bias(iwpb_w1, iwpb_w2)[..., baseline_index, :, :, :, 0]
+    iwpb = iwpb_per_style[..., style_index]
+    overall_iwpb = 100 * np.nanmean(iwpb_per_style, axis=-2)
+    total_iwpb = np.nanmean(iwpb, axis=-1)
+
+    tail = 100 * (1 - confidence) / 2
+
+    def interval(values):
+        low, high = np.nanpercentile(values, [tail, 100 - tail], axis=0)
+        return np.stack([low, high], axis=-1).tolist()
+
+    wpb, iwpb, total_iwpb = interval(wpb), interval(iwpb), interval(total_iwpb)
+    overall_wpb, overall_iwpb = interval(overall_wpb), interval(overall_iwpb)
+
+    return {
+        'wpb': {model: dict(zip(fpm.speaker_groups, wpb[m])) for m, model in enumerate(fpm.asr_models)},
+        'overall_wpb': {speech_type: {model: overall_wpb[m][s] for m, model in enumerate(fpm.asr_models)}
+                        for s, speech_type in enumerate(fpm.speaking_style_folders)},
+        'iwpb': {model: dict(zip(fpm.speaker_groups, iwpb[m])) for m, model in enumerate(fpm.asr_models)},
+        'overall_iwpb': {speech_type: {model: overall_iwpb[m][s] for m, model in enumerate(fpm.asr_models)}
+                         for s, speech_type in enumerate(fpm.speaking_style_folders)},
+        'total_iwpb': dict(zip(fpm.asr_models, total_iwpb)),
+    }
+
+
+def _resample_batch(values, weights, lengths, size, seed):
+    # Draw `size` resamples of every group at once, as indices into the concatenated values of shape (rate, speaker)
+    rng = np.random.default_rng(seed)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+
+    draws = starts[owner] + rng.integers(0, lengths[owner], size=(size, len(owner)))
+    weighted_sums = np.add.reduceat(values[:, draws] * weights[:, draws], starts, axis=2)
+    weight_sums = np.add.reduceat(weights[:, draws], starts, axis=2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Shape (size, group, rate)
+        return np.moveaxis(weighted_sums / weight_sums, 0, -1)
+
+
+def _get_rate_weights(key_weights, rate_type):
+    # Weights of the speakers of a key for one error rate, from a list shared by all error rates or a dictionary
+    return key_weights[rate_type] if isinstance(key_weights, dict) else key_weights
@@ -1,4 +1,11 @@
+import glob
 import json
+import re
+import string
+
+# Config lists that can be discovered from the input path template, with their placeholders in the template
+DISCOVERABLE = {'asr_models': 'asr_model', 'speaker_groups': 'speaker_group',
+                'speaking_style_folders': 'speaking_style_folder'}
 
 
 class FilepathManager:
@@ -15,6 +22,40 @@ class FilepathManager:
         speaker_groups: TODO
         asr_models: TODO
         path_templates: TODO
+
+        The ASR models, speaker groups and speaking styles may be set to 'auto' (or left out) to discover them from
+        the input files, by matching the path template of the input format against the files on disk.
+        cache_path: Directory in which intermediate results are cached.
+        cache_format: File format of the cached ASR output table, either 'parquet' or 'feather'.
+        max_workers: Number of output files read concurrently. 1 reads them sequentially.
+        ingestion_mode: Whether concurrent reads use a 'thread' or 'process' pool.
+        incremental: Whether to only recompute results whose inputs changed since the last run.
+        input_format: 'output' to read per-speaker output files, 'transcripts' to align utterance-level transcripts.
+        transcript_unit: Token unit used to align transcripts, either 'word' or 'char'.
+        transcript_fields: Names of the speaker, group, reference and hypothesis fields in the transcript files.
+        bootstrap_resamples: Number of bootstrap resamples of the confidence intervals, e.g. 1000. 0 disables them.
+        bootstrap_seed: Seed of the bootstrap resampling.
+        confidence_level: Confidence level of the bias confidence intervals.
+        permutations: Number of permutations of the pairwise group difference tests, e.g. 10000. 0 disables them.
+        permutation_seed: Seed of the permutation tests.
+        p_value_correction: Multiple comparison correction of the pairwise group difference tests.
+        plot_workers: Number of processes rendering the plots. None uses one per CPU.
+        results_format: File format of the results, either 'parquet', 'feather' or 'json'.
+        export_json: Whether to also write the results as JSON when using a columnar results format.
+        bias_level: Whether the bias is calculated from the error rates of the 'group' or of its 'speaker's.
+        speaker_weighting: Whether speakers are weighted by their number of 'words' or equally ('speakers').
+        baseline_quantile: Optional quantile of the speaker error rates to use as additional baseline.
+        speaker_metadata: Optional CSV, TSV or JSON lines file with the attributes of every speaker.
+        intersections: Optional lists of speaker attributes, or 'all'. If set, the bias is calculated over the groups
+            of speakers sharing the values of each list of attributes, and speaker_groups holds their labels.
+        input_groups: The speaker groups of the input files, equal to speaker_groups without intersections.
+        memo_cache: Whether to keep the results of the bias computations in a MemoCache in the cache directory.
+        memo_cache_entries: Number of results the MemoCache keeps in memory.
+        memo_cache_size: Maximum size of the results the MemoCache keeps on disk, in MiB.
+        reported_speaking_style: Speaking style the IWPB and the total IWPB are reported for. Defaults to the first
+            speaking style.
+        reported_error_rate: Error rate the overall WPB, the IWPB and the total IWPB are reported for. Defaults to the
+            first error rate.
     """
 
     def __init__(self, config_path):
@@ -23,11 +64,58 @@ class FilepathManager:
 
         self.base_path = self.config['base_path']
         self.error_rates = self.config['error_rates']
-        self.speaking_style_folders = self.config['speaking_style_folders']
-        self.speaking_style_infixes = self.config['speaking_style_infixes']
-        self.speaker_groups = self.config['speaker_groups']
-        self.asr_models = self.config['asr_models']
+        self.speaking_style_folders = self.config.get('speaking_style_folders', 'auto')
+        self.speaking_style_infixes = self.config.get('speaking_style_infixes', 'auto')
+        self.speaker_groups = self.config.get('speaker_groups', 'auto')
+        self.asr_models = self.config.get('asr_models', 'auto')
         self.path_templates = self.config['path_templates']
+        self.cache_path = self.config.get('cache_path', '.cache')
+        self.cache_format = self.config.get('cache_format', 'parquet')
+        self.max_workers = self.config.get('max_workers', 1)
+        self.ingestion_mode = self.config.get('ingestion_mode', 'thread')
+        self.incremental = self.config.get('incremental', False)
+        self.input_format = self.config.get('input_format', 'output')
+        self.transcript_unit = self.config.get('transcript_unit', 'word')
+        self.transcript_fields = self.config.get('transcript_fields', {})
+        self.bootstrap_resamples = self.config.get('bootstrap_resamples', 0)
+        self.bootstrap_seed = self.config.get('bootstrap_seed', 0)
+        self.confidence_level = self.config.get('confidence_level', 0.95)
+        self.permutations = self.config.get('permutations', 0)
+        self.permutation_seed = self.config.get('permutation_seed', 0)
+        self.p_value_correction = self.config.get('p_value_correction', 'holm')
+        self.plot_workers = self.config.get('plot_workers', None)
+        self.bias_level = self.config.get('bias_level', 'group')
+        self.speaker_weighting = self.config.get('speaker_weighting', 'words')
+        self.baseline_quantile = self.config.get('baseline_quantile', None)
+        self.speaker_metadata = self.config.get('speaker_metadata', None)
+        self.intersections = self.config.get('intersections', None)
+        self.memo_cache = self.config.get('memo_cache', True)
+        self.memo_cache_entries = self.config.get('memo_cache_entries', 128)
+        self.memo_cache_size = self.config.get('memo_cache_size', 256)
+        self.results_format = self.config.get('results_format', 'parquet')
+        self.export_json = self.config.get('export_json', False)
+        self.reported_speaking_style = self.config.get('reported_speaking_style', None)
+        self.reported_error_rate = self.config.get('reported_error_rate', None)
+        self._scan = None
+        self._group_index = None
+
+        if 'auto' in (self.asr_models, self.speaker_groups, self.speaking_style_folders, self.speaking_style_infixes):
+            self.discover()
+
+        self.input_groups = self.speaker_groups
+        if self.intersections:
+            # Calculate the bias over the intersectional groups instead of the groups of the input files
+            self.speaker_groups = self.get_group_index().groups
+
+        # The reported slice is looked up by these labels, so once set it does not depend on the configured order
+        if self.reported_speaking_style is None:
+            self.reported_speaking_style = self.speaking_style_folders[0]
+        elif self.reported_speaking_style not in self.speaking_style_folders:
+            raise ValueError(f"Invalid reported_speaking_style. Use one of {', '.join(self.speaking_style_folders)}.")
+        if self.reported_error_rate is None:
+            self.reported_error_rate = self.error_rates[0]
+        elif self.reported_error_rate not in self.error_rates:
+            raise ValueError(f"Invalid reported_error_rate. Use one of {', '.join(self.error_rates)}.")
 
     def _generate_path(self, template, **kwargs):
         return template.format(base_path=self.base_path, **kwargs)
@@ -41,7 +129,15 @@ class FilepathManager:
     def get_output_path(self, speaking_style_folder, speaking_style_infix, speaker_group, asr_model):
         # Public method to get the path for an output file
         template = self.path_templates['output_file']
-        return self._generate_path(template, speaking_style_folder=speaking_style_folder, speaker_group=speaker_group, asr_model=asr_model)
+        return self._generate_path(template, speaking_style_folder=speaking_style_folder,
+                                   speaking_style_infix=speaking_style_infix, speaker_group=speaker_group,
+                                   asr_model=asr_model)
+
+    def get_transcript_path(self, speaking_style_folder, speaking_style_infix, asr_model):
+        # Public method to get the path for an utterance-level transcript file
+        template = self.path_templates['transcript_file']
+        return self._generate_path(template, speaking_style_folder=speaking_style_folder,
+                                   speaking_style_infix=speaking_style_infix, asr_model=asr_model)
 
     def get_error_rates(self):
         return self.error_rates
@@ -49,6 +145,9 @@ class FilepathManager:
     def get_speaker_groups(self):
         return self.speaker_groups
 
+    def get_input_groups(self):
+        return self.input_groups
+
     def get_asr_models(self):
         return self.asr_models
 
@@ -57,3 +156,158 @@ class FilepathManager:
 
     def get_speaking_style_infixes(self):
         return self.speaking_style_infixes
+
+    def get_cache_path(self):
+        return self.cache_path
+
+    def get_group_index(self):
+        """
+        :return: GroupIndex of the intersectional groups of the speaker metadata, built on the first call.
+        """
+        if self._group_index is None:
+            from .intersections import GroupIndex, read_speaker_metadata
+
+            if self.speaker_metadata is None:
+                raise ValueError("Intersections require a speaker_metadata file.")
+            self._group_index = GroupIndex(read_speaker_metadata(self.speaker_metadata), self.intersections)
+
+        return self._group_index
+
+    def get_group_intersections(self):
+        """
+        :return: The intersection of every speaker group, in the order of speaker_groups, or None without
+            intersections. The baselines and IWPB only compare groups of the same intersection.
+        """
+        if not self.intersections:
+            return None
+        return self.get_group_index().group_intersections
+
+    def split_key(self, key):
+        """
+        Split a 'model_group_style' key into its ASR model, speaker group and speaking style, see split_key.
+        """
+        return split_key(key, self.speaker_groups, self.speaking_style_folders)
+
+    def scan(self, refresh=False):
+        """
+        Find the input files matching the path template of the input format, with a single directory scan whose
+        result is cached.
+
+        :param refresh: Whether to scan the directories again, e.g. after input files were added.
+        :return: List of dictionaries with the values of the template placeholders of every matching file.
+        """
+        if self._scan is None or refresh:
+            template = self._get_input_template()
+            placeholders = {field for _, field, _, _ in string.Formatter().parse(template) if field}
+            # Fill in the base path, escaping it for the glob pattern and regular expression
+            pattern = glob.escape(self.base_path).join(part for part in template.split('{base_path}'))
+            regex = re.escape(self.base_path).join(re.escape(part) for part in template.split('{base_path}'))
+
+            for field in placeholders - {'base_path'}:
+                pattern = pattern.replace('{' + field + '}', '*')
+                # Only the first occurrence captures the value, later ones have to repeat it
+                regex = regex.replace(re.escape('{' + field + '}'), f'(?P<{field}>[^/]+)', 1)
+                regex = regex.replace(re.escape('{' + field + '}'), f'(?P={field})')
+
+            matcher = re.compile(regex)
+            self._scan = [match.groupdict() for match in map(matcher.fullmatch, sorted(glob.glob(pattern)))
+                          if match is not None]
+
+        return self._scan
+
+    def discover(self):
+        """
+        Fill in the ASR models, speaker groups and speaking styles that are set to 'auto' from the input files.
+
+        Discovered labels are sorted in natural order, e.g. 'ckpt-9' before 'ckpt-10'. Speaking style infixes are
+        taken from the template if it contains them, and are equal to the speaking style folders otherwise.
+        """
+        matches = self.scan()
+        if not matches:
+            raise ValueError(f"No input files match the path template {self._get_input_template()}.")
+
+        for attribute, field in DISCOVERABLE.items():
+            if getattr(self, attribute) == 'auto':
+                if matches and field not in matches[0]:
+                    raise ValueError(f"Cannot discover {attribute}, the path template has no {{{field}}} placeholder.")
+                setattr(self, attribute, sorted({match[field] for match in matches}, key=_natural_key))
+
+        if self.speaking_style_infixes == 'auto':
+            infixes = {match['speaking_style_folder']: match.get('speaking_style_infix', match['speaking_style_folder'])
+                       for match in matches if 'speaking_style_folder' in match}
+            self.speaking_style_infixes = [infixes.get(folder, folder) for folder in self.speaking_style_folders]
+
+    def get_combinations(self):
+        """
+        :return: The (model, group, speaking style) combinations for which input files exist, ordered by speaking
+            style, model and group as listed. The groups are those of the input files.
+        """
+        available = self._get_available()
+        return [(model, group, speaking_style)
+                for speaking_style in self.speaking_style_folders
+                for model in self.asr_models
+                for group in self.input_groups
+                if (model, group, speaking_style) in available]
+
+    def get_missing_combinations(self):
+        """
+        :return: The (model, group, speaking style) combinations without input files.
+        """
+        available = self._get_available()
+        return [(model, group, speaking_style)
+                for speaking_style in self.speaking_style_folders
+                for model in self.asr_models
+                for group in self.input_groups
+                if (model, group, speaking_style) not in available]
+
+    def _get_input_template(self):
+        return self.path_templates['transcript_file' if self.input_format == 'transcripts' else 'output_file']
+
+    def _get_available(self):
+        # Every group of a transcript file is available, its groups are only known once the file is read
+        available = set()
+        for match in self.scan():
+            models = [match['asr_model']] if 'asr_model' in match else self.asr_models
+            groups = [match['speaker_group']] if 'speaker_group' in match else self.input_groups
+            styles = [match['speaking_style_folder']] if 'speaking_style_folder' in match else self.speaking_style_folders
+            available.update((model, group, speaking_style)
+                             for model in models for group in groups for speaking_style in styles)
+
+        return available
+
+
+def get_key(model, group, speaking_style):
+    """
+    :return: The 'model_group_style' key of the results of an ASR model, speaker group and speaking style.
+    """
+    return model + '_' + group + '_' + speaking_style
+
+
+def split_key(key, groups=None, speaking_styles=None):
+    """
+    Split a 'model_group_style' key into its ASR model, speaker group and speaking style.
+
+    The speaking style and group are matched against the given labels, longest first, so the ASR models, groups and
+    speaking styles may contain underscores themselves. Without labels, only the ASR model may contain underscores.
+
+    :param key: 'model_group_style' key.
+    :param groups: Optional speaker groups.
+    :param speaking_styles: Optional speaking styles.
+    :return: Tuple of (model, group, speaking style).
+    """
+    rest, speaking_style = _split_label(key, speaking_styles)
+    model, group = _split_label(rest, groups)
+    return model, group, speaking_style
+
+
+def _split_label(key, labels):
+    # Split off the longest label the key ends with, or the part after the last underscore
+    for label in sorted(labels or [], key=len, reverse=True):
+        if key.endswith('_' + label):
+            return key[:-len(label) - 1], label
+    return tuple(key.rsplit('_', 1))
+
+
+def _natural_key(label):
+    # Compare runs of digits as numbers
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', label)]
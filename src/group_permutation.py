@@ -0,0 +1,157 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .bias_engine import get_intersection_members
+from .filepath_manager import get_key
+from .speaker_bias import get_speaker_rates
+
+CORRECTIONS = ['holm', 'bonferroni', 'fdr_bh', 'none']
+
+
+def pairwise_permutation_test(result_per_speaker_df, fpm, n_permutations=10000, seed=0, rate_type='WER',
+                              correction='holm', batch_size=1000, max_workers=1):
+    """
+    Test for every pair of speaker groups whether the difference between their error rates is significant.
+
+    The error rate of a group is the mean of the error rates of its speakers, weighted by their number of words
+    (characters for CER) as the group error rates of the bias metrics, or equally in the speaker-level mode with the
+    'speakers' weighting. Speakers without a finite error rate or without words are left out. For every model and
+    speaking style, the speakers of all groups are pooled and their group labels are shuffled, each speaker keeping
+    their weight. With intersectional groups, this is done per intersection, so only groups of the same intersection
+    are compared. Each batch of permutations is a single (permutations, speakers) index array, and the group error
+    rates of all permutations are computed at once with np.bincount.
+
+    :param result_per_speaker_df: Error rates per speaker, keyed by 'model_group_style', as collected by read_data.
+    :param fpm: FilepathManager holding the ASR models, speaker groups and speaking styles.
+    :param n_permutations: Number of label permutations.
+    :param seed: Seed of the random number generator. Results do not depend on batch_size or max_workers.
+    :param rate_type: The error rate to test, or a list of error rates to test.
+    :param correction: Multiple comparison correction over all tested pairs, one of CORRECTIONS.
+    :param batch_size: Number of permutations drawn per batch, bounding the memory use to batch_size * #speakers.
+    :param max_workers: Number of processes to divide the batches over. 1 runs all batches in this process.
+    :return: List of records, one per (model, speaking style, group pair), with the observed absolute difference of
+        the group error rates, the p-value and the corrected p-value.
+    """
+    if correction not in CORRECTIONS:
+        raise ValueError(f"Invalid correction. Use one of {CORRECTIONS}.")
+
+    rate_types = [rate_type] if isinstance(rate_type, str) else list(rate_type)
+    weighting = fpm.speaker_weighting if fpm.bias_level == 'speaker' else 'words'
+    records = []
+    batches = [min(batch_size, n_permutations - start) for start in range(0, n_permutations, batch_size)]
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers is not None and max_workers > 1 else None
+
+    # A speaker belongs to a group of every intersection, so only the groups of the same intersection are compared
+    intersections = fpm.get_group_intersections()
+    group_sets = [[fpm.speaker_groups[index] for index in members]
+                  for members in get_intersection_members(intersections, len(fpm.speaker_groups))]
+    slices = list(itertools.product(enumerate(fpm.asr_models), enumerate(fpm.speaking_style_folders),
+                                    enumerate(group_sets)))
+
+    try:
+        for rate_type in rate_types:
+            for (model_index, model), (style_index, speaking_style), (set_index, group_set) in slices:
+                groups, values, weights, labels = [], [], [], []
+                for group in group_set:
+                    key = get_key(model, group, speaking_style)
+                    if key not in result_per_speaker_df:
+                        continue
+                    rates, rate_weights = get_speaker_rates(result_per_speaker_df, key, rate_type, weighting)
+                    if len(rates) > 0:
+                        labels.append(np.full(len(rates), len(groups)))
+                        values.append(rates)
+                        weights.append(rate_weights)
+                        groups.append(group)
+
+                if len(groups) < 2:
+                    continue
+
+                values, weights, labels = np.concatenate(values), np.concatenate(weights), np.concatenate(labels)
+                totals = np.bincount(labels, weights=weights, minlength=len(groups))
+                means = np.bincount(labels, weights=values * weights, minlength=len(groups)) / totals
+                observed = np.abs(means[:, np.newaxis] - means[np.newaxis, :])
+
+                # Seeds only depend on the slice and the batch, not on how the batches are scheduled, so every
+                # error rate is tested with the same permutations
+                slice_seed = np.random.SeedSequence([seed, model_index, style_index] +
+                                                    ([set_index] if intersections is not None else []))
+                arguments = [(values * weights, weights, labels, observed, size, batch_seed)
+                             for size, batch_seed in zip(batches, slice_seed.spawn(len(batches)))]
+
+                if executor is None:
+                    exceedances = sum(_count_exceedances(*batch_arguments) for batch_arguments in arguments)
+                else:
+                    exceedances = sum(executor.map(_count_exceedances, *zip(*arguments)))
+
+                p_values = (exceedances + 1) / (n_permutations + 1)
+
+                for i in range(len(groups)):
+                    for j in range(i + 1, len(groups)):
+                        records.append({
+                            "Model": model,
+                            "SpeakingStyle": speaking_style,
+                            "RateType": rate_type,
+                            "Group1": groups[i],
+                            "Group2": groups[j],
+                            "Difference": float(observed[i, j]),
+                            "PValue": float(p_values[i, j]),
+                        })
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    adjusted = adjust_p_values(np.array([record['PValue'] for record in records]), correction)
+    for record, adjusted_p_value in zip(records, adjusted):
+        record['AdjustedPValue'] = float(adjusted_p_value)
+
+    return records
+
+
+def adjust_p_values(p_values, method='holm'):
+    """
+    Correct p-values for multiple comparisons.
+
+    :param p_values: Array of p-values.
+    :param method: 'holm' (Holm-Bonferroni), 'bonferroni', 'fdr_bh' (Benjamini-Hochberg) or 'none'.
+    :return: Array of corrected p-values, in the same order.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    n = len(p_values)
+
+    if n == 0 or method == 'none':
+        return p_values.copy()
+    elif method == 'bonferroni':
+        return np.minimum(p_values * n, 1.0)
+
+    order = np.argsort(p_values, kind='stable')
+    ranked = p_values[order]
+    adjusted = np.empty(n)
+
+    if method == 'holm':
+        adjusted[order] = np.minimum(np.maximum.accumulate(ranked * (n - np.arange(n))), 1.0)
+    elif method == 'fdr_bh':
+        scaled = ranked * n / np.arange(1, n + 1)
+        adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    else:
+        raise ValueError(f"Invalid correction. Use one of {CORRECTIONS}.")
+
+    return adjusted
+
+
+def _count_exceedances(weighted_values, weights, labels, observed, size, seed):
+    # Count, per group pair, the permutations with a difference at least as large as the observed one
+    rng = np.random.default_rng(seed)
+    n_groups = len(observed)
+
+    permuted_labels = labels[rng.permuted(np.broadcast_to(np.arange(len(labels)), (size, len(labels))), axis=1)]
+    offsets = (n_groups * np.arange(size)[:, np.newaxis] + permuted_labels).ravel()
+    sums = np.bincount(offsets, weights=np.broadcast_to(weighted_values, permuted_labels.shape).ravel(),
+                       minlength=size * n_groups)
+    totals = np.bincount(offsets, weights=np.broadcast_to(weights, permuted_labels.shape).ravel(),
+                         minlength=size * n_groups)
+
+    means = sums.reshape(size, n_groups) / totals.reshape(size, n_groups)
+    differences = np.abs(means[:, :, np.newaxis] - means[:, np.newaxis, :])
+    return np.sum(differences >= observed - 1e-12, axis=0)
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+
+
+class IncrementalState:
+    """
+    Keeps fingerprints of the pipeline inputs and intermediate results between runs.
+
+    Every stage stores its results per slice (e.g. per model, group and speaking style), together with a fingerprint
+    of the inputs the slice was computed from. On the next run, only slices whose fingerprint changed have to be
+    recomputed.
+
+    Attributes:
+        path: JSON file in which the state is persisted.
+        state: Stored slices, as {stage: {slice key: {'fingerprint': ..., 'value': ...}}}.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.state = json.load(file)
+
+    def get(self, stage, key, fingerprint):
+        """
+        Look up the stored result of a slice.
+
+        :param stage: Name of the pipeline stage.
+        :param key: Key of the slice within the stage.
+        :param fingerprint: Fingerprint of the current inputs of the slice.
+        :return: The stored result, or None if it is missing or was computed from different inputs.
+        """
+        entry = self.state.get(stage, {}).get(key)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return None
+        return entry['value']
+
+    def put(self, stage, key, fingerprint, value):
+        """
+        Store the result of a slice.
+
+        :param stage: Name of the pipeline stage.
+        :param key: Key of the slice within the stage.
+        :param fingerprint: Fingerprint of the inputs the result was computed from.
+        :param value: JSON-serialisable result.
+        """
+        self.state.setdefault(stage, {})[key] = {'fingerprint': fingerprint, 'value': value}
+
+    def retain(self, stage, keys):
+        """
+        Drop all slices of a stage that are not in keys, e.g. because a model was removed from the config.
+
+        :param stage: Name of the pipeline stage.
+        :param keys: Keys of the slices to keep.
+        """
+        keys = set(keys)
+        self.state[stage] = {key: entry for key, entry in self.state.get(stage, {}).items() if key in keys}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as file:
+            file.write(json.dumps(self.state))
+
+
+def fingerprint(value):
+    """
+    Calculate a fingerprint of a JSON-serialisable value.
+
+    :param value: The value to fingerprint.
+    :return: Hex digest of the value's canonical JSON representation.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
@@ -0,0 +1,238 @@
+import datetime
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak RSS is not recorded
+    resource = None
+
+PROFILERS = ['cprofile', 'pyinstrument']
+
+
+class Instrumentation:
+    """
+    Records the wall time, CPU time, peak resident set size and number of processed items of the pipeline stages.
+
+    Stages are timed with the stage context manager or the timed decorator, and can be nested: the name of a nested
+    stage is prefixed with the names of the stages it runs in, e.g. 'compute/bias/wpb'. Every finished stage is
+    appended as a JSON line to timings_path, so the timings of a run that is interrupted are kept as well.
+
+    If profile_path is set, every stage is profiled and its profile is written to profile_path, unless a stage it
+    runs in is already being profiled, as only one profiler can be active at a time. The profile of a stage then
+    includes those of its nested stages.
+
+    Attributes:
+        timings_path: Optional JSON lines file to append the record of every finished stage to.
+        profile_path: Optional directory to write the profile of every stage to.
+        profiler: Profiler to use, either 'cprofile' (written as .prof for pstats or snakeviz) or 'pyinstrument'
+            (written as .txt).
+        records: Records of the finished stages, in order of completion. Besides the measurements, a record holds
+            the depth of the stage and its offset in seconds from the start of the run.
+        started: Time at which the instrumentation was created, identifying the run in the JSON lines.
+    """
+
+    def __init__(self, timings_path=None, profile_path=None, profiler='cprofile'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Invalid profiler. Use one of {', '.join(PROFILERS)}.")
+
+        self.timings_path = timings_path
+        self.profile_path = profile_path
+        self.profiler = profiler
+        self.records = []
+        self.started = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self._start = time.perf_counter()
+        self._stack = []
+        self._profiling = False
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """
+        Time the statements in the with block as a stage.
+
+        :param name: Name of the stage.
+        :param items: Optional number of items processed by the stage, e.g. output files or models. It can also be
+            set later through the 'items' key of the yielded record.
+        :return: Context manager yielding the record of the stage, which is completed when the block exits.
+        """
+        self._stack.append(name)
+        record = {'stage': '/'.join(self._stack), 'depth': len(self._stack) - 1, 'items': items,
+                  'offset': time.perf_counter() - self._start}
+        profiler = self._start_profiler()
+        start = _get_times()
+
+        try:
+            yield record
+        finally:
+            record.update(_get_elapsed(start))
+            self._stop_profiler(profiler, record['stage'])
+            self._stack.pop()
+            self._append(record)
+
+    def timed(self, name=None):
+        """
+        Decorator timing every call of a function as a stage.
+
+        :param name: Name of the stage. Defaults to the name of the function.
+        :return: Decorator.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, record):
+        """
+        Add the record of a stage that was measured elsewhere, e.g. in a worker process, as a nested stage of the
+        current stage.
+
+        :param record: Dictionary with at least the 'stage' name, e.g. from measure.
+        """
+        self._append({'items': None, 'offset': time.perf_counter() - self._start, **record,
+                      'stage': '/'.join(self._stack + [record['stage']]), 'depth': len(self._stack)})
+
+    def summary(self):
+        """
+        :return: Table of the recorded stages, with the nested stages indented below the stages they ran in.
+        """
+        rows = [(' ' * 2 * record['depth'] + record['stage'].rsplit('/', 1)[-1],
+                 f"{record['wall_time']:.3f}s", f"{record['cpu_time']:.3f}s",
+                 f"{record['peak_rss'] / 2 ** 20:.1f} MiB" if record.get('peak_rss') is not None else '-',
+                 str(record['items']) if record.get('items') is not None else '-')
+                for record in sorted(self.records, key=lambda record: (record['offset'], record['depth']))]
+        rows.insert(0, ('Stage', 'Wall time', 'CPU time', 'Peak RSS', 'Items'))
+
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        return '\n'.join(row[0].ljust(widths[0]) + ''.join(value.rjust(width + 2)
+                                                          for value, width in zip(row[1:], widths[1:]))
+                         for row in rows)
+
+    def _append(self, record):
+        self.records.append(record)
+
+        if self.timings_path is not None:
+            os.makedirs(os.path.dirname(self.timings_path) or '.', exist_ok=True)
+            with open(self.timings_path, 'a') as file:
+                file.write(json.dumps({'run': self.started, **record}) + '\n')
+
+    def _start_profiler(self):
+        if self.profile_path is None or self._profiling:
+            return None
+
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError as error:
+                print(f"Not profiling, pyinstrument is unavailable: {error}")
+                self.profile_path = None
+                return None
+            profiler = Profiler()
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        self._profiling = True
+        return profiler
+
+    def _stop_profiler(self, profiler, name):
+        if profiler is None:
+            return
+
+        os.makedirs(self.profile_path, exist_ok=True)
+        path = os.path.join(self.profile_path, name.replace('/', '.'))
+
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+            with open(path + '.txt', 'w') as file:
+                file.write(profiler.output_text())
+        else:
+            profiler.disable()
+            profiler.dump_stats(path + '.prof')
+
+        self._profiling = False
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation():
+    """
+    :return: The Instrumentation the stages of the pipeline are recorded with.
+    """
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation):
+    """
+    Record the stages of the pipeline with another Instrumentation, e.g. one writing JSON lines or profiles.
+
+    :param instrumentation: Instrumentation to use.
+    """
+    global _instrumentation
+    _instrumentation = instrumentation
+
+
+def stage(name, items=None):
+    """
+    Time a stage with the current Instrumentation, see Instrumentation.stage.
+    """
+    return _instrumentation.stage(name, items)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function as a stage of the current Instrumentation, see Instrumentation.timed.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _instrumentation.stage(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def measure(function, *args, **kwargs):
+    """
+    Call a function and measure it, e.g. in a worker process whose stages cannot be recorded directly.
+
+    :param function: Function to call.
+    :return: Tuple of (result of the function, dictionary with its wall time, CPU time and peak RSS).
+    """
+    start = _get_times()
+    result = function(*args, **kwargs)
+    return result, _get_elapsed(start)
+
+
+def _get_times():
+    times = os.times()
+    return time.perf_counter(), time.process_time(), times.children_user + times.children_system
+
+
+def _get_elapsed(start):
+    wall_time, cpu_time, child_cpu_time = _get_times()
+    return {
+        'wall_time': wall_time - start[0],
+        'cpu_time': cpu_time - start[1],
+        # CPU time of worker processes that exited during the stage, e.g. those of a process pool
+        'child_cpu_time': child_cpu_time - start[2],
+        'peak_rss': _get_peak_rss(),
+    }
+
+
+def _get_peak_rss():
+    # Peak resident set size of this process so far, in bytes (ru_maxrss is in kilobytes on Linux)
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
@@ -0,0 +1,141 @@
+import itertools
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# Field of the speaker IDs in the speaker metadata
+SPEAKER_FIELD = 'speaker'
+
+# Separator of the attribute values in the label of an intersectional group, e.g. 'female+60-70'
+LABEL_SEPARATOR = '+'
+
+# Value of speakers without a value for an attribute
+MISSING_VALUE = 'unknown'
+
+
+def read_speaker_metadata(path):
+    """
+    Read the attributes of every speaker, such as their age, gender, accent and region.
+
+    :param path: Path to a .csv, .tsv or .jsonl file with a 'speaker' field holding the speaker IDs, as in the
+        'SPKR' column of the output files or the speaker field of the transcripts, and one field per attribute.
+    :return: DataFrame indexed by speaker ID, with the attribute values as strings.
+    """
+    if path.endswith('.jsonl'):
+        metadata = pd.read_json(path, lines=True, dtype=False)
+    else:
+        metadata = pd.read_csv(path, sep='\t' if path.endswith('.tsv') else ',', dtype=str, keep_default_na=False)
+
+    if SPEAKER_FIELD not in metadata:
+        raise ValueError(f"The speaker metadata in {path} has no '{SPEAKER_FIELD}' field.")
+
+    metadata = metadata.astype(str).set_index(SPEAKER_FIELD)
+    if not metadata.index.is_unique:
+        raise ValueError(f"The speaker metadata in {path} lists some speakers more than once.")
+
+    return metadata.replace({'': MISSING_VALUE, 'nan': MISSING_VALUE, 'None': MISSING_VALUE})
+
+
+class GroupIndex:
+    """
+    Sparse index of the membership of speakers in intersectional groups.
+
+    Speakers with the same value for every attribute fall in the same cell, so every speaker is stored as a single
+    cell index. As every cell belongs to exactly one group of every intersection, the membership is stored as the
+    index of that group per intersection and cell. The counts of all groups are aggregated by summing the counts of
+    the speakers per cell once and adding those to the groups of every intersection, rather than selecting the
+    speakers of every group. As the number of cells is bounded by both the number of speakers and the number of
+    combinations of attribute values, thousands of groups can be aggregated at once.
+
+    Attributes:
+        attributes: Names of the speaker attributes.
+        intersections: Tuples of the attributes of every intersection. Every combination of values of the attributes
+            of an intersection that occurs in the metadata forms a group.
+        groups: Labels of the groups, the values of their attributes joined with LABEL_SEPARATOR.
+        group_intersections: Label of the intersection of every group, its attributes joined with LABEL_SEPARATOR.
+            Groups are only compared with the groups of the same intersection.
+        cells: Array of shape (cell, attribute) with the index of the value of every attribute of every cell.
+        values: Values of every attribute, indexed by the cells.
+        cell_groups: Array of shape (intersection, cell) with the index of the group of every cell in every
+            intersection.
+        speaker_cells: Dictionary with speaker IDs as keys and the index of their cell as values.
+    """
+
+    def __init__(self, metadata, intersections):
+        self.attributes = list(metadata.columns)
+        if intersections == 'all':
+            intersections = [combination for size in range(1, len(self.attributes) + 1)
+                             for combination in itertools.combinations(self.attributes, size)]
+        self.intersections = [tuple(intersection) for intersection in intersections]
+
+        unknown = {attribute for intersection in self.intersections for attribute in intersection} - \
+            set(self.attributes)
+        if unknown:
+            raise ValueError(f"Invalid intersections, the speaker metadata has no {', '.join(sorted(unknown))} field. "
+                             f"Use any of {', '.join(self.attributes)}.")
+
+        codes, self.values = [], []
+        for attribute in self.attributes:
+            attribute_codes, attribute_values = pd.factorize(metadata[attribute], sort=True)
+            codes.append(attribute_codes)
+            self.values.append(list(attribute_values))
+
+        self.cells, speaker_cells = np.unique(np.column_stack(codes), axis=0, return_inverse=True)
+        self.speaker_cells = dict(zip(metadata.index, np.ravel(speaker_cells).tolist()))
+
+        # Every cell belongs to exactly one group of every intersection
+        self.groups, self.group_intersections, cell_groups = [], [], []
+        for intersection in self.intersections:
+            positions = [self.attributes.index(attribute) for attribute in intersection]
+            combinations, groups = np.unique(self.cells[:, positions], axis=0, return_inverse=True)
+            cell_groups.append(len(self.groups) + np.ravel(groups))
+            self.groups.extend(LABEL_SEPARATOR.join(self.values[position][code]
+                                                    for position, code in zip(positions, combination))
+                               for combination in combinations)
+            self.group_intersections.extend([LABEL_SEPARATOR.join(intersection)] * len(combinations))
+
+        duplicates = [group for group, count in Counter(self.groups).items() if count > 1]
+        if duplicates:
+            raise ValueError(f"Intersections result in the same group label more than once: "
+                             f"{', '.join(sorted(duplicates))}.")
+
+        self.cell_groups = np.array(cell_groups, dtype=np.int64).reshape(len(self.intersections), len(self.cells))
+
+    def get_cells(self, speakers):
+        """
+        :param speakers: Speaker IDs.
+        :return: Array with the cell of every speaker, -1 for speakers without metadata.
+        """
+        return np.array([self.speaker_cells.get(str(speaker), -1) for speaker in speakers], dtype=np.int64)
+
+    def aggregate(self, counts, cells):
+        """
+        Sum the counts of the speakers of every group.
+
+        :param counts: Array of shape (speaker, ...) with the counts of every speaker.
+        :param cells: Cell of every speaker, from get_cells. Speakers without metadata (-1) are left out.
+        :return: Array of shape (group, ...) with the summed counts of every group.
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        known = cells >= 0
+        cell_counts = np.zeros((len(self.cells),) + counts.shape[1:])
+        np.add.at(cell_counts, cells[known], counts[known])
+
+        group_counts = np.zeros((len(self.groups),) + counts.shape[1:])
+        # The groups of an intersection do not overlap, so every group receives each of its cells exactly once
+        np.add.at(group_counts, self.cell_groups, cell_counts)
+        return group_counts
+
+    def get_members(self, cells):
+        """
+        :param cells: Cell of every speaker, from get_cells.
+        :return: List with an array of the positions of the speakers of every group, in ascending order.
+        """
+        known = np.flatnonzero(cells >= 0)
+        speaker_groups = self.cell_groups[:, cells[known]].ravel()
+
+        # Sorting the speakers of all intersections by group keeps them in ascending order within every group
+        order = np.argsort(speaker_groups, kind='stable')
+        sizes = np.bincount(speaker_groups, minlength=len(self.groups))
+        return np.split(np.tile(known, len(self.intersections))[order], np.cumsum(sizes)[:-1])
@@ -0,0 +1,283 @@
+import copy
+import functools
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+# Version of the stored results, to be increased when their format changes without a change to the source code
+CACHE_VERSION = 1
+
+# Fraction of max_bytes the on-disk tier is reduced to when it exceeds max_bytes
+EVICTION_RATIO = 0.9
+
+
+class MemoCache:
+    """
+    Content-addressed cache of bias results, keyed by the function and a fingerprint of its arguments.
+
+    The arguments are described by their content rather than their identity: data such as PerformanceRecords and
+    SpeakerStores by their fingerprint, arrays by a hash of their bytes and other values, e.g. weights and the metric
+    variant, by their JSON representation. Calling a memoized function again with equal inputs returns the stored
+    result, also when the inputs were read from disk again. The keys are salted with a version of the code, so results
+    stored by another version of the code are never returned.
+
+    Results are kept in two tiers. The in-memory tier holds the max_entries most recently used results of this
+    process. The on-disk tier in path is shared between runs and worker processes, and is bounded to max_bytes by
+    removing the least recently used results first. Its size is counted as results are stored, and the directory is
+    only scanned when the count exceeds max_bytes, after which it is reduced to EVICTION_RATIO of max_bytes.
+
+    Attributes:
+        path: Optional directory of the on-disk tier. Without a path, results are only kept in memory.
+        max_entries: Maximum number of results in the in-memory tier. 0 disables it.
+        max_bytes: Maximum total size of the results in the on-disk tier, in bytes.
+        version: Version of the code the keys are salted with. Defaults to a hash of CACHE_VERSION and the source
+            code of this package.
+        hits: Number of calls answered from either tier.
+        misses: Number of calls that had to be computed.
+    """
+
+    def __init__(self, path=None, max_entries=128, max_bytes=256 * 2 ** 20, version=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = get_code_version() if version is None else version
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Size of the on-disk tier, counted from the first scan on, or None before it
+        self._disk_bytes = None
+
+    def get_key(self, name, args=(), kwargs=None):
+        """
+        :param name: Name of the memoized function.
+        :param args: Positional arguments of the call.
+        :param kwargs: Keyword arguments of the call.
+        :return: Hex digest identifying the version of the code, the function and the content of its arguments.
+        """
+        key = hashlib.sha256(json.dumps([self.version, name]).encode('utf-8'))
+        _update(key, [list(args), kwargs or {}])
+        return key.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a result, first in memory and then on disk.
+
+        :param key: Key from get_key.
+        :return: Tuple of (whether the result was found, the result).
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            # Copied, so callers modifying the result do not modify the stored one
+            return True, copy.deepcopy(self._entries[key])
+
+        if self.path is not None:
+            path = self._get_path(key)
+            try:
+                with open(path, 'rb') as file:
+                    value = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                return False, None
+
+            try:
+                # Mark the result as recently used, for the eviction of the on-disk tier
+                os.utime(path)
+            except OSError:
+                pass
+            self._remember(key, value)
+            return True, copy.deepcopy(value) if self.max_entries > 0 else value
+
+        return False, None
+
+    def put(self, key, value):
+        """
+        Store a result in both tiers.
+
+        :param key: Key from get_key.
+        :param value: Picklable result.
+        """
+        self._remember(key, value)
+
+        if self.path is None:
+            return
+
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first, so concurrent processes never read a partially written result
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            size = file.tell()
+        os.replace(temporary_path, path)
+
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, size, _ in self._list_files())
+        else:
+            self._disk_bytes += size
+
+        if self._disk_bytes > self.max_bytes:
+            self._evict()
+
+    def call(self, function, args=(), kwargs=None, name=None):
+        """
+        Call a function, or return its stored result for the same arguments.
+
+        :param function: Function to call.
+        :param args: Positional arguments of the call.
+        :param kwargs: Keyword arguments of the call.
+        :param name: Name of the function in the keys. Defaults to its module and qualified name.
+        :return: Result of the function.
+        """
+        kwargs = kwargs or {}
+        key = self.get_key(name or f'{function.__module__}.{function.__qualname__}', args, kwargs)
+
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = function(*args, **kwargs)
+        self.put(key, value)
+        return copy.deepcopy(value) if self.max_entries > 0 else value
+
+    def clear(self):
+        """
+        Remove all results from both tiers.
+        """
+        self._entries.clear()
+        for path, _, _ in self._list_files():
+            os.remove(path)
+        self._disk_bytes = 0
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.pkl')
+
+    def _list_files(self):
+        # (path, size, last use) of every result on disk
+        if self.path is None or not os.path.isdir(self.path):
+            return []
+        files = []
+        for directory in os.scandir(self.path):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if entry.name.endswith('.pkl'):
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self):
+        # Scanned again, as other processes store and remove results in the same directory
+        files = self._list_files()
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * EVICTION_RATIO if total > self.max_bytes else self.max_bytes
+
+        for path, size, _ in sorted(files, key=lambda file: file[2]):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already evicted by another process
+                pass
+            total -= size
+
+        self._disk_bytes = total
+
+    def __getstate__(self):
+        # Worker processes share the on-disk tier, but start with an empty in-memory tier
+        return {'path': self.path, 'max_entries': self.max_entries, 'max_bytes': self.max_bytes,
+                'version': self.version}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_version():
+    """
+    :return: Hex digest of CACHE_VERSION and the source code of this package, which changes with any change to the
+        code the memoized functions run.
+    """
+    version = hashlib.sha256(b'%d' % CACHE_VERSION)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            version.update(name.encode('utf-8'))
+            with open(os.path.join(directory, name), 'rb') as file:
+                version.update(hashlib.sha256(file.read()).digest())
+    return version.hexdigest()
+
+
+_memo_cache = MemoCache()
+
+
+def get_memo_cache():
+    """
+    :return: The MemoCache the memoized functions store their results in.
+    """
+    return _memo_cache
+
+
+def set_memo_cache(memo_cache):
+    """
+    Store the results of the memoized functions in another MemoCache, e.g. one with an on-disk tier.
+
+    :param memo_cache: MemoCache to use, or None to disable memoization.
+    """
+    global _memo_cache
+    _memo_cache = memo_cache
+
+
+def memoize(function):
+    """
+    Decorator storing the results of a pure function in the current MemoCache. The function must not have side
+    effects, such as writing results, as these are skipped when its result is found.
+    """
+    name = f'{function.__module__}.{function.__qualname__}'
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _memo_cache is None:
+            return function(*args, **kwargs)
+        return _memo_cache.call(function, args, kwargs, name)
+    return wrapper
+
+
+def _update(key, value):
+    # Feed a canonical description of the content of a value to a hash
+    if hasattr(value, 'get_fingerprint'):
+        key.update(b'F' + value.get_fingerprint().encode('utf-8'))
+    elif isinstance(value, np.ndarray):
+        key.update(b'A' + json.dumps([str(value.dtype), value.shape]).encode('utf-8'))
+        key.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        key.update(b'D%d' % len(value))
+        # Keys are described with their type, so {1: x} and {'1': x} differ
+        for item_key in sorted(value, key=lambda item_key: (type(item_key).__name__, str(item_key))):
+            _update(key, [type(item_key).__name__, item_key])
+            _update(key, value[item_key])
+    elif isinstance(value, (list, tuple)):
+        key.update(b'L%d' % len(value))
+        for item in value:
+            _update(key, item)
+    elif isinstance(value, (str, int, float, bool, type(None), np.generic)):
+        key.update(b'V' + json.dumps(value.item() if isinstance(value, np.generic) else value).encode('utf-8'))
+    elif hasattr(value, '__dict__'):
+        # Objects such as the FilepathManager are described by their attributes
+        _update(key, {name: item for name, item in vars(value).items() if not name.startswith('_')})
+    else:
+        raise TypeError(f"Cannot fingerprint a value of type {type(value).__name__}.")
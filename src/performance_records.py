@@ -0,0 +1,246 @@
+import hashlib
+import json
+
+import numpy as np
+
+from .bias_engine import PerformanceTensor
+
+# Fields of a record in the nested performance difference dictionary, in order
+RECORD_FIELDS = ['RateType', 'SpeakingStyle', 'PerformanceDiff', 'BasePerformance', 'BaselinePerformance',
+                 'BaselineType']
+
+# Field holding the intersection of the group of a record, only present for intersectional groups
+INTERSECTION_FIELD = 'Intersection'
+
+
+class PerformanceRecords:
+    """
+    Struct-of-arrays container of performance difference records.
+
+    Every record is a (model, group, speaking style, rate type, baseline type) combination with its performance
+    difference, error rate and baseline error rate. Instead of one dictionary per record, the labels are stored once
+    and every field is a single array over all records, in which the labels are stored as indices. Records are looked
+    up by their labels rather than by their position, so the order of the records does not matter.
+
+    Attributes:
+        models: ASR model names.
+        groups: Speaker group names.
+        speaking_styles: Speaking styles.
+        rate_types: Error rate types.
+        baseline_types: Baseline types.
+        model_index: Index into models of every record.
+        group_index: Index into groups of every record.
+        style_index: Index into speaking_styles of every record.
+        rate_index: Index into rate_types of every record.
+        baseline_index: Index into baseline_types of every record.
+        performance_diff: Performance difference of every record with respect to the baseline.
+        base_performance: Error rate of every record.
+        baseline_performance: Baseline error rate of every record.
+        intersections: Intersection of every group, in the order of groups, or None if all groups are compared with
+            each other.
+    """
+
+    __slots__ = ('models', 'groups', 'speaking_styles', 'rate_types', 'baseline_types', 'model_index', 'group_index',
+                 'style_index', 'rate_index', 'baseline_index', 'performance_diff', 'base_performance',
+                 'baseline_performance', 'intersections', '_positions')
+
+    def __init__(self, models, groups, speaking_styles, rate_types, baseline_types, model_index, group_index,
+                 style_index, rate_index, baseline_index, performance_diff, base_performance, baseline_performance,
+                 intersections=None):
+        self.models = list(models)
+        self.groups = list(groups)
+        self.speaking_styles = list(speaking_styles)
+        self.rate_types = list(rate_types)
+        self.baseline_types = list(baseline_types)
+        self.model_index = np.asarray(model_index, dtype=np.int32)
+        self.group_index = np.asarray(group_index, dtype=np.int32)
+        self.style_index = np.asarray(style_index, dtype=np.int32)
+        self.rate_index = np.asarray(rate_index, dtype=np.int32)
+        self.baseline_index = np.asarray(baseline_index, dtype=np.int32)
+        self.performance_diff = np.asarray(performance_diff, dtype=np.float64)
+        self.base_performance = np.asarray(base_performance, dtype=np.float64)
+        self.baseline_performance = np.asarray(baseline_performance, dtype=np.float64)
+        self.intersections = None if intersections is None else list(intersections)
+        self._positions = None
+
+    @classmethod
+    def from_frame(cls, frame, diff_type, models=None, baseline_types=('min', 'norm')):
+        """
+        Build records from the long-format frame of build_performance_frame.
+
+        :param frame: Result of build_performance_frame. With intersectional groups, it has an INTERSECTION_FIELD
+            column.
+        :param diff_type: Either 'absolute' or 'relative'.
+        :param models: ASR model names, including models without records. Defaults to the models in the frame.
+        :param baseline_types: Baseline types to include. The records of each baseline type follow the row order of
+            the frame.
+        :return: PerformanceRecords with one record per row of the frame and baseline type.
+        """
+        model_column = frame['Model'].astype(str).to_numpy()
+        group_column = frame['Group'].astype(str).to_numpy()
+        style_column = frame['SpeakingStyle'].astype(str).to_numpy()
+        rate_column = frame['RateType'].astype(str).to_numpy()
+
+        models = list(dict.fromkeys(model_column)) if models is None else list(models)
+        groups = list(dict.fromkeys(group_column))
+        speaking_styles = list(dict.fromkeys(style_column))
+        rate_types = list(dict.fromkeys(rate_column))
+
+        intersections = None
+        if INTERSECTION_FIELD in frame:
+            intersections = dict(zip(group_column, frame[INTERSECTION_FIELD].astype(str)))
+            intersections = [intersections[group] for group in groups]
+
+        def index(labels, column):
+            return np.tile(_index_of(labels, column), len(baseline_types))
+
+        return cls(models, groups, speaking_styles, rate_types, baseline_types,
+                   index(models, model_column), index(groups, group_column), index(speaking_styles, style_column),
+                   index(rate_types, rate_column), np.repeat(np.arange(len(baseline_types)), len(frame)),
+                   np.concatenate([frame[f'{diff_type}_{baseline_type}'].to_numpy(dtype=np.float64)
+                                   for baseline_type in baseline_types]),
+                   np.tile(frame['Rates'].to_numpy(dtype=np.float64), len(baseline_types)),
+                   np.concatenate([frame[f'Baseline_{baseline_type}'].to_numpy(dtype=np.float64)
+                                   for baseline_type in baseline_types]),
+                   intersections)
+
+    @classmethod
+    def from_performance_differences(cls, df):
+        """
+        Build records from the nested performance difference dictionary.
+
+        :param df: The performance difference dictionary, {model: {group: [record, ...]}}, e.g. as read from the
+            results.
+        :return: PerformanceRecords holding the same records.
+        """
+        labels = {'Group': {}, 'SpeakingStyle': {}, 'RateType': {}, 'BaselineType': {}}
+        columns = {'Model': [], 'Group': [], 'SpeakingStyle': [], 'RateType': [], 'BaselineType': [],
+                   'PerformanceDiff': [], 'BasePerformance': [], 'BaselinePerformance': []}
+        intersections = {}
+
+        for model_index, groups in enumerate(df.values()):
+            for group, records in groups.items():
+                group_index = labels['Group'].setdefault(group, len(labels['Group']))
+                for record in records:
+                    intersections.setdefault(group, record.get(INTERSECTION_FIELD))
+                    columns['Model'].append(model_index)
+                    columns['Group'].append(group_index)
+                    for field in ('SpeakingStyle', 'RateType', 'BaselineType'):
+                        columns[field].append(labels[field].setdefault(record[field], len(labels[field])))
+                    for field in ('PerformanceDiff', 'BasePerformance', 'BaselinePerformance'):
+                        columns[field].append(record[field])
+
+        intersections = [intersections.get(group) for group in labels['Group']]
+        return cls(df.keys(), labels['Group'], labels['SpeakingStyle'], labels['RateType'], labels['BaselineType'],
+                   columns['Model'], columns['Group'], columns['SpeakingStyle'], columns['RateType'],
+                   columns['BaselineType'], columns['PerformanceDiff'], columns['BasePerformance'],
+                   columns['BaselinePerformance'],
+                   intersections if any(intersection is not None for intersection in intersections) else None)
+
+    def to_performance_differences(self):
+        """
+        Convert the records to the nested performance difference dictionary, e.g. to export them as JSON.
+
+        :return: Performance differences as {model: {group: [record, ...]}}, with the records in stored order. With
+            intersectional groups, every record holds the intersection of its group under INTERSECTION_FIELD.
+        """
+        performance_differences = {model: {} for model in self.models}
+        columns = zip(self.model_index.tolist(), self.group_index.tolist(), self.rate_index.tolist(),
+                      self.style_index.tolist(), self.performance_diff.tolist(), self.base_performance.tolist(),
+                      self.baseline_performance.tolist(), self.baseline_index.tolist())
+
+        for model, group, rate_type, speaking_style, performance_diff, base, baseline, baseline_type in columns:
+            record = dict(zip(RECORD_FIELDS, (self.rate_types[rate_type], self.speaking_styles[speaking_style],
+                                              performance_diff, base, baseline, self.baseline_types[baseline_type])))
+            if self.intersections is not None:
+                record[INTERSECTION_FIELD] = self.intersections[group]
+            performance_differences[self.models[model]].setdefault(self.groups[group], []).append(record)
+
+        return performance_differences
+
+    def to_tensor(self):
+        """
+        Scatter the records into a dense PerformanceTensor, with NaN for missing combinations.
+
+        :return: PerformanceTensor with the axes ordered as the labels of the records.
+        """
+        shape = (len(self.baseline_types), len(self.models), len(self.groups), len(self.speaking_styles),
+                 len(self.rate_types))
+        index = (self.baseline_index, self.model_index, self.group_index, self.style_index, self.rate_index)
+
+        arrays = []
+        for values in (self.performance_diff, self.base_performance, self.baseline_performance):
+            array = np.full(shape, np.nan)
+            array[index] = values
+            arrays.append(array)
+
+        return PerformanceTensor(self.baseline_types, self.models, self.groups, self.speaking_styles,
+                                 self.rate_types, *arrays, self.intersections)
+
+    def find(self, model, group, speaking_style, rate_type, baseline_type):
+        """
+        Look up a record by its labels.
+
+        :param model: ASR model name.
+        :param group: Speaker group name.
+        :param speaking_style: Speaking style.
+        :param rate_type: Error rate type.
+        :param baseline_type: Baseline type.
+        :return: Position of the record, or None if there is no such record.
+        """
+        if self._positions is None:
+            # Built on the first lookup only
+            keys = zip(self.model_index.tolist(), self.group_index.tolist(), self.style_index.tolist(),
+                       self.rate_index.tolist(), self.baseline_index.tolist())
+            self._positions = {key: position for position, key in enumerate(keys)}
+
+        try:
+            key = (self.models.index(model), self.groups.index(group), self.speaking_styles.index(speaking_style),
+                   self.rate_types.index(rate_type), self.baseline_types.index(baseline_type))
+        except ValueError:
+            return None
+
+        return self._positions.get(key)
+
+    def groups_of(self, model):
+        """
+        :param model: ASR model name.
+        :return: The groups with records of the model, in order of their first record.
+        """
+        model_index = self.models.index(model)
+        return [self.groups[group] for group in dict.fromkeys(self.group_index[self.model_index == model_index].tolist())]
+
+    def get_fingerprint(self):
+        # Fingerprint of the dense arrays, which do not depend on the order of the records
+        tensor = self.to_tensor()
+        fingerprint = hashlib.sha256(json.dumps([self.models, self.groups, self.speaking_styles, self.rate_types,
+                                                 self.baseline_types, self.intersections]).encode('utf-8'))
+        for array in (tensor.performance_diff, tensor.base_performance, tensor.baseline_performance):
+            fingerprint.update(array.tobytes())
+        return fingerprint.hexdigest()
+
+    def __len__(self):
+        return len(self.performance_diff)
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != '_positions'}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._positions = None
+
+
+def as_performance_records(df):
+    """
+    :param df: PerformanceRecords, or the nested performance difference dictionary.
+    :return: PerformanceRecords.
+    """
+    if isinstance(df, PerformanceRecords):
+        return df
+    return PerformanceRecords.from_performance_differences(df)
+
+
+def _index_of(labels, column):
+    positions = {label: position for position, label in enumerate(labels)}
+    return np.array([positions[label] for label in column], dtype=np.int32)
@@ -1,68 +1,245 @@
-def read_data(asr_output_data, filepath_manager, result_per_group_df, result_per_speaker_df):
-    for speaking_style_index in range(0, 2):
-        data_frame = asr_output_data.build_dataframe(speaking_style_index)
+import numpy as np
 
-        for model in filepath_manager.asr_models:
-            for _, data in data_frame[model].items():
-                group = data[0]
-                key = model + '_' + group + '_' + filepath_manager.speaking_style_folders[speaking_style_index]
+from .filepath_manager import get_key
+from .incremental import fingerprint
+from .instrumentation import stage
+
+
+def word_error_rate(substitutions, insertions, deletions, hits, words):
+    return (substitutions + insertions + deletions) / words
+
+
+def match_error_rate(substitutions, insertions, deletions, hits, words):
+    return (substitutions + insertions + deletions) / (substitutions + insertions + deletions + hits)
+
+
+def word_information_lost(substitutions, insertions, deletions, hits, words):
+    # 1 - (hits / reference words) * (hits / hypothesis words)
+    return 1 - (hits * hits) / ((hits + substitutions + deletions) * (hits + substitutions + insertions))
+
+
+# Error rates computed from the Sub/Ins/Del/Corr/# Wrd counts. CER uses the same formula as WER, applied to the counts
+# of a character-level alignment, see CHARACTER_COUNT_COLUMNS.
+ERROR_RATES = {
+    'WER': word_error_rate,
+    'MER': match_error_rate,
+    'WIL': word_information_lost,
+    'CER': word_error_rate,
+}
+
+# Columns of the counts the error rates are calculated from, in the order of the arguments of the ERROR_RATES
+COUNT_COLUMNS = ['Sub', 'Ins', 'Del', 'Corr', '# Wrd']
+
+# Error rates calculated from the counts of a character-level alignment of the transcripts
+CHARACTER_RATES = ['CER']
+
+# Columns of the counts of the character-level alignment, in the same order as COUNT_COLUMNS
+CHARACTER_COUNT_COLUMNS = ['Char Sub', 'Char Ins', 'Char Del', 'Char Corr', '# Char']
+
+# Key of the number of reference words of every speaker, stored next to the error rates per speaker
+WORD_COUNT = 'Words'
+
+# Key of the number of reference characters of every speaker, stored if any CHARACTER_RATES are calculated
+CHARACTER_COUNT = 'Characters'
+
+
+def get_count_columns(rate_type):
+    """
+    Get the columns of the counts an error rate is calculated from.
+
+    :param rate_type: Name of the error rate, a key of ERROR_RATES.
+    :return: CHARACTER_COUNT_COLUMNS for the CHARACTER_RATES, COUNT_COLUMNS otherwise.
+    """
+    return CHARACTER_COUNT_COLUMNS if rate_type in CHARACTER_RATES else COUNT_COLUMNS
+
+
+def get_weight_key(rate_type):
+    """
+    Get the key of the per-speaker counts by which the error rates of the speakers add up to that of their group.
+
+    :param rate_type: Name of the error rate, a key of ERROR_RATES.
+    :return: CHARACTER_COUNT for the CHARACTER_RATES, WORD_COUNT otherwise.
+    """
+    return CHARACTER_COUNT if rate_type in CHARACTER_RATES else WORD_COUNT
+
+
+def check_error_rates(error_rates, input_format='output'):
+    """
+    Check that the error rates exist and can be calculated from the input.
+
+    :param error_rates: Names of the error rates.
+    :param input_format: Input format of the FilepathManager, 'output' or 'transcripts'.
+    :raises ValueError: If an error rate is unknown, or needs a character alignment while the input only holds word
+        counts.
+    """
+    unknown = [rate_type for rate_type in error_rates if rate_type not in ERROR_RATES]
+    if unknown:
+        raise ValueError(f"Invalid error_rates {unknown}. Use any of {list(ERROR_RATES)}.")
+
+    character_rates = [rate_type for rate_type in error_rates if rate_type in CHARACTER_RATES]
+    if character_rates and input_format != 'transcripts':
+        raise ValueError(f"The error_rates {character_rates} need a character-level alignment, but the output files "
+                         f"only hold word counts. Set input_format to 'transcripts' or leave them out.")
+
+
+def read_data(asr_output_data, filepath_manager, result_per_group_df, result_per_speaker_df, state=None):
+    """
+    Calculate the configured error rates of every ASR model, speaker group and speaking style.
+
+    All error rates are calculated in a single pass over the counts of each output file.
+
+    :param asr_output_data: AsrOutputData to read the output files with.
+    :param filepath_manager: FilepathManager holding the ASR models, speaker groups and speaking styles.
+    :param result_per_group_df: Dictionary to store the error rates per group in, keyed by 'model_group_style'.
+    :param result_per_speaker_df: Dictionary to store the error rates per speaker in, keyed by 'model_group_style'.
+    :param state: Optional IncrementalState. If given, only output files that changed since the last run, or whose
+        error rates were not calculated yet, are processed again. Not used for intersectional groups.
+    """
+    error_rates = filepath_manager.get_error_rates()
+    check_error_rates(error_rates, filepath_manager.input_format)
+
+    if filepath_manager.intersections:
+        read_intersections(asr_output_data, filepath_manager, result_per_group_df, result_per_speaker_df)
+        return
+
+    # Only the combinations with input files, missing ones are reported by the FilepathManager
+    sources = filepath_manager.get_combinations()
+    fingerprints = asr_output_data.get_fingerprints() if state is not None else {}
+    results = {}
+
+    def source_fingerprint(source):
+        # Changing the configured error rates, or the values stored per speaker, invalidates the stored results as well
+        return fingerprint([fingerprints[source], error_rates, WORD_COUNT, CHARACTER_COUNT_COLUMNS])
+
+    if state is not None:
+        for source in sources:
+            cached = state.get('error_rates', '_'.join(source), source_fingerprint(source))
+            if cached is not None and fingerprints[source] is not None:
+                results[source] = tuple(cached)
+
+    if len(results) != len(sources):
+        with stage('build_table') as record:
+            table = asr_output_data.build_table()
+            tables = dict(iter(table.groupby(['Model', 'Group', 'SpeakingStyle'], observed=True, sort=False)))
+            record['items'] = len(table)
+
+        with stage('error_rates', items=len(sources) - len(results)):
+            for model, group, speaking_style in sources:
+                # Transcript files need not contain every group
+                if (model, group, speaking_style) not in results and (model, group, speaking_style) in tables:
+                    # Process model output data
+                    results[(model, group, speaking_style)] = process_output(
+                        (group, tables[(model, group, speaking_style)]), error_rates)
+
+                    if state is not None:
+                        state.put('error_rates', '_'.join((model, group, speaking_style)),
+                                  source_fingerprint((model, group, speaking_style)),
+                                  results[(model, group, speaking_style)])
+
+    for model, group, speaking_style in sources:
+        if (model, group, speaking_style) in results:
+            key = get_key(model, group, speaking_style)
+            result_per_speaker_df[key], result_per_group_df[key] = results[(model, group, speaking_style)]
+
+    if state is not None:
+        state.retain('error_rates', result_per_group_df.keys())
+
+
+def read_intersections(asr_output_data, filepath_manager, result_per_group_df, result_per_speaker_df):
+    """
+    Calculate the configured error rates of every ASR model, intersectional speaker group and speaking style.
+
+    The counts of the speakers of every ASR model and speaking style are aggregated into all groups of the
+    FilepathManager's GroupIndex at once. Speakers are matched to the speaker metadata by their ID; those without
+    metadata are left out.
+
+    :param asr_output_data: AsrOutputData to read the output files with.
+    :param filepath_manager: FilepathManager holding the ASR models, intersections and speaking styles.
+    :param result_per_group_df: Dictionary to store the error rates per group in, keyed by 'model_group_style'.
+    :param result_per_speaker_df: Dictionary to store the error rates per speaker in, keyed by 'model_group_style'.
+    """
+    error_rates = filepath_manager.get_error_rates()
+    group_index = filepath_manager.get_group_index()
+
+    with stage('build_table') as record:
+        table = asr_output_data.build_table()
+        tables = dict(iter(table.groupby(['Model', 'SpeakingStyle'], observed=True, sort=False)))
+        record['items'] = len(table)
+
+    unmatched = set()
+    with stage('intersections', items=len(group_index.groups)):
+        for speaking_style in filepath_manager.speaking_style_folders:
+            for model in filepath_manager.asr_models:
+                if (model, speaking_style) not in tables:
+                    continue
+
+                speakers = tables[(model, speaking_style)]
+                cells = group_index.get_cells(speakers['Speaker'])
+                unmatched.update(speakers['Speaker'][cells < 0].astype(str))
+
+                count_columns = list(dict.fromkeys(column for rate_type in error_rates
+                                                   for column in get_count_columns(rate_type)))
+                group_counts = dict(zip(count_columns, group_index.aggregate(
+                    speakers[count_columns].to_numpy(dtype=float), cells).T))
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    group_rates = {rate_type: ERROR_RATES[rate_type](*(group_counts[column]
+                                                                       for column in get_count_columns(rate_type)))
+                                   for rate_type in error_rates}
+                speaker_results = {name: np.asarray(values)
+                                   for name, values in process_output((None, speakers), error_rates)[0].items()}
+
+                for position, members in enumerate(group_index.get_members(cells)):
+                    if len(members) == 0:
+                        continue
+
+                    key = get_key(model, group_index.groups[position], speaking_style)
+                    result_per_speaker_df[key] = {name: values[members].tolist()
+                                                  for name, values in speaker_results.items()}
+                    result_per_group_df[key] = {rate_type: float(rates[position])
+                                                for rate_type, rates in group_rates.items()}
+
+    if unmatched:
+        print(f"Leaving out {len(unmatched)} speaker(s) without speaker metadata.")
 
-                # Process model output data
-                result_per_speaker_df[key], result_per_group_df[key] = process_wer(data)
 
 def process_wer(df):
-    total_substitutions = 0
-    total_insertions = 0
-    total_deletions = 0
-    total_words = 0
-    wer_per_speaker = []
+    return process_output(df, error_rates=['WER'])
 
-    # Iterate over file
-    for index, row in df[1].iterrows():
-        total_substitutions = row['Sub']
-        total_insertions = row['Ins']
-        total_deletions = row['Del']
-        total_words = row['# Wrd']
 
-        # Calculate error rates for current speaker
-        wer_per_speaker.append((row['Sub'] + row['Ins'] + row['Del']) / row['# Wrd'])
+def process_output(df, error_rates=('WER', 'MER')):
+    """
+    Calculate error rates per speaker and for the whole group.
 
-    # Calculate total error rates
-    total_wer = (total_substitutions + total_insertions + total_deletions) / total_words
+    Group error rates are computed from the summed counts of all speakers, so they are weighted by the number of
+    words of each speaker, or the number of characters for the CHARACTER_RATES.
 
-    result_per_speaker_df = {'WER': wer_per_speaker }
-    result_per_group_df = {'WER': total_wer }
+    :param df: Tuple of (group, DataFrame with the per-speaker Sub, Ins, Del, Corr and # Wrd counts, and the
+        CHARACTER_COUNT_COLUMNS if any CHARACTER_RATES are calculated).
+    :param error_rates: Names of the error rates to calculate, keys of ERROR_RATES.
+    :return: Tuple of (error rates and number of words per speaker as lists, error rates of the group). The number
+        of words is stored under WORD_COUNT, and the number of characters under CHARACTER_COUNT if any
+        CHARACTER_RATES are calculated.
+    :raises ValueError: If the DataFrame lacks the character counts needed for the CHARACTER_RATES.
+    """
+    data = df[1]
 
-    return result_per_speaker_df, result_per_group_df
+    result_per_speaker_df = {}
+    result_per_group_df = {}
+    totals = {WORD_COUNT: data[COUNT_COLUMNS[4]].to_numpy(dtype=float).tolist()}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for rate_type in error_rates:
+            count_columns = get_count_columns(rate_type)
+            if any(column not in data for column in count_columns):
+                raise ValueError(f"{rate_type} needs the {', '.join(count_columns)} counts of a character-level "
+                                 f"alignment, set input_format to 'transcripts'.")
 
+            counts = [data[column].to_numpy(dtype=float) for column in count_columns]
+            error_rate = ERROR_RATES[rate_type]
+            result_per_speaker_df[rate_type] = error_rate(*counts).tolist()
+            result_per_group_df[rate_type] = float(error_rate(*[column.sum() for column in counts]))
+            totals[get_weight_key(rate_type)] = counts[4].tolist()
 
-def process_output(df):
-    # Processes all relevant error rates, but since decision has been made to solely use WER, this remains unused.
-    total_substitutions = 0
-    total_insertions = 0
-    total_deletions = 0
-    total_hits = 0
-    total_words = 0
-    wer_per_speaker = []
-    mer_per_speaker = []
-
-    # Iterate over file
-    for index, row in df[1].iterrows():
-        total_substitutions = row['Sub']
-        total_insertions = row['Ins']
-        total_deletions = row['Del']
-        total_hits = row['Corr']
-        total_words = row['# Wrd']
-
-        # Calculate error rates for current speaker
-        wer_per_speaker.append((row['Sub'] + row['Ins'] + row['Del']) / row['# Wrd'])
-        mer_per_speaker.append((row['Sub'] + row['Ins'] + row['Del']) / (row['Sub'] + row['Ins'] + row['Del'] + row['Corr']))
-
-    # Calculate total error rates
-    total_wer = (total_substitutions + total_insertions + total_deletions) / total_words
-    total_mer = 1 - (total_hits / (total_substitutions + total_insertions + total_deletions + total_hits))
-
-    result_per_speaker_df = {'WER': wer_per_speaker, 'MER': mer_per_speaker, }
-    result_per_group_df = {'WER': total_wer, 'MER': total_mer, }
+    result_per_speaker_df.update(totals)
 
     return result_per_speaker_df, result_per_group_df
@@ -0,0 +1,108 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .incremental import fingerprint
+from .instrumentation import get_instrumentation, measure
+from .memo_cache import get_memo_cache, set_memo_cache
+
+
+class PlotJob:
+    """
+    Describes a figure to render: a plot function from visualize.py, the data to call it with and the files it writes.
+
+    Attributes:
+        function: Name of the plot function in visualize.py.
+        outputs: Paths of the image files the plot function writes.
+        args: Positional arguments of the plot function.
+        kwargs: Keyword arguments of the plot function.
+    """
+
+    def __init__(self, function, outputs, *args, **kwargs):
+        self.function = function
+        self.outputs = list(outputs)
+        self.args = args
+        self.kwargs = kwargs
+
+    def get_fingerprint(self):
+        # Fingerprint of the plot function and its input data
+        return fingerprint([self.function, _to_json(self.args), _to_json(self.kwargs)])
+
+
+def render_plots(jobs, hash_path, max_workers=None):
+    """
+    Render figures in a pool of worker processes using the non-interactive Agg backend.
+
+    A figure is skipped if all of its image files exist and were rendered from the same input data before. The
+    fingerprints of the rendered input data are kept in hash_path.
+
+    :param jobs: List of PlotJobs.
+    :param hash_path: JSON file holding the fingerprints of the rendered figures.
+    :param max_workers: Number of worker processes. None uses one per CPU, 1 renders in this process.
+    :return: List of the jobs that were rendered. Each rendered figure is recorded as a stage of the current
+        Instrumentation, named after its first image file.
+    """
+    hashes = {}
+    if os.path.exists(hash_path):
+        with open(hash_path, 'r') as file:
+            hashes = json.load(file)
+
+    fingerprints = [job.get_fingerprint() for job in jobs]
+    pending = [(job, job_fingerprint) for job, job_fingerprint in zip(jobs, fingerprints)
+               if not all(hashes.get(output) == job_fingerprint and os.path.exists(output) for output in job.outputs)]
+
+    if (max_workers is not None and max_workers <= 1) or len(pending) <= 1:
+        _use_agg_backend()
+        timings = [_render(job) for job, _ in pending]
+    else:
+        # Workers share the on-disk tier of the MemoCache, so a result computed by one worker is reused by the others
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(get_memo_cache(),)) as executor:
+            # Consume the results, so exceptions in the workers are raised here
+            timings = list(executor.map(_render, [job for job, _ in pending]))
+
+    for (job, _), timing in zip(pending, timings):
+        name = os.path.splitext(os.path.basename(job.outputs[0]))[0] if job.outputs else job.function
+        get_instrumentation().add({'stage': name, 'items': len(job.outputs), **timing})
+
+    for job, job_fingerprint in pending:
+        for output in job.outputs:
+            hashes[output] = job_fingerprint
+
+    os.makedirs(os.path.dirname(hash_path) or '.', exist_ok=True)
+    with open(hash_path, 'w') as file:
+        file.write(json.dumps(hashes, indent=4))
+
+    return [job for job, _ in pending]
+
+
+def _use_agg_backend():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _init_worker(memo_cache):
+    _use_agg_backend()
+    set_memo_cache(memo_cache)
+
+
+def _render(job):
+    # Measured in the worker, as the main process cannot time the figures rendered in parallel
+    from . import visualize
+    _, timing = measure(getattr(visualize, job.function), *job.args, **job.kwargs)
+    return timing
+
+
+def _to_json(value):
+    # Convert plot inputs to JSON-serialisable values, describing objects such as the FilepathManager by their attributes
+    if hasattr(value, 'get_fingerprint'):
+        return value.get_fingerprint()
+    if isinstance(value, dict):
+        return {str(key): _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, '__dict__'):
+        return _to_json(vars(value))
+    return value
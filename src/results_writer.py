@@ -0,0 +1,203 @@
+import json
+import os
+
+RESULTS_FORMATS = ['json', 'parquet', 'feather']
+
+
+class ResultsWriter:
+    """
+    Writes the results of the pipeline, e.g. the error rates and bias metrics, and reads them back.
+
+    Results are nested dictionaries (and lists) of numbers, lists of numbers or records, as returned by the pipeline
+    stages. They are identified by their JSON path, e.g. 'results/bias/new/weighted_performance_bias.json'. The
+    columnar formats store them next to it under the same name with their own extension.
+
+    Attributes:
+        results_format: One of RESULTS_FORMATS.
+        export_json: Whether to also write the results as JSON when using a columnar format.
+    """
+
+    def __init__(self, results_format='parquet', export_json=False):
+        if results_format not in RESULTS_FORMATS:
+            raise ValueError(f"Invalid results_format. Use one of {RESULTS_FORMATS}.")
+
+        self.results_format = results_format
+        self.export_json = export_json
+
+    def write(self, path, data):
+        """
+        Write results. Falls back to JSON if the columnar format is unavailable, i.e. pyarrow is not installed, or
+        cannot store the results, e.g. because a column would hold values of different types.
+
+        :param path: JSON path of the results.
+        :param data: JSON-serialisable results.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        write_json = self.results_format == 'json' or self.export_json
+
+        if self.results_format != 'json':
+            try:
+                _write_table(to_table(data), self.get_path(path), self.results_format)
+            except ImportError as error:
+                print(f"Writing {path} as JSON, {self.results_format} support is unavailable: {error}")
+                write_json = True
+            except (ValueError, TypeError) as error:
+                # pyarrow raises ArrowInvalid and ArrowTypeError, e.g. for values of mixed types in one column
+                print(f"Writing {path} as JSON, it cannot be stored as {self.results_format}: {error}")
+                write_json = True
+
+            if write_json and os.path.exists(self.get_path(path)):
+                # Otherwise read would return the results of an earlier run
+                os.remove(self.get_path(path))
+
+        if write_json:
+            with open(path, 'w') as file:
+                file.write(json.dumps(data, indent=4))
+
+    def read(self, path):
+        """
+        Read results written by write.
+
+        :param path: JSON path of the results.
+        :return: The results.
+        """
+        columnar_path = self.get_path(path)
+
+        if self.results_format != 'json' and os.path.exists(columnar_path):
+            try:
+                return from_table(_read_table(columnar_path, self.results_format))
+            except ImportError:
+                pass
+
+        # Results written as JSON, or written before the format was changed
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def get_path(self, path):
+        # Path of the results in the configured format
+        return os.path.splitext(path)[0] + '.' + self.results_format
+
+
+def get_results_writer(fpm):
+    """
+    Create the results writer configured in config.json.
+
+    :param fpm: FilepathManager holding the results format.
+    :return: ResultsWriter.
+    """
+    return ResultsWriter(fpm.results_format, fpm.export_json)
+
+
+def to_table(data):
+    """
+    Flatten results to a long table with one row per value, list element or record.
+
+    The dictionary keys leading to a value are stored in the Key0, Key1, ... columns, the position of list elements
+    in the Index column, plain values in the Value column and the fields of records in columns of their own. Empty
+    dictionaries and lists have a row of their own, marked 'dict' or 'list' in the Empty column. The layout is kept
+    in the schema metadata, so from_table can restore the nesting.
+
+    :param data: JSON-serialisable results.
+    :return: pyarrow Table.
+    """
+    import pyarrow as pa
+
+    rows = []
+    _flatten(data, (), rows)
+
+    depth = max((len(keys) for keys, _, _ in rows), default=0)
+    fields = list(dict.fromkeys(field for _, _, value in rows if isinstance(value, dict) for field in value))
+
+    columns = {f'Key{level}': [keys[level] if level < len(keys) else None for keys, _, _ in rows]
+               for level in range(depth)}
+    columns['Index'] = [index for _, index, _ in rows]
+    columns['Value'] = [None if isinstance(value, dict) or _empty_type(value) else value for _, _, value in rows]
+    for field in fields:
+        columns[field] = [value.get(field) if isinstance(value, dict) else None for _, _, value in rows]
+    if any(_empty_type(value) for _, _, value in rows):
+        columns['Empty'] = [_empty_type(value) for _, _, value in rows]
+
+    layout = {'depth': depth, 'fields': fields, 'list': isinstance(data, list)}
+    return pa.table(columns).replace_schema_metadata({'results_layout': json.dumps(layout)})
+
+
+def from_table(table):
+    """
+    Restore results flattened by to_table.
+
+    :param table: pyarrow Table.
+    :return: The results.
+    """
+    layout = json.loads(table.schema.metadata[b'results_layout'])
+    columns = table.to_pydict()
+    key_columns = [columns[f'Key{level}'] for level in range(layout['depth'])]
+    field_columns = {field: columns[field] for field in layout['fields']}
+    empty_column = columns.get('Empty', [None] * table.num_rows)
+
+    data = [] if layout['list'] else {}
+
+    for row, (index, value, empty) in enumerate(zip(columns['Index'], columns['Value'], empty_column)):
+        keys = [key_column[row] for key_column in key_columns if key_column[row] is not None]
+
+        if empty is not None:
+            value = {} if empty == 'dict' else []
+            if not keys and index is None:
+                # The results themselves are empty
+                continue
+        elif value is None and any(field_column[row] is not None for field_column in field_columns.values()):
+            value = {field: field_column[row] for field, field_column in field_columns.items()}
+
+        if index is None:
+            container = data
+            for key in keys[:-1]:
+                container = container.setdefault(key, {})
+            container[keys[-1]] = value
+        else:
+            container = data
+            for level, key in enumerate(keys):
+                container = container.setdefault(key, {} if level < len(keys) - 1 else [])
+            container.append(value)
+
+    return data
+
+
+def _write_table(table, path, results_format):
+    if results_format == 'feather':
+        from pyarrow import feather
+        feather.write_feather(table, path)
+    else:
+        from pyarrow import parquet
+        parquet.write_table(table, path)
+
+
+def _read_table(path, results_format):
+    # Feather files are memory-mapped, so only the columns that are used are read from disk
+    if results_format == 'feather':
+        from pyarrow import feather
+        return feather.read_table(path, memory_map=True)
+    else:
+        from pyarrow import parquet
+        return parquet.read_table(path)
+
+
+def _flatten(data, keys, rows):
+    # Collect (keys, list index, value) tuples; list elements are added as a whole, so records stay dictionaries.
+    # Empty dictionaries and lists are added as a value, so they are not lost
+    if isinstance(data, dict) and data:
+        for key, value in data.items():
+            _flatten(value, keys + (str(key),), rows)
+    elif isinstance(data, list) and data:
+        for index, value in enumerate(data):
+            rows.append((keys, index, value))
+    else:
+        rows.append((keys, None, data))
+
+
+def _empty_type(value):
+    # Marker of empty dictionaries and lists in the Empty column
+    if isinstance(value, dict) and not value:
+        return 'dict'
+    if isinstance(value, list) and not value:
+        return 'list'
+    return None
+
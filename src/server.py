@@ -0,0 +1,439 @@
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from .bias_engine import BASELINE_AXIS, STYLE_AXIS, RATE_AXIS
+from .memo_cache import get_memo_cache, set_memo_cache
+
+METRICS = ['wpb', 'iwpb']
+
+# Largest request body that is accepted, in bytes
+MAX_BODY_SIZE = 2 ** 20
+
+
+class BiasService:
+    """
+    Keeps the evaluation data in memory and answers bias queries on it, for the server mode.
+
+    The error rates are read once, using the same caches as the ingest stage, and kept as the dense PerformanceTensor
+    of the absolute performance differences. A query then only evaluates the bias metrics for its weights, models,
+    speaking style and error rate, without reading or writing any files. New data is loaded into new objects, which
+    replace the current ones when complete, so queries can be answered while data is being reloaded.
+
+    Attributes:
+        filepath_manager: FilepathManager holding the ASR models, speaker groups, speaking styles and error rates.
+        records: PerformanceRecords of the absolute performance differences.
+        tensor: PerformanceTensor of the records.
+        version: Number of times the data was loaded, returned with every answer so clients can detect new data.
+    """
+
+    def __init__(self, filepath_manager):
+        self.filepath_manager = filepath_manager
+        self.records = None
+        self.tensor = None
+        self.version = 0
+        self.load()
+
+    def load(self):
+        """
+        Read the error rates of all configured ASR models and replace the data in memory. Only output files that
+        changed since they were last read are parsed again.
+        """
+        from .asr_output_data import AsrOutputData
+        from .bias_calculation import build_performance_frame
+        from .performance_records import PerformanceRecords
+        from .process import read_data
+        from .speaker_bias import speaker_group_rates
+
+        state = None
+        if self.filepath_manager.incremental:
+            from .incremental import IncrementalState
+            state = IncrementalState(os.path.join(self.filepath_manager.get_cache_path(), 'incremental.json'))
+
+        # Input files may have been added since the last load
+        self.filepath_manager.scan(refresh=True)
+
+        result_per_group_df, result_per_speaker_df = {}, {}
+        read_data(AsrOutputData(self.filepath_manager), self.filepath_manager, result_per_group_df,
+                  result_per_speaker_df, state)
+        if state is not None:
+            state.save()
+
+        if self.filepath_manager.bias_level == 'speaker':
+            result_per_group_df = speaker_group_rates(result_per_speaker_df, self.filepath_manager.error_rates,
+                                                      self.filepath_manager.speaker_weighting)
+
+        records = PerformanceRecords.from_frame(build_performance_frame(result_per_group_df, self.filepath_manager),
+                                                'absolute', self.filepath_manager.asr_models)
+        self.records, self.tensor = records, records.to_tensor()
+        self.version += 1
+
+    def add_models(self, models):
+        """
+        Add ASR models whose input files were placed according to the path template, and load their data. If any of
+        the models has no input files, none of them are added.
+
+        :param models: Names of the ASR models.
+        :return: The ASR models that were added.
+        """
+        added = [model for model in models if model not in self.filepath_manager.asr_models]
+        if not added:
+            return []
+
+        # The input files of the new models were placed after the last scan
+        self.filepath_manager.scan(refresh=True)
+        previous_models = self.filepath_manager.asr_models
+        self.filepath_manager.asr_models = previous_models + added
+        available = {model for model, _, _ in self.filepath_manager.get_combinations()}
+        without_files = [model for model in added if model not in available]
+        if without_files:
+            self.filepath_manager.asr_models = previous_models
+            raise ValueError(f"No input files found for {', '.join(without_files)}.")
+
+        self.load()
+        return added
+
+    def get_labels(self):
+        """
+        :return: Dictionary with the ASR models, speaker groups, speaking styles and error rates of the data.
+        """
+        return {'models': self.tensor.models, 'groups': self.tensor.groups,
+                'speaking_styles': self.tensor.speaking_styles, 'rate_types': self.tensor.rate_types,
+                'version': self.version}
+
+
+def evaluate_bias(tensor, metric='iwpb', w1=0.5, w2=None, models=None, speaking_style=None, rate_type=None):
+    """
+    Evaluate the WPB or IWPB of every group for a single weight.
+
+    :param tensor: PerformanceTensor of the absolute performance differences.
+    :param metric: Either 'wpb' or 'iwpb'.
+    :param w1: Weight for performance difference.
+    :param w2: Weight for base performance. Defaults to 1 - w1.
+    :param models: Optional ASR models to evaluate. Defaults to all models.
+    :param speaking_style: Optional speaking style. Defaults to the average over all speaking styles.
+    :param rate_type: Optional error rate. Defaults to the average over all error rates.
+    :return: Dictionary with the 'bias' of every group as {model: {group: value}} and the 'total' bias of every
+        model, averaged over its groups.
+    """
+    w2 = 1 - w1 if w2 is None else w2
+
+    if metric == 'wpb':
+        values = tensor.weighted_performance_terms(w1, w2)
+    elif metric == 'iwpb':
+        # The IWPB normalises by the first baseline type, as in the batch pipeline
+        values = tensor.intergroup_weighted_performance_bias(w1, w2)[..., :1, :, :, :, :]
+    else:
+        raise ValueError(f"Invalid metric. Use one of {', '.join(METRICS)}.")
+
+    if speaking_style is not None:
+        index = _index_of(tensor.speaking_styles, speaking_style, 'speaking style')
+        values = values[..., index:index + 1, :]
+    if rate_type is not None:
+        index = _index_of(tensor.rate_types, rate_type, 'error rate')
+        values = values[..., index:index + 1]
+
+    models = tensor.models if models is None else models
+    model_indices = [_index_of(tensor.models, model, 'model') for model in models]
+
+    with warnings.catch_warnings():
+        # Groups and models without data result in NaN
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        bias = np.nanmean(values, axis=(BASELINE_AXIS, STYLE_AXIS, RATE_AXIS))[model_indices]
+        total = np.nanmean(bias, axis=1)
+
+    return {
+        'bias': {model: {group: float(value) for group, value in zip(tensor.groups, bias[position])
+                         if not np.isnan(value)}
+                 for position, model in enumerate(models)},
+        'total': {model: None if np.isnan(total[position]) else float(total[position])
+                  for position, model in enumerate(models)},
+    }
+
+
+def sweep_bias(records, metric='iwpb', resolution=100):
+    """
+    :param records: PerformanceRecords of the absolute performance differences.
+    :param metric: Either 'wpb' or 'iwpb'.
+    :param resolution: Number of w1 values between 0 and 1.
+    :return: Dictionary with the 'w1' values and the total 'bias' of every model for each of them.
+    """
+    from .bias_calculation import sweep_weights
+
+    w1_values = np.linspace(0, 1, resolution)
+    models, bias = sweep_weights(records, w1_values, metric=metric)
+    return {'w1': w1_values.tolist(), 'bias': {model: bias[:, index].tolist() for index, model in enumerate(models)}}
+
+
+def optimise_bias(records, **parameters):
+    """
+    :param records: PerformanceRecords of the absolute performance differences.
+    :param parameters: Keyword arguments of optimise_weights.
+    :return: Result of optimise_weights.
+    """
+    from .weight_optimiser import optimise_weights
+    return optimise_weights(records, **parameters)
+
+
+async def serve(service, host='127.0.0.1', port=8000, max_workers=None):
+    """
+    Answer bias queries over a local HTTP/JSON API until interrupted.
+
+    Requests are handled concurrently by an asyncio event loop. Queries are evaluated in a pool of worker processes,
+    which share the on-disk tier of the MemoCache, and loading data runs in a thread, one load at a time. The workers
+    receive the data once, when they start, and queries only send their parameters. After the data is loaded again,
+    the next query starts a new pool with the new data, while the previous pool completes its queries. All endpoints
+    answer with a JSON object:
+
+    - GET /health: status of the server and version of the data.
+    - GET /labels: ASR models, speaker groups, speaking styles and error rates.
+    - GET or POST /bias: WPB or IWPB per group for 'metric', 'w1', optionally 'w2', 'models', 'speaking_style' and
+      'rate_type', e.g. /bias?metric=iwpb&models=X,Y&w1=0.3&speaking_style=HMI.
+    - POST /sweep: total bias of every model for 'resolution' values of w1 for 'metric'.
+    - POST /optimise: weights fit under an objective, with the parameters of optimise_weights.
+    - POST /models: add the ASR models in 'models', whose input files were placed according to the path template.
+    - POST /reload: read the input files that changed since they were last read.
+
+    :param service: BiasService holding the data.
+    :param host: Host to listen on.
+    :param port: Port to listen on.
+    :param max_workers: Number of worker processes. None uses one per CPU.
+    """
+    pool = _DataPool(service, max_workers)
+    try:
+        handler = functools.partial(_handle_connection, service, pool, asyncio.Lock())
+        server = await asyncio.start_server(handler, host, port)
+        print(f"Serving bias queries on http://{host}:{port}")
+
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.shutdown()
+
+
+class _DataPool:
+    # Pool of worker processes holding the records of one version of the data of a BiasService
+
+    def __init__(self, service, max_workers=None):
+        self.service = service
+        self.max_workers = max_workers
+        self.version = None
+        self._executor = None
+
+    def get_executor(self):
+        # Called from the event loop only, so the pool is replaced by one request at a time
+        records, version = self.service.records, self.service.version
+        if version != self.version:
+            if self._executor is not None:
+                # Queries submitted to the previous pool are still completed on the previous data
+                self._executor.shutdown(wait=False)
+            # Workers are started lazily, while connections are open. Forked workers would inherit their sockets and
+            # keep them open after the server closes them, so the workers are spawned instead.
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker, initargs=(get_memo_cache(), records))
+            self.version = version
+        return self._executor, self.version
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+# Data of the current worker process, set by _init_worker
+_worker_records = None
+_worker_tensor = None
+
+
+def _init_worker(memo_cache, records):
+    global _worker_records, _worker_tensor
+    set_memo_cache(memo_cache)
+    _worker_records, _worker_tensor = records, records.to_tensor()
+
+
+def _evaluate_bias(parameters):
+    return evaluate_bias(_worker_tensor, **parameters)
+
+
+def _sweep_bias(metric, resolution):
+    return sweep_bias(_worker_records, metric, resolution)
+
+
+def _optimise_bias(parameters):
+    return optimise_bias(_worker_records, **parameters)
+
+
+class _HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def _handle_connection(service, pool, lock, reader, writer):
+    # Answer the requests of a connection in order, keeping it open between requests unless asked otherwise
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except _HttpError as error:
+                _write_response(writer, error.status, {'error': str(error)}, keep_alive=False)
+                await writer.drain()
+                break
+
+            if request is None:
+                break
+
+            method, path, parameters, keep_alive = request
+            status, payload = await _dispatch(service, pool, lock, method, path, parameters)
+            _write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise _HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise _HttpError(HTTPStatus.BAD_REQUEST, "Malformed Content-Length header.")
+    if length < 0:
+        raise _HttpError(HTTPStatus.BAD_REQUEST, "Malformed Content-Length header.")
+    if length > MAX_BODY_SIZE:
+        raise _HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large.")
+    body = await reader.readexactly(length) if length else b''
+
+    url = urlsplit(target)
+    parameters = dict(parse_qsl(url.query))
+    if body:
+        try:
+            parameters.update(json.loads(body))
+        except (ValueError, TypeError):
+            raise _HttpError(HTTPStatus.BAD_REQUEST, "The request body is not a JSON object.")
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+    return method.upper(), url.path.rstrip('/') or '/', parameters, keep_alive
+
+
+async def _dispatch(service, pool, lock, method, path, parameters):
+    loop = asyncio.get_running_loop()
+
+    try:
+        if path == '/health' and method == 'GET':
+            payload = {'status': 'ok', 'version': service.version}
+        elif path == '/labels' and method == 'GET':
+            payload = service.get_labels()
+        elif path == '/bias' and method in ('GET', 'POST'):
+            payload = await _run_query(pool, functools.partial(_evaluate_bias, _get_bias_parameters(parameters)))
+        elif path == '/sweep' and method == 'POST':
+            payload = await _run_query(pool, functools.partial(
+                _sweep_bias, parameters.get('metric', 'iwpb'), int(parameters.get('resolution', 100))))
+        elif path == '/optimise' and method == 'POST':
+            payload = await _run_query(pool, functools.partial(_optimise_bias, _get_optimise_parameters(parameters)))
+        elif path in ('/models', '/reload') and method == 'POST':
+            # Loading reads files and replaces the data, so only one load runs at a time
+            async with lock:
+                if path == '/models':
+                    payload = {'added': await loop.run_in_executor(None, service.add_models,
+                                                                   _get_list(parameters.get('models')))}
+                else:
+                    await loop.run_in_executor(None, service.load)
+                    payload = {}
+            payload['version'] = service.version
+        elif path in ('/health', '/labels', '/bias', '/sweep', '/optimise', '/models', '/reload'):
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': f"{method} is not supported for {path}."}
+        else:
+            return HTTPStatus.NOT_FOUND, {'error': f"Unknown endpoint {path}."}
+    except (ValueError, TypeError) as error:
+        return HTTPStatus.BAD_REQUEST, {'error': str(error)}
+    except Exception as error:
+        return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(error)}
+
+    return HTTPStatus.OK, {'version': service.version, **payload}
+
+
+async def _run_query(pool, task):
+    # Answered with the version of the data the query was evaluated on, which may precede a load in progress
+    executor, version = pool.get_executor()
+    return {**await asyncio.get_running_loop().run_in_executor(executor, task), 'version': version}
+
+
+def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    headers = [f'HTTP/1.1 {status.value} {status.phrase}', 'Content-Type: application/json',
+               f'Content-Length: {len(body)}', f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+
+
+def _get_bias_parameters(parameters):
+    unknown = set(parameters) - {'metric', 'w1', 'w2', 'models', 'speaking_style', 'rate_type'}
+    if unknown:
+        raise ValueError(f"Invalid parameters {', '.join(sorted(unknown))}.")
+
+    return {
+        'metric': parameters.get('metric', 'iwpb'),
+        'w1': float(parameters.get('w1', 0.5)),
+        'w2': float(parameters['w2']) if parameters.get('w2') is not None else None,
+        'models': _get_list(parameters.get('models')),
+        'speaking_style': parameters.get('speaking_style'),
+        'rate_type': parameters.get('rate_type'),
+    }
+
+
+def _get_optimise_parameters(parameters):
+    unknown = set(parameters) - {'metric', 'objective', 'scope', 'per_rate', 'bounds', 'target_ranking'}
+    if unknown:
+        raise ValueError(f"Invalid parameters {', '.join(sorted(unknown))}.")
+
+    parameters = dict(parameters)
+    if parameters.get('bounds') is not None:
+        if not isinstance(parameters['bounds'], dict) or not all(
+                isinstance(bounds, list) and len(bounds) == 2 for bounds in parameters['bounds'].values()):
+            raise ValueError("Invalid bounds. Give a JSON object with a [lower, upper] pair per term.")
+        parameters['bounds'] = {term: tuple(bounds) for term, bounds in parameters['bounds'].items()}
+    return parameters
+
+
+def _get_list(value):
+    # Lists can be given as JSON arrays or as comma-separated query parameters
+    if value is None or isinstance(value, list):
+        return value
+    return [item for item in str(value).split(',') if item]
+
+
+def _index_of(labels, label, name):
+    try:
+        return labels.index(label)
+    except ValueError:
+        raise ValueError(f"Unknown {name} {label}. Use one of {', '.join(labels)}.")
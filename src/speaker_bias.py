@@ -0,0 +1,229 @@
+import warnings
+
+import numpy as np
+
+from .bias_engine import BASELINE_AXIS, PerformanceTensor, get_intersection_members
+from .filepath_manager import get_key
+from .process import get_weight_key
+
+BIAS_LEVELS = ['group', 'speaker']
+SPEAKER_WEIGHTINGS = ['words', 'speakers']
+
+
+def get_speaker_rates(result_per_speaker_df, key, rate_type, weighting='words'):
+    """
+    Get the error rates of the speakers of a key, together with the weight of every speaker.
+
+    Speakers without a finite error rate, e.g. those without any reference words, are left out.
+
+    :param result_per_speaker_df: SpeakerStore, or the error rates per speaker as collected by read_data.
+    :param key: 'model_group_style' key.
+    :param rate_type: The error rate.
+    :param weighting: 'words' weighs every speaker by their number of words (characters for CER), 'speakers' weighs
+        all speakers equally.
+    :return: Tuple of (error rates, weights), both 1-D float arrays.
+    """
+    if weighting not in SPEAKER_WEIGHTINGS:
+        raise ValueError(f"Invalid speaker_weighting. Use one of {', '.join(SPEAKER_WEIGHTINGS)}.")
+
+    speakers = result_per_speaker_df[key]
+    rates = np.asarray(speakers[rate_type], dtype=np.float64)
+
+    if weighting == 'words':
+        weight_key = get_weight_key(rate_type)
+        if weight_key not in speakers:
+            raise ValueError(f"The number of {weight_key.lower()} per speaker is unavailable, run the ingest stage "
+                             f"again.")
+        weights = np.asarray(speakers[weight_key], dtype=np.float64)
+    else:
+        weights = np.ones(len(rates))
+
+    valid = np.isfinite(rates) & (weights > 0)
+    return rates[valid], weights[valid]
+
+
+def speaker_group_rates(result_per_speaker_df, rate_types, weighting='words'):
+    """
+    Calculate the error rate of every group as the weighted mean of the error rates of its speakers.
+
+    Weighted by words, this equals the error rate of the summed counts for WER and CER; for MER and WIL, every
+    speaker counts in proportion to their number of words instead of their number of alignment operations.
+
+    :param result_per_speaker_df: SpeakerStore, or the error rates per speaker as collected by read_data.
+    :param rate_types: The error rates.
+    :param weighting: Either 'words' or 'speakers', see get_speaker_rates.
+    :return: Dictionary with 'model_group_style' keys and {rate_type: error rate} dictionaries as values, like the
+        error rates per group of read_data.
+    """
+    result_per_group_df = {}
+
+    for key in result_per_speaker_df:
+        result_per_group_df[key] = {}
+        for rate_type in rate_types:
+            rates, weights = get_speaker_rates(result_per_speaker_df, key, rate_type, weighting)
+            result_per_group_df[key][rate_type] = float(np.dot(rates, weights) / weights.sum()) \
+                if len(rates) else float('nan')
+
+    return result_per_group_df
+
+
+def weighted_quantile(values, weights, q):
+    """
+    Calculate a quantile of weighted values, interpolating between the midpoints of their cumulative weights.
+
+    With equal weights, this is the 'hazen' quantile of numpy.quantile.
+
+    :param values: 1-D array of values.
+    :param weights: 1-D array of non-negative weights.
+    :param q: Quantile between 0 and 1.
+    :return: The quantile, NaN if there are no values.
+    """
+    if len(values) == 0:
+        return float('nan')
+
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    cumulative = (np.cumsum(weights) - weights / 2) / weights.sum()
+    return float(np.interp(q, cumulative, values))
+
+
+def mean_absolute_differences(samples):
+    """
+    Calculate the weighted mean absolute difference between the speakers of every pair of groups.
+
+    For groups i and j this is sum_a sum_b w_a * w_b * |x_a - x_b| / (sum_a w_a * sum_b w_b), over the speakers a of
+    i and b of j. Instead of comparing all pairs of speakers, the speakers of each group are sorted once and every
+    speaker is located in the other groups by binary search. Prefix sums of the sorted weights and weighted error
+    rates then give the summed differences to all speakers below and above it, so the cost is O(G * N log N) for N
+    speakers in G groups rather than O(N^2).
+
+    :param samples: List of (error rates, weights) tuples, one per group, e.g. from get_speaker_rates.
+    :return: Array of shape (group, group), NaN for pairs with a group without speakers.
+    """
+    n_groups = len(samples)
+    differences = np.full((n_groups, n_groups), np.nan)
+    present = [index for index, (rates, _) in enumerate(samples) if len(rates)]
+    if not present:
+        return differences
+
+    values = np.concatenate([samples[index][0] for index in present])
+    weights = np.concatenate([samples[index][1] for index in present])
+    lengths = np.array([len(samples[index][0]) for index in present])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    totals = np.add.reduceat(weights, starts)
+
+    for column, index in enumerate(present):
+        rates, rate_weights = samples[index]
+        order = np.argsort(rates, kind='stable')
+        sorted_rates = rates[order]
+        cumulative_weights = np.concatenate([[0], np.cumsum(rate_weights[order])])
+        cumulative_rates = np.concatenate([[0], np.cumsum(rate_weights[order] * sorted_rates)])
+
+        # Number of speakers of group j with an error rate of at most each speaker of all groups
+        below = np.searchsorted(sorted_rates, values, side='right')
+        summed = (values * cumulative_weights[below] - cumulative_rates[below]) + \
+                 ((cumulative_rates[-1] - cumulative_rates[below]) - values * (cumulative_weights[-1] -
+                                                                               cumulative_weights[below]))
+
+        differences[present, index] = np.add.reduceat(weights * summed, starts) / (totals * totals[column])
+
+    return differences
+
+
+def calculate_speaker_level_bias(result_per_speaker_df, fpm, wpb_w1, wpb_w2, iwpb_w1, iwpb_w2, weighting='words',
+                                 baseline_quantile=None, writer=None):
+    """
+    Calculate the WPB and IWPB of every group from the error rates of its speakers.
+
+    The base performance of a group is the weighted mean error rate of its speakers. Besides the 'min' and 'norm'
+    baselines, the WPB can use a quantile of the error rates of all speakers of a model and speaking style as
+    baseline, so a single outlying group does not set the baseline. The IWPB compares the speakers of every pair of
+    groups rather than their means: the performance difference of group i is the mean over all other groups j of
+    the mean absolute difference between the speakers of i and j, normalised by the 'min' baseline.
+
+    :param result_per_speaker_df: SpeakerStore, or the error rates per speaker as collected by read_data.
+    :param fpm: FilepathManager holding the ASR models, speaker groups, speaking styles and error rates.
+    :param wpb_w1: Weight for performance difference of the WPB.
+    :param wpb_w2: Weight for base performance of the WPB.
+    :param iwpb_w1: Weight for performance difference of the IWPB.
+    :param iwpb_w2: Weight for base performance of the IWPB.
+    :param weighting: Either 'words' or 'speakers', see get_speaker_rates.
+    :param baseline_quantile: Optional quantile between 0 and 1 to use as additional baseline, e.g. 0.1.
+    :param writer: Optional ResultsWriter to write the results to results/bias/new/speaker_level_bias.json.
+    :return: Dictionary with 'wpb' and 'iwpb' keys and {rate_type: {speaking_style: {model: {group: value}}}}
+        dictionaries as values. The WPB is averaged over the baseline types.
+    """
+    models, groups, speaking_styles = fpm.asr_models, fpm.speaker_groups, fpm.speaking_style_folders
+    rate_types = fpm.error_rates
+    intersections = fpm.get_group_intersections()
+    shape = (len(models), len(groups), len(speaking_styles), len(rate_types))
+
+    rates = np.full(shape, np.nan)
+    quantiles = np.full(shape, np.nan)
+    differences = np.full(shape + (len(groups),), np.nan)
+
+    for model_index, model in enumerate(models):
+        for style_index, speaking_style in enumerate(speaking_styles):
+            for rate_index, rate_type in enumerate(rate_types):
+                samples = [get_speaker_rates(result_per_speaker_df, key, rate_type, weighting)
+                           if key in result_per_speaker_df else (np.empty(0), np.empty(0))
+                           for key in (get_key(model, group, speaking_style) for group in groups)]
+
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    rates[model_index, :, style_index, rate_index] = [
+                        np.dot(*sample) / sample[1].sum() if len(sample[0]) else np.nan for sample in samples]
+
+                # Groups are only compared with the groups of their intersection, and never against themselves
+                for members in get_intersection_members(intersections, len(groups)):
+                    pairwise = mean_absolute_differences([samples[index] for index in members])
+                    np.fill_diagonal(pairwise, np.nan)
+                    differences[model_index, members[:, np.newaxis], style_index, rate_index, members] = pairwise
+
+                    if baseline_quantile is not None:
+                        quantiles[model_index, members, style_index, rate_index] = weighted_quantile(
+                            np.concatenate([samples[index][0] for index in members]),
+                            np.concatenate([samples[index][1] for index in members]), baseline_quantile)
+
+    tensor = PerformanceTensor.from_rates(rates, models, groups, speaking_styles, rate_types, intersections)
+    if baseline_quantile is not None:
+        tensor = _with_baseline(tensor, f'q{baseline_quantile:g}', quantiles)
+
+    with warnings.catch_warnings():
+        # Models without any group in a speaking style result in NaN
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        wpb = np.nanmean(tensor.weighted_performance_terms(wpb_w1, wpb_w2), axis=BASELINE_AXIS)
+
+        # Mean over the other groups of the speaker-level differences, normalised by the 'min' baseline
+        valid = ~np.isnan(differences)
+        count = valid.sum(axis=-1)
+        normalised = np.where(valid, differences, 0).sum(axis=-1) / np.where(count != 0, count, 1) / \
+            tensor.baseline_performance[0]
+        iwpb = iwpb_w1 * normalised + iwpb_w2 * rates
+        # Groups without any other group to compare against have an IWPB of 0
+        iwpb = np.where(count != 0, iwpb, np.where(np.isnan(rates), np.nan, 0.0))
+
+    speaker_level_bias = {metric: {rate_type: {speaking_style: {model: {
+        group: float(values[model_index, group_index, style_index, rate_index])
+        for group_index, group in enumerate(groups) if not np.isnan(values[model_index, group_index, style_index,
+                                                                           rate_index])}
+        for model_index, model in enumerate(models)}
+        for style_index, speaking_style in enumerate(speaking_styles)}
+        for rate_index, rate_type in enumerate(rate_types)}
+        for metric, values in (('wpb', wpb), ('iwpb', iwpb))}
+
+    if writer is not None:
+        writer.write('results/bias/new/speaker_level_bias.json', speaker_level_bias)
+
+    return speaker_level_bias
+
+
+def _with_baseline(tensor, baseline_type, baseline):
+    # Add a baseline of shape (model, group, style, rate) to a tensor built from error rates
+    baseline = np.broadcast_to(baseline, tensor.base_performance.shape[1:])[np.newaxis]
+    base = tensor.base_performance[:1]
+    return PerformanceTensor(tensor.baseline_types + [baseline_type], tensor.models, tensor.groups,
+                             tensor.speaking_styles, tensor.rate_types,
+                             np.concatenate([tensor.performance_diff, np.abs(base - baseline)], axis=BASELINE_AXIS),
+                             np.concatenate([tensor.base_performance, base], axis=BASELINE_AXIS),
+                             np.concatenate([tensor.baseline_performance, baseline], axis=BASELINE_AXIS),
+                             tensor.intersections)
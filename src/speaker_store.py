@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class SpeakerStore(Mapping):
+    """
+    Memory-mapped store of the error rates per speaker.
+
+    The error rates of all speakers are kept in a single (rate type, speaker) array in values.npy, in which the
+    speakers of every 'model_group_style' key form a contiguous slice. index.json holds the keys and the offsets of
+    their slices. The store can be used in place of the result_per_speaker_df dictionary collected by read_data:
+    store[key][rate_type] is a read-only view on the memory-mapped array, so no error rates are copied until used.
+
+    Attributes:
+        path: Directory holding values.npy and index.json.
+        keys: The 'model_group_style' keys, in order of their slices.
+        rate_types: The error rates, in order of the rows of the values. The number of words per speaker, if stored,
+            is a row as well.
+        offsets: Array of len(keys) + 1 offsets, the slice of keys[i] is offsets[i]:offsets[i + 1].
+        values: Memory-mapped (rate type, speaker) array of the error rates.
+        fingerprint: Fingerprint of the stored error rates.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, 'index.json'), 'r') as file:
+            index = json.load(file)
+
+        self.keys = index['keys']
+        self.rate_types = index['rate_types']
+        self.offsets = np.asarray(index['offsets'], dtype=np.int64)
+        self.fingerprint = index['fingerprint']
+        self.values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        self._positions = {key: position for position, key in enumerate(self.keys)}
+
+    @classmethod
+    def write(cls, path, result_per_speaker_df, rate_types=None, dtype=np.float64):
+        """
+        Write the error rates per speaker to a store.
+
+        :param path: Directory to write the store to.
+        :param result_per_speaker_df: Error rates per speaker, keyed by 'model_group_style', as collected by read_data.
+        :param rate_types: The error rates to store. Defaults to all error rates of the first key.
+        :param dtype: Float type of the stored error rates, e.g. np.float32 to halve the size of the store.
+        :return: SpeakerStore reading the written store.
+        """
+        keys = list(result_per_speaker_df.keys())
+        if rate_types is None:
+            rate_types = list(result_per_speaker_df[keys[0]].keys()) if keys else []
+
+        lengths = [len(result_per_speaker_df[key][rate_types[0]]) if rate_types else 0 for key in keys]
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+        os.makedirs(path, exist_ok=True)
+        values = np.lib.format.open_memmap(os.path.join(path, 'values.npy'), mode='w+', dtype=dtype,
+                                           shape=(len(rate_types), int(offsets[-1])))
+
+        # Fill the slices one key at a time, so only the store itself is ever fully in memory
+        for position, key in enumerate(keys):
+            for row, rate_type in enumerate(rate_types):
+                values[row, offsets[position]:offsets[position + 1]] = result_per_speaker_df[key][rate_type]
+
+        values.flush()
+        fingerprint = hashlib.sha256(json.dumps([keys, list(rate_types)]).encode('utf-8'))
+        for row in values:
+            fingerprint.update(row)
+        del values
+
+        index = {
+            'keys': keys,
+            'rate_types': list(rate_types),
+            'offsets': offsets.tolist(),
+            'fingerprint': fingerprint.hexdigest(),
+        }
+
+        with open(os.path.join(path, 'index.json'), 'w') as file:
+            file.write(json.dumps(index))
+
+        return cls(path)
+
+    def get_rates(self, key, rate_type):
+        """
+        Get the error rates of the speakers of a key.
+
+        :param key: 'model_group_style' key.
+        :param rate_type: The error rate.
+        :return: Read-only view on the error rates, without copying them.
+        """
+        position = self._positions[key]
+        return self.values[self.rate_types.index(rate_type), self.offsets[position]:self.offsets[position + 1]]
+
+    def get_fingerprint(self):
+        return self.fingerprint
+
+    def __getitem__(self, key):
+        if key not in self._positions:
+            raise KeyError(key)
+        return {rate_type: self.get_rates(key, rate_type) for rate_type in self.rate_types}
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getstate__(self):
+        # Pickle the location only, so worker processes map the same file instead of receiving a copy
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+def speaker_statistics(result_per_speaker_df, rate_type):
+    """
+    Calculate the median, standard deviation, maximum and minimum error rate of the speakers of every key.
+
+    :param result_per_speaker_df: SpeakerStore, or the error rates per speaker as collected by read_data.
+    :param rate_type: The error rate.
+    :return: Dictionary with 'model_group_style' keys and {'median', 'std', 'max', 'min'} dictionaries as values.
+        The standard deviation is the sample standard deviation; NaN for keys with fewer than two speakers.
+    """
+    statistics = {}
+
+    for key, value in result_per_speaker_df.items():
+        rates = np.asarray(value[rate_type], dtype=np.float64)
+        if len(rates) == 0:
+            continue
+
+        statistics[key] = {
+            'median': float(np.median(rates)),
+            'std': float(np.std(rates, ddof=1)) if len(rates) > 1 else float('nan'),
+            'max': float(np.max(rates)),
+            'min': float(np.min(rates)),
+        }
+
+    return statistics
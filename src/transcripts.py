@@ -0,0 +1,169 @@
+import csv
+import json
+
+import pandas as pd
+
+# Default names of the fields of a transcript record
+TRANSCRIPT_FIELDS = {'speaker': 'speaker', 'group': 'group', 'reference': 'reference', 'hypothesis': 'hypothesis'}
+
+
+def read_transcripts(path, fields=None):
+    """
+    Lazily read utterance-level transcripts from a JSONL or TSV file, one record at a time.
+
+    JSONL files contain one JSON object per line, TSV files have a header row. Both need a speaker, reference and
+    hypothesis field; the group field is optional.
+
+    :param path: Path to a .jsonl or .tsv file.
+    :param fields: Mapping from 'speaker', 'group', 'reference' and 'hypothesis' to the field names in the file.
+    :return: Generator of (group, speaker, reference, hypothesis) tuples, with group None if not present.
+    """
+    fields = {**TRANSCRIPT_FIELDS, **(fields or {})}
+
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        if path.endswith('.tsv'):
+            records = csv.DictReader(file, delimiter='\t', quoting=csv.QUOTE_NONE)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+
+        for record in records:
+            yield (record.get(fields['group']), record[fields['speaker']], record[fields['reference']],
+                   record[fields['hypothesis']])
+
+
+def align(reference, hypothesis):
+    """
+    Align a hypothesis to a reference with a minimum edit distance alignment.
+
+    Common prefixes and suffixes are matched directly; only the remaining middle part is aligned with dynamic
+    programming, keeping a single row of the cost matrix in memory.
+
+    :param reference: Sequence of reference tokens.
+    :param hypothesis: Sequence of hypothesis tokens.
+    :return: Tuple of (substitutions, insertions, deletions, hits).
+    """
+    start = 0
+    shortest = min(len(reference), len(hypothesis))
+    while start < shortest and reference[start] == hypothesis[start]:
+        start += 1
+
+    end = 0
+    while end < shortest - start and reference[-1 - end] == hypothesis[-1 - end]:
+        end += 1
+
+    reference = reference[start:len(reference) - end]
+    hypothesis = hypothesis[start:len(hypothesis) - end]
+    hits = start + end
+
+    if not reference:
+        return 0, len(hypothesis), 0, hits
+    if not hypothesis:
+        return 0, 0, len(reference), hits
+
+    # Each cell holds (errors, substitutions, insertions, deletions), compared in that order
+    previous = [(j, 0, j, 0) for j in range(len(hypothesis) + 1)]
+
+    for i, reference_token in enumerate(reference, 1):
+        current = [(i, 0, 0, i)]
+
+        for j, hypothesis_token in enumerate(hypothesis, 1):
+            errors, substitutions, insertions, deletions = previous[j - 1]
+            if reference_token == hypothesis_token:
+                best = previous[j - 1]
+            else:
+                best = (errors + 1, substitutions + 1, insertions, deletions)
+
+            errors, substitutions, insertions, deletions = previous[j]
+            deletion = (errors + 1, substitutions, insertions, deletions + 1)
+            if deletion < best:
+                best = deletion
+
+            errors, substitutions, insertions, deletions = current[j - 1]
+            insertion = (errors + 1, substitutions, insertions + 1, deletions)
+            if insertion < best:
+                best = insertion
+
+            current.append(best)
+
+        previous = current
+
+    _, substitutions, insertions, deletions = previous[-1]
+    return substitutions, insertions, deletions, hits + len(reference) - substitutions - deletions
+
+
+def tokenize(text, unit='word'):
+    """
+    Split a transcript into tokens.
+
+    :param text: The transcript.
+    :param unit: 'word' to split on whitespace, 'char' to split into characters, ignoring whitespace.
+    :return: List of tokens.
+    """
+    if unit == 'word':
+        return text.split()
+    elif unit == 'char':
+        return [character for character in text if not character.isspace()]
+    else:
+        raise ValueError("Invalid unit. Use 'word' or 'char'.")
+
+
+def accumulate_counts(transcripts, unit='word', default_group=None):
+    """
+    Align every transcript and accumulate the counts per speaker.
+
+    Only one counter per speaker is kept in memory, regardless of the number of utterances.
+
+    :param transcripts: Iterable of (group, speaker, reference, hypothesis) tuples, e.g. from read_transcripts.
+    :param unit: Token unit, see tokenize.
+    :param default_group: Group of records without a group.
+    :return: Dictionary with (group, speaker) tuples as keys and [Sub, Ins, Del, Corr, # Wrd] lists as values, in
+        order of first occurrence.
+    """
+    counts = {}
+
+    for group, speaker, reference, hypothesis in transcripts:
+        reference = tokenize(reference, unit)
+        substitutions, insertions, deletions, hits = align(reference, tokenize(hypothesis, unit))
+
+        speaker_counts = counts.setdefault((group if group is not None else default_group, speaker), [0, 0, 0, 0, 0])
+        speaker_counts[0] += substitutions
+        speaker_counts[1] += insertions
+        speaker_counts[2] += deletions
+        speaker_counts[3] += hits
+        speaker_counts[4] += len(reference)
+
+    return counts
+
+
+def counts_to_frames(counts, columns=None):
+    """
+    Convert accumulated counts to per-group DataFrames in the format of the per-speaker output files.
+
+    :param counts: Result of accumulate_counts.
+    :param columns: Names of the count columns. Defaults to 'Sub', 'Ins', 'Del', 'Corr' and '# Wrd'.
+    :return: Dictionary with groups as keys and DataFrames with a 'SPKR' column and the count columns as values.
+    """
+    rows = {}
+    for (group, speaker), speaker_counts in counts.items():
+        rows.setdefault(group, []).append([speaker] + speaker_counts)
+
+    return {group: pd.DataFrame(group_rows, columns=['SPKR'] + list(columns or ['Sub', 'Ins', 'Del', 'Corr', '# Wrd']))
+            for group, group_rows in rows.items()}
+
+
+def stream_error_rates(path, process, unit='word', default_group=None, fields=None):
+    """
+    Stream a transcript file and calculate the error rates of every group in it.
+
+    :param path: Path to a .jsonl or .tsv transcript file.
+    :param process: Function processing a (group, DataFrame) tuple, e.g. process_wer.
+    :param unit: Token unit, see tokenize.
+    :param default_group: Group of records without a group.
+    :param fields: Field names, see read_transcripts.
+    :return: Generator of (group, result per speaker, result per group) tuples.
+    """
+    counts = accumulate_counts(read_transcripts(path, fields), unit, default_group)
+
+    for group, frame in counts_to_frames(counts).items():
+        result_per_speaker_df, result_per_group_df = process((group, frame))
+        yield group, result_per_speaker_df, result_per_group_df
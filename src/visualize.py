@@ -3,29 +3,31 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 
-from .bias_calculation import calculate_total_intergroup_weighted_performance_bias, \
-    calculate_total_weighted_performance_bias
+from .bias_calculation import sweep_weights
+from .filepath_manager import split_key
+from .performance_records import as_performance_records
+from .speaker_store import speaker_statistics
 
 
-def plot_statistics_per_error_rate(data):
-    # Convert the JSON data into a pandas DataFrame
-    rows = []
-    for key, value in data.items():
-        model, group, speaking_style = key.split('_')
-        for rate_type in ['WER']:
-            rows.append([model, group, speaking_style, rate_type, value[rate_type]])
+def plot_statistics_per_error_rate(data, rate_types=None, fpm=None):
+    # All error rates of the data by default
+    if rate_types is None:
+        rate_types = data.rate_types if hasattr(data, 'rate_types') else list(next(iter(data.values()), {}))
 
-    df = pd.DataFrame(rows, columns=['Model', 'Group', 'SpeakingStyle', 'RateType', 'Rates'])
+    # Compute statistics for each combination of Model, Group, SpeakingStyle, and RateType on the per-speaker arrays
+    rows = []
+    for rate_type in rate_types:
+        for key, key_statistics in speaker_statistics(data, rate_type).items():
+            model, group, speaking_style = fpm.split_key(key) if fpm is not None else split_key(key)
+            rows.append({'Model': model, 'Group': group, 'SpeakingStyle': speaking_style, 'RateType': rate_type,
+                         **key_statistics})
 
-    # Compute statistics for each combination of Model, Group, SpeakingStyle, and RateType
-    stats = df.explode('Rates').groupby(['Model', 'Group', 'SpeakingStyle', 'RateType'])['Rates'].agg(
-        ['median', 'std', 'max', 'min']).reset_index()
+    stats = pd.DataFrame(rows, columns=['Model', 'Group', 'SpeakingStyle', 'RateType', 'median', 'std', 'max', 'min'])
 
     # Plotting
     metrics = ['median', 'std', 'max', 'min']
-    rate_types = ['WER']
-    groups = df['Group'].unique()
-    models = df['Model'].unique()
+    groups = stats['Group'].unique()
+    models = stats['Model'].unique()
 
     # Colorblind-friendly palette
     colors = sns.color_palette("colorblind", n_colors=len(groups))
@@ -68,21 +70,17 @@ def plot_statistics_per_error_rate(data):
 # TODO: output different every time
 # TODO: absolute seems smaller than relative?
 def plot_performance_difference(performance_differences_abs, performance_differences_rel):
-    # Convert the nested dictionaries into a DataFrame for easier plotting
+    # Convert the records into a DataFrame for easier plotting
     def convert_to_dataframe(performance_differences):
-        records = []
-        for model, groups in performance_differences.items():
-            for group, diffs in groups.items():
-                for diff in diffs:
-                    records.append({
-                        'Model': model,
-                        'Group': group,
-                        'SpeakingStyle': diff['SpeakingStyle'],
-                        'PerformanceDiff': diff['PerformanceDiff'],
-                        'RateType': diff['RateType'],
-                        'BaselineType': diff['BaselineType'],
-                    })
-        return pd.DataFrame(records)
+        records = as_performance_records(performance_differences)
+        return pd.DataFrame({
+            'Model': np.array(records.models, dtype=object)[records.model_index],
+            'Group': np.array(records.groups, dtype=object)[records.group_index],
+            'SpeakingStyle': np.array(records.speaking_styles, dtype=object)[records.style_index],
+            'PerformanceDiff': records.performance_diff,
+            'RateType': np.array(records.rate_types, dtype=object)[records.rate_index],
+            'BaselineType': np.array(records.baseline_types, dtype=object)[records.baseline_index],
+        })
 
     df_abs = convert_to_dataframe(performance_differences_abs)
     df_rel = convert_to_dataframe(performance_differences_rel)
@@ -95,19 +93,13 @@ def plot_performance_difference(performance_differences_abs, performance_differe
     df_abs['ModelSpeakingStyle'] = df_abs['Model'] + '-' + df_abs['BaselineType']
     df_rel['ModelSpeakingStyle'] = df_rel['Model'] + '-' + df_rel['BaselineType']
 
-    # Define the color palette to ensure similar colors for same models
-    palette = {
-        'NoAug-min': 'skyblue',
-        'NoAug-norm': 'deepskyblue',
-        'SpAug-min': 'lightcoral',
-        'SpAug-norm': 'indianred',
-        'SpSpecAug-min': 'lightgreen',
-        'SpSpecAug-norm': 'seagreen',
-        'FT-Wpr-min': 'lightgreen',
-        'FT-Wpr-norm': 'seagreen',
-        'Whisper-min': 'lightgreen',
-        'Whisper-norm': 'seagreen'
-    }
+    # Define the color palette to ensure similar colors for same models, lighter for the min baseline
+    models = list(dict.fromkeys(df_abs['Model']))
+    colors = sns.color_palette("colorblind", n_colors=len(models))
+    palette = {}
+    for model, color in zip(models, colors):
+        palette[f'{model}-min'] = tuple(0.5 + 0.5 * channel for channel in color)
+        palette[f'{model}-norm'] = color
 
     # Create the subplots
     fig, axes = plt.subplots(2, 1, figsize=(18, 12), sharex=True)
@@ -141,24 +133,25 @@ def plot_performance_difference(performance_differences_abs, performance_differe
     plt.close()
 
 
-def plot_wpb(wpb_values, fpm, w1):
+def plot_wpb(wpb_values, fpm, w1, rate_type=None):
     x = np.arange(len(fpm.speaker_groups))
-    width = 0.15
+    # Fit the bars of all models within 0.75 of the space of each group
+    width = min(0.15, 0.75 / len(fpm.asr_models))
 
     # Colorblind-friendly palette
     colors = sns.color_palette("colorblind", n_colors=len(fpm.asr_models))
 
     fig, ax = plt.subplots()
-    rects1 = ax.bar(x - 2 * width, list(wpb_values['NoAug'].values()), width, label='NoAug', color=colors[0])
-    rects2 = ax.bar(x - width, list(wpb_values['SpSpecAug'].values()), width, label='SpSpecAug', color=colors[1])
-    rects3 = ax.bar(x, list(wpb_values['SpAug'].values()), width, label='SpAug', color=colors[2])
-    rects4 = ax.bar(x + width, list(wpb_values['FT-Wpr'].values()), width, label='FT-Wpr', color=colors[3])
-    rects5 = ax.bar(x + 2 * width, list(wpb_values['Whisper'].values()), width, label='Whisper', color=colors[4])
+    for index, model in enumerate(fpm.asr_models):
+        offset = (index - (len(fpm.asr_models) - 1) / 2) * width
+        values = [wpb_values.get(model, {}).get(group, np.nan) for group in fpm.speaker_groups]
+        ax.bar(x + offset, values, width, label=model, color=colors[index])
 
     # Add some text for labels, title and custom x-axis tick labels
     ax.set_ylim(0, 1)
     ax.set_ylabel('WPB Values')
-    ax.set_title(f'WPB by Model and Group - w1: {w1}, w2: {1 - w1}')
+    metric = 'WPB' if rate_type is None else f'WPB ({rate_type})'
+    ax.set_title(f'{metric} by Model and Group - w1: {w1}, w2: {1 - w1}')
     ax.set_xticks(x)
     ax.set_xticklabels(fpm.speaker_groups)
     ax.legend()
@@ -168,28 +161,29 @@ def plot_wpb(wpb_values, fpm, w1):
     plt.tight_layout()
 
     # Save the figure
-    plt.savefig('plots/wpb.png')
+    plt.savefig(f'plots/wpb-{rate_type}.png' if rate_type is not None else 'plots/wpb.png')
     plt.close()
 
 
-def plot_iwpb(iwpb_values, fpm, w1):
+def plot_iwpb(iwpb_values, fpm, w1, rate_type=None):
     x = np.arange(len(fpm.speaker_groups))
-    width = 0.15
+    # Fit the bars of all models within 0.75 of the space of each group
+    width = min(0.15, 0.75 / len(fpm.asr_models))
 
     # Colorblind-friendly palette
     colors = sns.color_palette("colorblind", n_colors=len(fpm.asr_models))
 
     fig, ax = plt.subplots()
-    rects1 = ax.bar(x - 2 * width, list(iwpb_values['NoAug'].values()), width, label='NoAug', color=colors[0])
-    rects2 = ax.bar(x - width, list(iwpb_values['SpSpecAug'].values()), width, label='SpSpecAug', color=colors[1])
-    rects3 = ax.bar(x, list(iwpb_values['SpAug'].values()), width, label='SpAug', color=colors[2])
-    rects4 = ax.bar(x + width, list(iwpb_values['FT-Wpr'].values()), width, label='FT-Wpr', color=colors[3])
-    rects5 = ax.bar(x + 2 * width, list(iwpb_values['Whisper'].values()), width, label='Whisper', color=colors[4])
+    for index, model in enumerate(fpm.asr_models):
+        offset = (index - (len(fpm.asr_models) - 1) / 2) * width
+        values = [iwpb_values.get(model, {}).get(group, np.nan) for group in fpm.speaker_groups]
+        ax.bar(x + offset, values, width, label=model, color=colors[index])
 
     # Add some text for labels, title and custom x-axis tick labels
     ax.set_ylim(0, 1)
     ax.set_ylabel('IWPB Values')
-    ax.set_title(f'IWPB by Model and Group - w1: {w1}, w2: {1 - w1}')
+    metric = 'IWPB' if rate_type is None else f'IWPB ({rate_type})'
+    ax.set_title(f'{metric} by Model and Group - w1: {w1}, w2: {1 - w1}')
     ax.set_xticks(x)
     ax.set_xticklabels(fpm.speaker_groups)
     ax.legend()
@@ -199,7 +193,7 @@ def plot_iwpb(iwpb_values, fpm, w1):
     plt.tight_layout()
 
     # Save the figure
-    plt.savefig('plots/iwpb.png')
+    plt.savefig(f'plots/iwpb-{rate_type}.png' if rate_type is not None else 'plots/iwpb.png')
     plt.close()
 
 def plot_wpb_simulation(df, weight_range=100):
@@ -214,14 +208,9 @@ def plot_wpb_simulation(df, weight_range=100):
     """
 
     w1_values = np.linspace(0, 1, weight_range)
-    w2_values = 1 - w1_values
-    wpb_results = {model: [] for model in df.keys()}
-    best_w1_values = {model: None for model in df.keys()}
-
-    for w1, w2 in zip(w1_values, w2_values):
-        wpb = calculate_total_weighted_performance_bias(df, w1, w2)
-        for model in df.keys():
-            wpb_results[model].append(wpb[model])
+    models, wpb = sweep_weights(df, w1_values, metric='wpb')
+    wpb_results = {model: wpb[:, index] for index, model in enumerate(models)}
+    best_w1_values = {model: None for model in models}
 
     plt.figure(figsize=(10, 6))
 
@@ -242,7 +231,7 @@ def plot_wpb_simulation(df, weight_range=100):
     return sum(best_w1_values.values()) / len(best_w1_values)
 
 
-def plot_iwpb_simulation(df, weight_range=100):
+def plot_iwpb_simulation(df, weight_range=100, speaking_style=None, rate_type=None):
     """
     Plot the Intergroup Weighted Performance Bias (IWPB) simulation for different weights.
     Return the w1 value for which the IWPB value was the best (minimum) for each model.
@@ -250,18 +239,15 @@ def plot_iwpb_simulation(df, weight_range=100):
     :param df: DataFrame containing performance data.
     :param bp: Baseline performance value.
     :param weight_range: Number of weight values to simulate.
+    :param speaking_style: Speaking style of the IWPB, see get_bias_components.
+    :param rate_type: Error rate of the IWPB, see get_bias_components.
     :return: Dictionary with model names as keys and the best (minimum) w1 value as values.
     """
 
     w1_values = np.linspace(0, 1, weight_range)
-    w2_values = 1 - w1_values
-    iwpb_results = {model: [] for model in df.keys()}
-    best_w1_values = {model: None for model in df.keys()}
-
-    for w1, w2 in zip(w1_values, w2_values):
-        iwpb = calculate_total_intergroup_weighted_performance_bias(df, w1, w2)
-        for model in df.keys():
-            iwpb_results[model].append(iwpb[model])
+    models, iwpb = sweep_weights(df, w1_values, metric='iwpb', speaking_style=speaking_style, rate_type=rate_type)
+    iwpb_results = {model: iwpb[:, index] for index, model in enumerate(models)}
+    best_w1_values = {model: None for model in models}
 
     plt.figure(figsize=(10, 6))
 
@@ -282,24 +268,19 @@ def plot_iwpb_simulation(df, weight_range=100):
     return np.mean(list(best_w1_values.values()))
 
 
-def plot_iwpb_heatmap(df, weight_range=100):
+def plot_iwpb_heatmap(df, weight_range=100, speaking_style=None, rate_type=None):
     """
     Plot a heatmap of the Intergroup Weighted Performance Bias (IWPB) for different weights.
 
     :param df: Dataframe containing the performance difference data.
     :param bp: Baseline performance value.
     :param weight_range: Number of weight values to simulate. Default is 20.
+    :param speaking_style: Speaking style of the IWPB, see get_bias_components.
+    :param rate_type: Error rate of the IWPB, see get_bias_components.
     """
     w1_values = np.linspace(0, 1, weight_range)
-    w2_values = 1 - w1_values
-    models = list(df.keys())
-
-    heatmap_data = np.zeros((weight_range, len(models)))
-
-    for idx, (w1, w2) in enumerate(zip(w1_values, w2_values)):
-        iwpb = calculate_total_intergroup_weighted_performance_bias(df, w1, w2)
-        for model_idx, model in enumerate(models):
-            heatmap_data[idx, model_idx] = iwpb[model]
+    models, heatmap_data = sweep_weights(df, w1_values, metric='iwpb', speaking_style=speaking_style,
+                                         rate_type=rate_type)
 
     plt.figure(figsize=(12, 8))
     sns.heatmap(heatmap_data, xticklabels=models, yticklabels=np.round(w1_values, 2), cmap='coolwarm', annot=True)
@@ -0,0 +1,266 @@
+import warnings
+
+import numpy as np
+
+from .bias_engine import BASELINE_AXIS
+from .memo_cache import memoize
+from .performance_records import as_performance_records
+
+OBJECTIVES = ['mean', 'minimax', 'ranking']
+SCOPES = ['global', 'model', 'style']
+
+# Name of the single fit of the global scope
+GLOBAL_FIT = 'all'
+
+
+@memoize
+def get_weight_components(df, metric='iwpb', per_rate=False):
+    """
+    Split the WPB or IWPB of every model and speaking style into weight-independent components, one per weight term.
+
+    Both metrics are linear in the weights, so the bias for a weight vector w is sum_k w_k * components[k]. With two
+    terms these are the performance difference (w1) and base performance (w2) components, averaged over the rate
+    types. With per_rate, every rate type gets its own performance difference and base performance term; weights of
+    1 / (2 * number of rate types) each then give the same bias as w1 = w2 = 0.5.
+
+    :param df: PerformanceRecords, or the performance difference dictionary.
+    :param metric: Either 'wpb' or 'iwpb'.
+    :param per_rate: Whether every rate type gets its own weight terms.
+    :return: Tuple of (terms, models, speaking_styles, components), with components an array of shape
+        (term, model, speaking style), averaged over the groups and NaN for missing combinations.
+    """
+    tensor = as_performance_records(df).to_tensor()
+
+    if metric == 'wpb':
+        performance_component, base_component = tensor.weighted_performance_components(axis=BASELINE_AXIS)
+    elif metric == 'iwpb':
+        performance_component, base_component = tensor.intergroup_weighted_performance_components(
+            style_index=slice(None), rate_index=slice(None))
+    else:
+        raise ValueError("Invalid metric. Use 'wpb' or 'iwpb'.")
+
+    with warnings.catch_warnings():
+        # Models without any group in a speaking style result in NaN
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        # Average over the groups, giving arrays of shape (model, style, rate)
+        performance_component = np.nanmean(performance_component, axis=1)
+        base_component = np.nanmean(base_component, axis=1)
+
+        if per_rate:
+            terms = [f'{component}_{rate_type}' for rate_type in tensor.rate_types
+                     for component in ('performance', 'base')]
+            components = np.stack([performance_component, base_component], axis=-1)
+            components = np.moveaxis(components.reshape(components.shape[:2] + (-1,)), -1, 0)
+        else:
+            terms = ['performance', 'base']
+            components = np.stack([np.nanmean(performance_component, axis=-1), np.nanmean(base_component, axis=-1)])
+
+    return terms, tensor.models, tensor.speaking_styles, components
+
+
+def evaluate_weights(components, weights):
+    """
+    Evaluate a bias metric for many weight vectors at once.
+
+    :param components: Array of shape (term, ...) from get_weight_components.
+    :param weights: Array of shape (candidate, term).
+    :return: Array of shape (candidate, ...) with the bias of every weight vector.
+    """
+    return np.tensordot(np.asarray(weights, dtype=float), components, axes=(1, 0))
+
+
+def optimise_weights(df, metric='iwpb', objective='mean', scope='global', per_rate=False, bounds=None,
+                     target_ranking=None, n_candidates=256, n_iterations=100, seed=0):
+    """
+    Fit the weights of the WPB or IWPB under an objective, globally, per model or per speaking style.
+
+    The weights are non-negative and sum to 1, as w2 = 1 - w1 for two terms. The 'mean' objective is linear in the
+    weights and is solved in closed form. Other objectives are minimised with a gradient-free search, which
+    evaluates a batch of candidate weight vectors at once and narrows the search around the best one.
+
+    :param df: PerformanceRecords, or the performance difference dictionary.
+    :param metric: Either 'wpb' or 'iwpb'.
+    :param objective: 'mean' minimises the mean bias and 'minimax' the largest bias, over the models and speaking
+        styles of a fit. 'ranking' minimises the number of model pairs that are ordered differently than in
+        target_ranking, breaking ties by the mean bias. A function can also be given, which is called with an
+        array of shape (candidate, model, speaking style) holding the bias of every candidate of a fit, NaN for
+        missing combinations, and returns an array of shape (candidate,) to minimise.
+    :param scope: 'global' fits one weight vector to all models and speaking styles, 'model' one per model and
+        'style' one per speaking style.
+    :param per_rate: Whether every rate type gets its own weight terms, see get_weight_components.
+    :param bounds: Optional dictionary with terms as keys and (lower, upper) bounds of their weights as values.
+    :param target_ranking: Model names, from least to most biased. Required for the 'ranking' objective.
+    :param n_candidates: Number of candidates evaluated per iteration of the search.
+    :param n_iterations: Number of iterations of the search.
+    :param seed: Seed of the search.
+    :return: Dictionary with the terms, the weights of every fit as {fit: {term: weight}} and the objective value
+        of every fit. The fits are the models, the speaking styles or GLOBAL_FIT, depending on the scope. Fits
+        without any results are left out.
+    """
+    terms, models, speaking_styles, components = get_weight_components(df, metric, per_rate)
+    lower, upper = _get_bounds(terms, bounds or {})
+
+    if scope == 'global':
+        fits = {GLOBAL_FIT: components}
+    elif scope == 'model':
+        fits = {model: components[:, index:index + 1, :] for index, model in enumerate(models)}
+    elif scope == 'style':
+        fits = {style: components[:, :, index:index + 1] for index, style in enumerate(speaking_styles)}
+    else:
+        raise ValueError(f"Invalid scope. Use one of {', '.join(SCOPES)}.")
+
+    if objective == 'ranking':
+        if target_ranking is None:
+            raise ValueError("The 'ranking' objective requires a target_ranking.")
+        if scope == 'model':
+            raise ValueError("The 'ranking' objective ranks models, so it cannot be fit per model.")
+        unknown = [model for model in target_ranking if model not in models]
+        if unknown:
+            raise ValueError(f"Invalid target_ranking, there are no results for {', '.join(unknown)}. "
+                             f"Use any of {', '.join(models)}.")
+        objective = ranking_objective([models.index(model) for model in target_ranking])
+
+    rng = np.random.default_rng(seed)
+    weights, values = {}, {}
+
+    for fit, fit_components in fits.items():
+        if np.all(np.isnan(fit_components)):
+            # A model or speaking style without any results has nothing to fit
+            continue
+
+        if objective == 'mean':
+            # The mean bias is linear in the weights, so its minimum is at a vertex of the feasible region
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                coefficients = np.nanmean(fit_components.reshape(len(terms), -1), axis=1)
+            best = _minimise_linear(coefficients, lower, upper)
+            value = float(np.dot(best, coefficients))
+        else:
+            function = OBJECTIVE_FUNCTIONS[objective] if isinstance(objective, str) else objective
+            best, value = _search(lambda candidates: function(evaluate_weights(fit_components, candidates)),
+                                  lower, upper, n_candidates, n_iterations, rng)
+
+        weights[fit] = {term: float(weight) for term, weight in zip(terms, best)}
+        values[fit] = value
+
+    return {'terms': terms, 'weights': weights, 'objective': values}
+
+
+def mean_objective(bias):
+    """
+    :param bias: Array of shape (candidate, model, speaking style).
+    :return: Mean bias of every candidate.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmean(bias.reshape(len(bias), -1), axis=1)
+
+
+def minimax_objective(bias):
+    """
+    :param bias: Array of shape (candidate, model, speaking style).
+    :return: Largest bias of every candidate.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmax(bias.reshape(len(bias), -1), axis=1)
+
+
+def ranking_objective(target_ranking):
+    """
+    Create an objective counting the model pairs that are ranked differently than in the target ranking.
+
+    :param target_ranking: Model indices, from least to most biased. Models that are not listed are not ranked.
+    :return: Function mapping an array of shape (candidate, model, speaking style) to the number of discordant
+        pairs of every candidate, plus a tie-breaker below 1 that increases with the mean bias.
+    """
+    target_ranking = np.asarray(target_ranking)
+
+    def objective(bias):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            # Rank the models by their bias averaged over the speaking styles
+            model_bias = np.nanmean(bias, axis=2)[:, target_ranking]
+        # Pairs (i, j) with i ranked as less biased than j, but having a larger bias
+        discordant = np.triu(model_bias[:, :, np.newaxis] > model_bias[:, np.newaxis, :], k=1).sum(axis=(1, 2))
+        return discordant + 0.5 * np.tanh(mean_objective(bias))
+
+    return objective
+
+
+OBJECTIVE_FUNCTIONS = {'mean': mean_objective, 'minimax': minimax_objective}
+
+
+def project_to_simplex(weights, lower, upper, n_steps=60):
+    """
+    Project weight vectors onto the set of weights between lower and upper that sum to 1.
+
+    The projection of v is clip(v - tau, lower, upper) for the tau at which it sums to 1, found by bisection for all
+    vectors at once.
+
+    :param weights: Array of shape (candidate, term).
+    :param lower: Lower bounds of the weights, of shape (term,).
+    :param upper: Upper bounds of the weights, of shape (term,).
+    :param n_steps: Number of bisection steps.
+    :return: Array of shape (candidate, term) with the projected weights.
+    """
+    weights = np.asarray(weights, dtype=float)
+    low = np.min(weights - upper, axis=1, keepdims=True)
+    high = np.max(weights - lower, axis=1, keepdims=True)
+
+    for _ in range(n_steps):
+        tau = (low + high) / 2
+        too_large = np.clip(weights - tau, lower, upper).sum(axis=1, keepdims=True) > 1
+        low = np.where(too_large, tau, low)
+        high = np.where(too_large, high, tau)
+
+    return np.clip(weights - (low + high) / 2, lower, upper)
+
+
+def _get_bounds(terms, bounds):
+    unknown = set(bounds) - set(terms)
+    if unknown:
+        raise ValueError(f"Invalid bounds for {', '.join(sorted(unknown))}. Use one of {', '.join(terms)}.")
+
+    lower = np.array([bounds.get(term, (0, 1))[0] for term in terms], dtype=float)
+    upper = np.array([bounds.get(term, (0, 1))[1] for term in terms], dtype=float)
+    if np.any(lower < 0) or np.any(lower > upper) or lower.sum() > 1 or upper.sum() < 1:
+        raise ValueError("Invalid bounds. The weights are non-negative and have to be able to sum to 1.")
+
+    return lower, upper
+
+
+def _minimise_linear(coefficients, lower, upper):
+    # Start from the lower bounds and give the remaining weight to the terms with the smallest coefficients first
+    weights = lower.copy()
+    remaining = 1 - lower.sum()
+    for term in np.argsort(np.nan_to_num(coefficients, nan=np.inf), kind='stable'):
+        weights[term] += min(upper[term] - lower[term], remaining)
+        remaining = 1 - weights.sum()
+    return weights
+
+
+def _search(objective, lower, upper, n_candidates, n_iterations, rng):
+    # Start from the vertices, the centre and random points of the feasible region
+    n_terms = len(lower)
+    candidates = project_to_simplex(np.vstack([np.eye(n_terms), np.full((1, n_terms), 1 / n_terms),
+                                               rng.dirichlet(np.ones(n_terms), n_candidates)]), lower, upper)
+    values = objective(candidates)
+    best_index = int(np.nanargmin(values))
+    best, best_value = candidates[best_index], values[best_index]
+    radius = 0.5
+
+    for _ in range(n_iterations):
+        # Sample around the best weights, narrowing the search when no better weights are found
+        candidates = project_to_simplex(best + radius * rng.standard_normal((n_candidates, n_terms)), lower, upper)
+        values = objective(candidates)
+        index = int(np.nanargmin(values))
+
+        if values[index] < best_value:
+            best, best_value = candidates[index], values[index]
+        else:
+            radius /= 2
+            if radius < 1e-9:
+                break
+
+    return best, float(best_value)
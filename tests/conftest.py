@@ -0,0 +1,30 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_corpus import generate_corpus
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """
+    Generate a small synthetic corpus in a temporary directory and run the test from it.
+
+    :return: Function updating the generated config.json with its keyword arguments.
+    """
+    config_path = generate_corpus(str(tmp_path), n_models=2, n_groups=3, n_speakers=60)
+    monkeypatch.chdir(tmp_path)
+
+    def configure(**options):
+        with open(config_path, 'r') as file:
+            config = json.load(file)
+        config.update({'results_format': 'json', **options})
+        with open(config_path, 'w') as file:
+            file.write(json.dumps(config, indent=4))
+
+    configure()
+    return configure
@@ -0,0 +1,86 @@
+import itertools
+import warnings
+
+import numpy as np
+import pytest
+
+from main import main
+from src.bias_engine import BASELINE_AXIS, PerformanceTensor
+from src.bias_monitor import BiasMonitor, _mean_absolute_differences
+from src.process import COUNT_COLUMNS, ERROR_RATES
+from src.results_writer import ResultsWriter
+
+MODELS = ['model0', 'model1']
+GROUPS = ['group0', 'group1', 'group2', 'group3']
+STYLES = ['style0']
+RATE_TYPES = ['WER', 'MER']
+
+
+def random_counts(rng):
+    words = int(rng.integers(5, 30))
+    substitutions, deletions = rng.integers(0, words // 3 + 1, size=2)
+    return [substitutions, rng.integers(0, 5), deletions, words - substitutions - deletions, words]
+
+
+def test_cumulative_window_equals_the_batch_bias():
+    rng = np.random.default_rng(0)
+    monitor = BiasMonitor(MODELS, GROUPS, STYLES, RATE_TYPES, wpb_w1=0.3, iwpb_w1=0.7)
+    counts = np.zeros((len(MODELS), len(GROUPS), len(STYLES), len(COUNT_COLUMNS)))
+
+    # group3 of model1 has no results
+    combinations = [combination for combination in itertools.product(range(2), range(4)) if combination != (1, 3)]
+    for index in rng.integers(0, len(combinations), size=200):
+        model, group = combinations[index]
+        update = random_counts(rng)
+        monitor.update(MODELS[model], GROUPS[group], STYLES[0], update, timestamp=float(index))
+        counts[model, group, 0] += update
+
+    with warnings.catch_warnings(), np.errstate(invalid='ignore'):
+        # The group without results has NaN error rates
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        rates = np.stack([ERROR_RATES[rate_type](*np.moveaxis(counts, -1, 0)) for rate_type in RATE_TYPES], axis=-1)
+        tensor = PerformanceTensor.from_rates(rates, MODELS, GROUPS, STYLES, RATE_TYPES)
+        wpb = np.nanmean(tensor.weighted_performance_terms(0.3, 0.7), axis=BASELINE_AXIS)
+
+    np.testing.assert_allclose(monitor.wpb, wpb)
+    np.testing.assert_allclose(monitor.iwpb, tensor.intergroup_weighted_performance_bias(0.7, 0.3)[0])
+    assert np.isnan(monitor.wpb[1, 3]).all()
+
+
+def test_mean_absolute_differences():
+    rates = np.array([[0.1, np.nan], [0.3, 0.2], [0.3, np.nan], [np.nan, np.nan]])
+    differences, count = _mean_absolute_differences(rates)
+
+    expected = np.array([[0.2, np.nan], [0.1, 0.0], [0.1, np.nan], [np.nan, np.nan]])
+    np.testing.assert_allclose(differences, expected)
+    np.testing.assert_array_equal(count, [[2, 0], [2, 0], [2, 0], [0, 0]])
+
+
+def test_sliding_window_of_historic_results():
+    monitor = BiasMonitor(MODELS, GROUPS, ['style0', 'style1'], ['WER'], window='sliding', window_size=10)
+    monitor.update('model0', 'group0', 'style0', [1, 0, 0, 9, 10], timestamp=1000)
+    monitor.update('model0', 'group1', 'style1', [2, 0, 0, 8, 10], timestamp=1005)
+    monitor.update('model0', 'group0', 'style1', [3, 0, 0, 7, 10], timestamp=1012)
+
+    # Advancing to the latest timestamp only removes the counts of style0, which are older than the window
+    monitor.advance()
+    assert monitor.latest == 1012
+    assert np.isnan(monitor.rates[0, 0, 0, 0])
+    assert monitor.rates[0, 1, 1, 0] == pytest.approx(0.2)
+    assert monitor.rates[0, 0, 1, 0] == pytest.approx(0.3)
+
+    monitor.advance(1016)
+    assert np.isnan(monitor.rates[0, 1, 1, 0])
+    assert monitor.rates[0, 0, 1, 0] == pytest.approx(0.3)
+
+
+def test_monitor_reports_historic_results(corpus, tmp_path):
+    events = tmp_path / 'results.jsonl'
+    events.write_text('\n'.join(
+        f'{{"model": "model0", "group": "group{group}", "speaking_style": "style0", "timestamp": {1000 + group}, '
+        f'"Sub": 1, "Ins": 0, "Del": 0, "Corr": {group + 4}, "# Wrd": {group + 5}}}' for group in range(3)))
+
+    main(['monitor', '--input', str(events), '--window', 'sliding', '--window-size', '60', '--report-every', '2'])
+
+    bias = ResultsWriter('json').read('results/bias/new/live_bias.json')
+    assert sorted(bias['wpb']['WER']['style0']['model0']) == ['group0', 'group1', 'group2']
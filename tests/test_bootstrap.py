@@ -0,0 +1,31 @@
+import numpy as np
+
+from main import ERROR_RATES_PER_GROUP_PATH, SPEAKER_STORE_PATH, _get_speaker_weights, main
+from src.bootstrap import resample_group_rates
+from src.filepath_manager import FilepathManager
+from src.results_writer import ResultsWriter
+from src.speaker_store import SpeakerStore
+
+
+def test_resamples_are_centred_on_the_group_error_rates(corpus):
+    main(['ingest'])
+    fpm = FilepathManager('config.json')
+    result_per_group_df = ResultsWriter('json').read(ERROR_RATES_PER_GROUP_PATH)
+    result_per_speaker_df = SpeakerStore(SPEAKER_STORE_PATH)
+
+    resampled = resample_group_rates(result_per_speaker_df, fpm, n_resamples=4000,
+                                     weights=_get_speaker_weights(result_per_speaker_df, fpm))
+    rates = np.array([[[result_per_group_df[f'{model}_{group}_{speaking_style}']['WER']
+                        for speaking_style in fpm.speaking_style_folders]
+                       for group in fpm.speaker_groups]
+                      for model in fpm.asr_models])
+
+    # Weighted by words, the resamples are centred on the error rates of the summed counts
+    assert np.abs(resampled.mean(axis=0) - rates).max() < 1e-3
+
+
+def test_speakers_are_weighted_equally_in_the_speaker_weighting(corpus):
+    corpus(bias_level='speaker', speaker_weighting='speakers')
+    main(['ingest'])
+
+    assert _get_speaker_weights(SpeakerStore(SPEAKER_STORE_PATH), FilepathManager('config.json')) is None
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from main import INTERGROUP_WEIGHTED_BIAS_PATH, OVERALL_INTERGROUP_WEIGHTED_BIAS_PATH, main
+from src.results_writer import ResultsWriter
+
+
+def test_statistical_tests_are_opt_in(corpus):
+    main(['ingest'])
+    main(['compute'])
+
+    assert not os.path.exists('results/bias/new/bias_confidence_intervals.json')
+    assert not os.path.exists('results/bias/new/pairwise_group_differences.json')
+
+
+def test_statistical_tests_run_when_configured(corpus):
+    corpus(bootstrap_resamples=20, permutations=50)
+    main(['ingest'])
+    main(['compute'])
+
+    assert os.path.exists('results/bias/new/bias_confidence_intervals.json')
+    assert os.path.exists('results/bias/new/pairwise_group_differences.json')
+
+
+def test_reported_slice_does_not_depend_on_the_configured_order(corpus):
+    tables = []
+    orders = ((['style0', 'style1'], ['WER', 'MER']), (['style1', 'style0'], ['MER', 'WER']))
+    for speaking_styles, error_rates in orders:
+        corpus(speaking_style_folders=speaking_styles, speaking_style_infixes=speaking_styles, error_rates=error_rates,
+               reported_speaking_style='style1', reported_error_rate='MER', memo_cache=False)
+        main(['ingest'])
+        main(['compute'])
+        tables.append([ResultsWriter('json').read(path) for path in (INTERGROUP_WEIGHTED_BIAS_PATH,
+                                                                     OVERALL_INTERGROUP_WEIGHTED_BIAS_PATH)])
+
+    assert tables[0] == tables[1]
+
+
+def test_invalid_reported_error_rate(corpus):
+    corpus(reported_error_rate='CER')
+
+    with pytest.raises(ValueError, match='reported_error_rate'):
+        main(['ingest'])
@@ -0,0 +1,22 @@
+import glob
+import os
+
+from main import ERROR_RATES_PER_GROUP_PATH, main
+from src.filepath_manager import FilepathManager
+from src.results_writer import ResultsWriter
+
+
+def test_output_files_with_speaking_style_infixes(corpus):
+    for path in glob.glob('data/style*/model*/group*.csv'):
+        speaking_style = path.split(os.sep)[1]
+        os.rename(path, path.replace('.csv', f'_{speaking_style.upper()}.csv'))
+    corpus(speaking_style_infixes='auto', path_templates={
+        'output_file': '{base_path}/{speaking_style_folder}/{asr_model}/{speaker_group}_{speaking_style_infix}.csv',
+        'error_rate_file': '{base_path}/{error_rate}.csv'})
+
+    fpm = FilepathManager('config.json')
+    assert fpm.speaking_style_infixes == ['STYLE0', 'STYLE1']
+    assert fpm.get_output_path('style1', 'STYLE1', 'group0', 'model0').endswith('style1/model0/group0_STYLE1.csv')
+
+    main(['ingest'])
+    assert 'model0_group0_style1' in ResultsWriter('json').read(ERROR_RATES_PER_GROUP_PATH)
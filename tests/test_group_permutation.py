@@ -0,0 +1,24 @@
+import numpy as np
+
+from src.filepath_manager import FilepathManager
+from src.group_permutation import pairwise_permutation_test
+
+
+def test_groups_are_compared_on_their_word_weighted_error_rates(corpus):
+    fpm = FilepathManager('config.json')
+    # The speaker without words has no error rate, and does not make the difference of group0 and group1 NaN
+    result_per_speaker_df = {
+        'model0_group0_style0': {'WER': np.array([0.1, 0.3, np.nan]), 'Words': np.array([30.0, 10.0, 0.0])},
+        'model0_group1_style0': {'WER': np.array([0.2, 0.2]), 'Words': np.array([5.0, 15.0])},
+        'model0_group2_style0': {'WER': np.array([0.15, 0.25, 0.2]), 'Words': np.array([10.0, 10.0, 10.0])},
+    }
+
+    records = pairwise_permutation_test(result_per_speaker_df, fpm, n_permutations=500, correction='none')
+
+    assert [(record['Group1'], record['Group2']) for record in records] == [
+        ('group0', 'group1'), ('group0', 'group2'), ('group1', 'group2')]
+    # Weighted by words, group0 has an error rate of 0.15 rather than the mean 0.2 of its speakers
+    np.testing.assert_allclose([record['Difference'] for record in records], [0.05, 0.05, 0.0], atol=1e-12)
+    # Differences of groups with the same error rate are not significant
+    assert records[2]['PValue'] == 1.0
+    assert all(record['PValue'] > 1 / 501 for record in records)
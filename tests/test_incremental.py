@@ -0,0 +1,29 @@
+import json
+import os
+
+from main import main
+
+BIAS_TABLES = ['weighted_performance_bias', 'overall_weighted_performance_bias', 'intergroup_weighted_performance_bias',
+               'overall_intergroup_weighted_performance_bias', 'bias_per_error_rate']
+
+
+def read_tables():
+    tables = {}
+    for table in BIAS_TABLES:
+        with open(f'results/bias/new/{table}.json', 'r') as file:
+            tables[table] = json.load(file)
+    return tables
+
+
+def test_cached_bias_tables_are_written_again(corpus):
+    corpus(incremental=True)
+    main(['ingest'])
+    main(['compute', '--outputs', 'bias'])
+    tables = read_tables()
+
+    for table in BIAS_TABLES:
+        os.remove(f'results/bias/new/{table}.json')
+
+    # The bias tables are taken from the incremental state, but still written
+    main(['compute', '--outputs', 'bias'])
+    assert read_tables() == tables
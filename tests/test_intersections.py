@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import INTERGROUP_WEIGHTED_BIAS_PATH, PERFORMANCE_DIFFERENCES_ABS_PATH, WEIGHTED_BIAS_PATH, main
+from src.intersections import GroupIndex
+from src.results_writer import ResultsWriter
+
+
+def make_metadata(n_speakers=60, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'speaker': [str(speaker) for speaker in range(n_speakers)],
+                         'gender': rng.choice(['female', 'male'], n_speakers),
+                         'age': rng.choice(['young', 'old', 'unknown'], n_speakers),
+                         'accent': rng.choice(['north', 'south'], n_speakers)}).set_index('speaker')
+
+
+def test_aggregate_and_members_equal_brute_force():
+    metadata = make_metadata()
+    group_index = GroupIndex(metadata, 'all')
+    speakers = [str(speaker) for speaker in np.random.default_rng(1).integers(0, 70, 200)]
+    counts = np.random.default_rng(2).integers(0, 50, (len(speakers), 5))
+    cells = group_index.get_cells(speakers)
+
+    aggregated = group_index.aggregate(counts, cells)
+    members = group_index.get_members(cells)
+
+    for position, (group, intersection) in enumerate(zip(group_index.groups, group_index.group_intersections)):
+        attributes = intersection.split('+')
+        expected = [index for index, speaker in enumerate(speakers) if speaker in metadata.index and
+                    '+'.join(metadata.loc[speaker, attributes]) == group]
+        assert members[position].tolist() == expected
+        assert np.array_equal(aggregated[position], counts[expected].sum(axis=0))
+
+
+def run_intersections(corpus, tmp_path, intersections):
+    make_metadata().to_csv(tmp_path / 'speakers.csv')
+    corpus(speaker_metadata=str(tmp_path / 'speakers.csv'), intersections=intersections, memo_cache=False,
+           permutations=20)
+    main(['ingest'])
+    main(['compute'])
+
+    writer = ResultsWriter('json')
+    return (writer.read(PERFORMANCE_DIFFERENCES_ABS_PATH), writer.read(WEIGHTED_BIAS_PATH),
+            writer.read(INTERGROUP_WEIGHTED_BIAS_PATH), writer.read('results/bias/new/pairwise_group_differences.json'))
+
+
+def test_intersections_are_compared_separately(corpus, tmp_path):
+    gender = run_intersections(corpus, tmp_path, [['gender']])
+    combined = run_intersections(corpus, tmp_path, [['gender'], ['gender', 'age']])
+
+    # Adding the overlapping gender+age groups does not change the baselines or bias of the gender groups
+    for model, groups in gender[0].items():
+        for group, records in groups.items():
+            assert [record['BaselinePerformance'] for record in combined[0][model][group]] == \
+                   pytest.approx([record['BaselinePerformance'] for record in records])
+            assert combined[1][model][group] == pytest.approx(gender[1][model][group])
+            assert combined[2][model][group] == pytest.approx(gender[2][model][group])
+
+    # Groups of different intersections are never tested against each other
+    assert all(('+' in record['Group1']) == ('+' in record['Group2']) for record in combined[3])
+    assert {(record['Group1'], record['Group2']) for record in combined[3]} >= \
+           {(record['Group1'], record['Group2']) for record in gender[3]}
@@ -0,0 +1,39 @@
+import numpy as np
+
+from src.memo_cache import MemoCache
+
+
+def test_results_of_another_code_version_are_not_returned(tmp_path):
+    memo_cache = MemoCache(str(tmp_path), version='a')
+    memo_cache.put(memo_cache.get_key('f', (1,)), 'result')
+
+    other_memo_cache = MemoCache(str(tmp_path), version='b')
+    assert other_memo_cache.get_key('f', (1,)) != memo_cache.get_key('f', (1,))
+    assert other_memo_cache.get(other_memo_cache.get_key('f', (1,))) == (False, None)
+    assert MemoCache(str(tmp_path), version='a').get(memo_cache.get_key('f', (1,))) == (True, 'result')
+
+
+def test_disk_size_is_counted_without_scanning_on_every_put(tmp_path, monkeypatch):
+    memo_cache = MemoCache(str(tmp_path), max_entries=0, max_bytes=20000)
+    scans = []
+    list_files = memo_cache._list_files
+    monkeypatch.setattr(memo_cache, '_list_files', lambda: scans.append(1) or list_files())
+
+    keys = [memo_cache.get_key('f', (index,)) for index in range(20)]
+    for key in keys:
+        memo_cache.put(key, np.zeros(200))
+
+    # Every result is about 1700 bytes, so the tier is scanned once at the start and on every overflow only
+    assert len(scans) < 10
+    files = list_files()
+    assert sum(size for _, size, _ in files) <= memo_cache.max_bytes
+    assert memo_cache._disk_bytes == sum(size for _, size, _ in files)
+    # The most recently stored result is kept
+    assert memo_cache.get(keys[-1])[0]
+
+
+def test_keys_of_different_types_are_distinguished():
+    memo_cache = MemoCache(version='a')
+
+    assert memo_cache.get_key('f', ({1: 'x'},)) != memo_cache.get_key('f', ({'1': 'x'},))
+    assert memo_cache.get_key('f', ({1: 'x', '1': 'y'},)) == memo_cache.get_key('f', ({'1': 'y', 1: 'x'},))
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from main import ERROR_RATES_PER_GROUP_PATH, SPEAKER_STORE_PATH, main
+from src.results_writer import ResultsWriter
+from src.speaker_store import SpeakerStore
+
+TRANSCRIPTS = [
+    {'speaker': 's0', 'group': 'group0', 'reference': 'hello world', 'hypothesis': 'hallo world'},
+    {'speaker': 's1', 'group': 'group0', 'reference': 'good morning', 'hypothesis': 'good morning'},
+    {'speaker': 's2', 'group': 'group1', 'reference': 'the cat sat', 'hypothesis': 'the hat sat down'},
+]
+
+
+def test_character_error_rate_needs_transcripts(corpus):
+    corpus(error_rates=['WER', 'CER'])
+
+    with pytest.raises(ValueError, match='CER'):
+        main(['ingest'])
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_invalid_ingestion_mode(corpus, max_workers):
+    corpus(ingestion_mode='fork', max_workers=max_workers)
+
+    with pytest.raises(ValueError, match='ingestion_mode'):
+        main(['ingest'])
+
+
+def test_character_error_rate_is_calculated_per_character(corpus, tmp_path):
+    with open(tmp_path / 'transcripts.jsonl', 'w') as file:
+        file.write('\n'.join(json.dumps(transcript) for transcript in TRANSCRIPTS))
+    corpus(error_rates=['WER', 'CER'], input_format='transcripts', asr_models=['model0'],
+           speaker_groups=['group0', 'group1'], speaking_style_folders=['style0'], speaking_style_infixes=['style0'],
+           path_templates={'transcript_file': str(tmp_path / 'transcripts.jsonl')})
+    main(['ingest'])
+
+    result_per_group_df = ResultsWriter('json').read(ERROR_RATES_PER_GROUP_PATH)
+    # One of 4 words and one of 21 characters is wrong, and 2 of 3 words and 5 of 9 characters
+    assert result_per_group_df['model0_group0_style0'] == pytest.approx({'WER': 1 / 4, 'CER': 1 / 21})
+    assert result_per_group_df['model0_group1_style0'] == pytest.approx({'WER': 2 / 3, 'CER': 5 / 9})
+
+    speakers = SpeakerStore(SPEAKER_STORE_PATH)['model0_group0_style0']
+    assert list(speakers['Words']) == [2, 2]
+    assert list(speakers['Characters']) == [10, 11]
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from src.results_writer import ResultsWriter, from_table, to_table
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.mark.parametrize('data', [
+    {'a': {}, 'b': {'x': 1.0}},
+    {'a': [], 'b': [1.0, 2.0]},
+    {'a': {'b': {}}, 'c': {'d': [{'k': 1, 'v': 2.0}]}},
+    {'a': [{}, {'k': 1}]},
+    {'m': [[0.1, 0.2], [0.3, 0.4]]},
+    [{'k': 1}, {'k': 2}],
+    {},
+    [],
+])
+def test_round_trip(data):
+    assert from_table(to_table(data)) == data
+
+
+def test_mixed_types_fall_back_to_json(tmp_path):
+    writer = ResultsWriter('parquet')
+    path = str(tmp_path / 'results.json')
+
+    writer.write(path, {'a': 1.0})
+    writer.write(path, {'a': 'text', 'b': 1.0})
+
+    # The parquet file of the first write is removed, so the JSON file is read
+    assert writer.read(path) == {'a': 'text', 'b': 1.0}
+    assert not os.path.exists(writer.get_path(path))
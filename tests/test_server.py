@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import json
+import shutil
+
+import pytest
+
+from src.filepath_manager import FilepathManager
+from src.server import BiasService, _DataPool, _handle_connection, evaluate_bias
+
+
+def request(service, pool, *raw_requests):
+    # Send raw HTTP requests to a server on a free port, and return the status and JSON body of every response
+    async def run():
+        handler = functools.partial(_handle_connection, service, pool, asyncio.Lock())
+        server = await asyncio.start_server(handler, '127.0.0.1', 0)
+        responses = []
+        async with server:
+            for raw_request in raw_requests:
+                reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+                writer.write(raw_request)
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+                head, _, body = response.partition(b'\r\n\r\n')
+                responses.append((int(head.split()[1]), json.loads(body)))
+        return responses
+
+    return asyncio.run(run())
+
+
+def post(path, parameters):
+    body = json.dumps(parameters).encode('utf-8')
+    return (f'POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1')
+            + body)
+
+
+@pytest.fixture
+def service(corpus):
+    return BiasService(FilepathManager('config.json'))
+
+
+def test_bias_is_evaluated_on_the_data_of_the_workers(service):
+    pool = _DataPool(service, max_workers=1)
+    try:
+        (status, payload), = request(service, pool, post('/bias', {'metric': 'wpb', 'w1': 0.3}))
+        executor = pool.get_executor()[0]
+        expected = evaluate_bias(service.tensor, metric='wpb', w1=0.3)
+
+        assert status == 200
+        assert payload['version'] == 1
+        assert payload['total'] == pytest.approx(expected['total'])
+
+        # The workers keep their data between queries, and receive the new data after a reload
+        request(service, pool, b'GET /bias?models=model0 HTTP/1.1\r\nConnection: close\r\n\r\n')
+        assert pool.get_executor()[0] is executor
+
+        (status, payload), = request(service, pool, post('/reload', {}))
+        assert (status, payload['version']) == (200, 2)
+        (status, payload), = request(service, pool, post('/bias', {'metric': 'iwpb'}))
+        assert (status, payload['version']) == (200, 2)
+        assert pool.get_executor()[0] is not executor
+    finally:
+        pool.shutdown()
+
+
+def test_malformed_requests(service):
+    pool = _DataPool(service, max_workers=1)
+    try:
+        responses = request(service, pool,
+                            b'POST /bias HTTP/1.1\r\nContent-Length: ten\r\n\r\n',
+                            b'POST /bias HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+                            post('/bias', {'w3': 1}),
+                            post('/bias', {'models': ['model9']}),
+                            post('/optimise', {'bounds': [0, 1]}),
+                            post('/optimise', {'bounds': {'performance': 0.5}}),
+                            b'GET /unknown HTTP/1.1\r\nConnection: close\r\n\r\n')
+    finally:
+        pool.shutdown()
+
+    assert [status for status, _ in responses] == [400, 400, 400, 400, 400, 400, 404]
+    assert 'Content-Length' in responses[0][1]['error']
+    assert 'model9' in responses[3][1]['error']
+
+
+def test_models_added_after_the_start(service):
+    pool = _DataPool(service, max_workers=1)
+    try:
+        for speaking_style in ('style0', 'style1'):
+            shutil.copytree(f'data/{speaking_style}/model1', f'data/{speaking_style}/model9')
+
+        (status, payload), = request(service, pool, post('/models', {'models': ['model9', 'model10']}))
+        assert status == 400 and 'model10' in payload['error']
+
+        (status, payload), = request(service, pool, post('/models', {'models': ['model9']}))
+        assert (status, payload['added'], payload['version']) == (200, ['model9'], 2)
+
+        (status, payload), = request(service, pool, post('/bias', {'models': ['model1', 'model9']}))
+        assert status == 200
+        # The input files of model9 are those of model1
+        assert payload['total']['model9'] == pytest.approx(payload['total']['model1'])
+    finally:
+        pool.shutdown()
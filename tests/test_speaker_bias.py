@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from src.speaker_bias import mean_absolute_differences, weighted_quantile
+
+
+def brute_force_differences(samples):
+    differences = np.full((len(samples), len(samples)), np.nan)
+    for i, (rates_i, weights_i) in enumerate(samples):
+        for j, (rates_j, weights_j) in enumerate(samples):
+            if len(rates_i) and len(rates_j):
+                pairwise = np.abs(rates_i[:, np.newaxis] - rates_j[np.newaxis, :])
+                differences[i, j] = weights_i @ pairwise @ weights_j / (weights_i.sum() * weights_j.sum())
+    return differences
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_mean_absolute_differences_equal_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    # Rounded error rates give ties within and between groups, and one group has no speakers
+    samples = [(np.round(rng.random(size), 1), rng.integers(1, 50, size).astype(float))
+               for size in rng.integers(1, 30, 4)] + [(np.empty(0), np.empty(0))]
+
+    differences = mean_absolute_differences(samples)
+
+    assert np.allclose(differences, brute_force_differences(samples), equal_nan=True)
+    assert np.isnan(differences[-1]).all() and np.isnan(differences[:, -1]).all()
+
+
+def test_weighted_quantile_with_equal_weights():
+    values = np.random.default_rng(0).random(25)
+
+    assert weighted_quantile(values, np.ones(25), 0.3) == pytest.approx(np.quantile(values, 0.3, method='hazen'))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from src.performance_records import PerformanceRecords
+from src.weight_optimiser import optimise_weights, project_to_simplex
+
+
+def make_records(models=('model0', 'model1'), empty_models=()):
+    rng = np.random.default_rng(0)
+    performance_differences = {}
+    for model in models:
+        performance_differences[model] = {}
+        for group in ('group0', 'group1', 'group2'):
+            performance_differences[model][group] = [
+                {'BaselineType': 'min', 'SpeakingStyle': 'style0', 'RateType': 'WER',
+                 'PerformanceDiff': rng.random() * 0.1, 'BasePerformance': 0.2 + rng.random() * 0.1,
+                 'BaselinePerformance': 0.2}]
+    for model in empty_models:
+        performance_differences[model] = {}
+    return PerformanceRecords.from_performance_differences(performance_differences)
+
+
+@pytest.mark.parametrize('objective', ['mean', 'minimax'])
+def test_fits_without_results_are_left_out(objective):
+    result = optimise_weights(make_records(empty_models=['model2']), objective=objective, scope='model')
+
+    assert set(result['weights']) == {'model0', 'model1'}
+    assert all(np.isfinite(value) for value in result['objective'].values())
+
+
+def test_unknown_ranking_model():
+    with pytest.raises(ValueError, match='model9'):
+        optimise_weights(make_records(), objective='ranking', target_ranking=['model0', 'model9'])
+
+
+def test_project_to_simplex():
+    lower, upper = np.array([0.1, 0.0, 0.0]), np.array([1.0, 0.5, 1.0])
+    projected = project_to_simplex(np.random.default_rng(0).normal(size=(50, 3)), lower, upper)
+
+    assert np.allclose(projected.sum(axis=1), 1)
+    assert np.all(projected >= lower - 1e-9) and np.all(projected <= upper + 1e-9)